@@ -0,0 +1,198 @@
+"""Load-test a local store_api server with concurrent checkout clients.
+
+Seeds a throwaway database, starts store_api.py on it in a separate
+process and runs keep-alive clients that check out small bills (and,
+with --search-ratio, search the catalog) as fast as the server answers:
+
+    python bench_api.py --clients 16 --duration 10
+
+Reports sustained checkouts/s with p50/p99 latency as seen by clients.
+With --check it only checks that a checkout short of stock is refused
+with 409 and the shortages, and exits non-zero if not.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+from store_engine import StoreEngine
+
+
+def percentile(samples, fraction):
+    """Return the given percentile of samples in milliseconds"""
+    if not samples:
+        return 0.0
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))] * 1000
+
+
+def seed(db_path, medicines):
+    """Create medicines with enough stock in one lot each to never run out"""
+    engine = StoreEngine(db_path)
+    engine.cursor.executemany('''
+        INSERT INTO medicines (name, company, category, purchase_price,
+                             sale_price, quantity, expiry_date)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', ((f"Medicine {i:06d}", "Load Pharma", "Tablet", 1.0, 2.0, 10_000_000, "2030-12-31")
+          for i in range(medicines)))
+    engine.cursor.execute('''
+        INSERT INTO batches (med_id, expiry_date, quantity)
+        SELECT med_id, expiry_date, quantity FROM medicines
+    ''')
+    engine.cursor.execute('''
+        INSERT INTO stock_ledger (med_id, kind, quantity, recorded_at)
+        SELECT med_id, 'opening', quantity, datetime('now', 'localtime') FROM medicines
+    ''')
+    engine.conn.commit()
+    engine.close()
+
+
+async def request(reader, writer, method, path, payload=None):
+    """Send one keep-alive request and return (status, body)"""
+    body = json.dumps(payload).encode() if payload is not None else b''
+    writer.write(f"{method} {path} HTTP/1.1\r\nHost: localhost\r\n"
+                 f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n\r\n".encode() + body)
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b''):
+            break
+        name, _, value = line.decode().partition(':')
+        if name.lower() == 'content-length':
+            length = int(value)
+    return status, await reader.readexactly(length)
+
+
+async def client(port, medicines, deadline, search_ratio, stats, rng):
+    """Check out (or search) until the deadline over one connection"""
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    try:
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            if rng.random() < search_ratio:
+                kind = 'search'
+                status, _ = await request(reader, writer, 'GET',
+                                          f"/medicines?q={rng.randint(0, 999):03d}&limit=10")
+            else:
+                kind = 'checkout'
+                items = [{'med_id': rng.randint(1, medicines), 'quantity': 1}
+                         for _ in range(rng.randint(1, 5))]
+                status, _ = await request(reader, writer, 'POST', '/checkout',
+                                          {'customer': "Load", 'items': items})
+            if status == 200:
+                stats[kind].append(time.perf_counter() - started)
+            else:
+                stats['errors'].append(status)
+    finally:
+        writer.close()
+
+
+async def check_shortage(port, medicines):
+    """Check out more than is in stock; return None if refused as expected, else what went wrong"""
+    wanted = 10 ** 9
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    try:
+        status, body = await request(reader, writer, 'POST', '/checkout',
+                                     {'items': [{'med_id': medicines, 'quantity': wanted}]})
+    finally:
+        writer.close()
+    shortages = json.loads(body).get('shortages') if status == 409 else None
+    if not shortages or shortages[0]['requested'] != wanted:
+        return f"status {status}: {body.decode()}"
+    return None
+
+
+async def run_clients(port, args):
+    stats = {'checkout': [], 'search': [], 'errors': []}
+    deadline = time.perf_counter() + args.duration
+    await asyncio.gather(*(client(port, args.medicines, deadline, args.search_ratio,
+                                  stats, random.Random(args.seed + i))
+                           for i in range(args.clients)))
+    return stats
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_for(port, server, timeout=30):
+    """Wait until the server accepts connections"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            sys.exit("store_api.py exited during startup")
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    sys.exit("store_api.py did not start listening")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--medicines", type=int, default=10_000)
+    parser.add_argument("--readers", type=int, default=4, help="server reader threads")
+    parser.add_argument("--search-ratio", type=float, default=0.0,
+                        help="fraction of requests that search instead of checking out")
+    parser.add_argument("--db", help="database path (default: temporary file)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--check", action="store_true",
+                        help="only check that a checkout short of stock gets 409 with its shortages")
+    args = parser.parse_args()
+
+    tmpdir = None
+    db_path = args.db
+    if not db_path:
+        tmpdir = tempfile.TemporaryDirectory()
+        db_path = os.path.join(tmpdir.name, "bench_api.db")
+        seed(db_path, args.medicines)
+
+    port = free_port()
+    server = subprocess.Popen(
+        [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "store_api.py"),
+         "--db", db_path, "--port", str(port), "--readers", str(args.readers)],
+        stdout=subprocess.DEVNULL)
+    try:
+        wait_for(port, server)
+        if args.check:
+            problem = asyncio.run(check_shortage(port, args.medicines))
+        else:
+            stats = asyncio.run(run_clients(port, args))
+    finally:
+        server.terminate()
+        server.wait()
+        if args.check and tmpdir:
+            tmpdir.cleanup()
+
+    if args.check:
+        print("shortage response:", f"FAIL ({problem})" if problem else "ok")
+        sys.exit(1 if problem else 0)
+
+    print(f"clients={args.clients} readers={args.readers} duration={args.duration:.0f} s")
+    for kind, unit in (('checkout', "checkouts/s"), ('search', "searches/s")):
+        samples = stats[kind]
+        if samples:
+            print(f"{kind:<10} {len(samples) / args.duration:>9.1f} {unit:<12} "
+                  f"p50 {percentile(samples, 0.5):>8.2f} ms   p99 {percentile(samples, 0.99):>8.2f} ms")
+    errors = stats['errors']
+    print(f"errors     {len(errors)}" + (f" (statuses: {sorted(set(errors))})" if errors else ""))
+
+    if tmpdir:
+        tmpdir.cleanup()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,410 @@
+"""Benchmark the headless StoreEngine without a display.
+
+Seeds a throwaway database in the pre-compact layout, converts it (see
+store_compact) and reports throughput and p50/p99 latency for billing,
+search, reporting, CSV export/import, bulk repricing, receipt spooling,
+stock ledger checks and archiving old sales:
+
+    python bench_store.py --medicines 100000 --sales 5000000
+
+With --check-plans it only verifies that no report query falls back to a
+table scan (EXPLAIN QUERY PLAN) and exits non-zero if one does.
+"""
+import argparse
+import collections
+import csv
+import datetime
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+import store_analytics
+from store_archive import archive
+from store_compact import LEGACY_VERSION, compact, file_size
+from store_csv import export_medicines, import_medicines
+from store_engine import StoreEngine
+from store_metrics import METRICS
+from store_receipts import spool_receipts
+
+CATEGORIES = ["Tablet", "Syrup", "Capsule", "Injection", "Ointment", "Drops"]
+COMPANIES = ["Cipla", "Sun Pharma", "Lupin", "Mankind", "Abbott", "Zydus", "Alkem"]
+
+
+def seed(engine, medicines, sales, rng):
+    """Fill a pre-compact (LEGACY_VERSION) database with synthetic medicines, stock lots and sales"""
+    # Each medicine's stock is split over 1-4 lots with different expiries
+    lots = []
+    for med_id in range(1, medicines + 1):
+        for lot in range(rng.randint(1, 4)):
+            expiry = f"{rng.randint(2025, 2030)}-{rng.randint(1, 12):02d}-28"
+            lots.append((med_id, f"L{med_id}-{lot}", expiry, rng.randint(25, 2500)))
+    stock = collections.Counter()
+    earliest = {}
+    for med_id, _, expiry, quantity in lots:
+        stock[med_id] += quantity
+        earliest[med_id] = min(expiry, earliest.get(med_id, expiry))
+
+    engine.cursor.executemany('''
+        INSERT INTO medicines (name, company, category, purchase_price,
+                             sale_price, quantity, expiry_date)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', ((f"Medicine {med_id - 1:06d}", rng.choice(COMPANIES), rng.choice(CATEGORIES),
+           round(rng.uniform(1, 400), 2), round(rng.uniform(2, 500), 2),
+           stock[med_id], earliest[med_id])
+          for med_id in range(1, medicines + 1)))
+    engine.cursor.executemany('''
+        INSERT INTO batches (med_id, batch_no, expiry_date, quantity)
+        VALUES (?, ?, ?, ?)
+    ''', lots)
+    engine.cursor.execute('''
+        INSERT INTO stock_ledger (med_id, kind, quantity, recorded_at)
+        SELECT med_id, 'opening', quantity, '2024-01-01 00:00:00' FROM medicines
+    ''')
+
+    start = datetime.datetime(2024, 1, 1)
+    span = 365 * 2 * 24 * 3600
+
+    def sale_rows():
+        for _ in range(sales):
+            med_id = rng.randint(1, medicines)
+            quantity = rng.randint(1, 5)
+            price = round(rng.uniform(2, 500), 2)
+            sale_date = start + datetime.timedelta(seconds=rng.randrange(span))
+            yield (med_id, f"Medicine {med_id - 1:06d}", quantity, price,
+                   round(price * quantity, 2), sale_date.strftime("%Y-%m-%d %H:%M:%S"))
+
+    engine.cursor.executemany('''
+        INSERT INTO sales (med_id, med_name, quantity, price, total, sale_date)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', sale_rows())
+    # The pre-compact daily rollup, as checkouts would have kept it
+    engine.cursor.execute('''
+        INSERT INTO sales_daily (sale_day, med_id, quantity, revenue, cost)
+        SELECT substr(s.sale_date, 1, 10), s.med_id, SUM(s.quantity), SUM(s.total),
+               SUM(s.quantity * m.purchase_price)
+        FROM sales s JOIN medicines m ON m.med_id = s.med_id
+        GROUP BY 1, 2
+    ''')
+    engine.cursor.execute('''
+        INSERT INTO sales_daily_totals (sale_day, quantity, revenue, cost)
+        SELECT sale_day, SUM(quantity), SUM(revenue), SUM(cost) FROM sales_daily GROUP BY sale_day
+    ''')
+    engine.conn.commit()
+
+
+def measure(name, func, iterations):
+    """Run func repeatedly and print throughput and latency percentiles"""
+    samples = []
+    started = time.perf_counter()
+    for i in range(iterations):
+        t0 = time.perf_counter()
+        func(i)
+        samples.append(time.perf_counter() - t0)
+    elapsed = time.perf_counter() - started
+
+    samples.sort()
+    p50 = statistics.median(samples) * 1000
+    p99 = samples[min(len(samples) - 1, int(len(samples) * 0.99))] * 1000
+    print(f"{name:<24} {iterations / elapsed:>10.1f} ops/s   "
+          f"p50 {p50:>9.3f} ms   p99 {p99:>9.3f} ms")
+
+
+def measure_csv(engine, rows, directory, rng):
+    """Time a full export, a re-import of it and an import of new rows"""
+    exported = os.path.join(directory, "export.csv")
+    t0 = time.perf_counter()
+    count = export_medicines(engine, exported)
+    elapsed = time.perf_counter() - t0
+    print(f"{'csv export':<24} {count / elapsed:>10.0f} rows/s  ({count} rows)")
+
+    t0 = time.perf_counter()
+    result = import_medicines(engine, exported)
+    elapsed = time.perf_counter() - t0
+    print(f"{'csv re-import (update)':<24} {count / elapsed:>10.0f} rows/s  "
+          f"({result.updated} updated, {result.skipped} skipped)")
+
+    new = os.path.join(directory, "new.csv")
+    with open(new, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(["Name", "Company", "Category", "Purchase Price",
+                         "Sale Price", "Quantity", "Expiry Date", "Barcode"])
+        for i in range(rows):
+            price = round(rng.uniform(1, 500), 2)
+            writer.writerow([f"Imported {i:07d}", rng.choice(COMPANIES), rng.choice(CATEGORIES),
+                             price, round(price * 1.2, 2), rng.randint(0, 500),
+                             f"2027-{rng.randint(1, 12):02d}-01", f"IMP{i:09d}"])
+
+    t0 = time.perf_counter()
+    result = import_medicines(engine, new)
+    elapsed = time.perf_counter() - t0
+    print(f"{'csv import (insert)':<24} {rows / elapsed:>10.0f} rows/s  "
+          f"({result.inserted} added, {result.skipped} skipped)")
+
+
+def measure_reprice(engine, medicines, rng):
+    """Time previewing and applying catalog-wide repricing"""
+    def timed(name, func):
+        t0 = time.perf_counter()
+        count = func()
+        if isinstance(count, tuple):
+            count = count[0]
+        elapsed = time.perf_counter() - t0
+        print(f"{name:<24} {elapsed * 1000:>10.1f} ms      ({count} prices)")
+
+    timed("reprice preview (+5%)", lambda: engine.reprice_preview(percent=5))
+    timed("reprice rule (+5%)", lambda: engine.reprice(percent=5, reason="benchmark"))
+    timed("reprice rule (company)", lambda: engine.reprice(company=COMPANIES[0], margin=20))
+    prices = [(med_id, round(rng.uniform(1, 600), 2)) for med_id in range(1, medicines + 1)]
+    timed("reprice price list", lambda: engine.reprice(prices=prices, reason="benchmark"))
+
+
+def measure_analytics(engine, directory, iterations):
+    """Time loading sales into column arrays (cold, then from the cache) and the reports"""
+    if not store_analytics.available():
+        print("analytics                skipped (NumPy not installed)")
+        return
+    cache = os.path.join(directory, "columns")
+    t0 = time.perf_counter()
+    columns = store_analytics.SalesColumns(engine, cache)
+    elapsed = time.perf_counter() - t0
+    print(f"{'analytics cold load':<24} {len(columns) / elapsed:>10.0f} rows/s  "
+          f"({len(columns)} sales in {elapsed:.2f} s)")
+
+    billing_sales = engine.cursor.execute("SELECT COUNT(*) FROM sales").fetchone()[0]
+    t0 = time.perf_counter()
+    columns = store_analytics.SalesColumns(engine, cache)
+    elapsed = time.perf_counter() - t0
+    print(f"{'analytics cached open':<24} {elapsed * 1000:>10.1f} ms      ({len(columns)} of {billing_sales} sales)")
+
+    # Revenue over everything should match the rollup
+    revenue = sum(row[2] for row in columns.margin_by_category())
+    expected = engine.sales_summary()[1]
+    print(f"{'analytics check':<24} {'ok' if abs(revenue - expected) < 0.01 * max(1, expected) else 'MISMATCH':>10}"
+          f"      (revenue {revenue:.2f} vs rollup {expected:.2f})")
+
+    measure("columnar top sellers", lambda i: columns.top_sellers(), iterations)
+    measure("columnar by category", lambda i: columns.margin_by_category(), iterations)
+    measure("columnar hourly curve", lambda i: columns.hourly_curve("2024-06-01", "2025-05-31"), iterations)
+
+
+def measure_ledger(engine, events, medicines):
+    """Grow the stock ledger to events rows, then time checking, snapshotting and rebuilding stock"""
+    def timed(name, func, unit="mismatches"):
+        t0 = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - t0
+        count = len(result) if isinstance(result, list) else result
+        print(f"{name:<24} {elapsed * 1000:>10.1f} ms      ({count} {unit})")
+        return result
+
+    # Alternating +1/-1 pairs per medicine leave every balance unchanged
+    existing = engine.cursor.execute("SELECT COUNT(*) FROM stock_ledger").fetchone()[0]
+    pairs = max(0, events - existing) // 2
+    t0 = time.perf_counter()
+    if pairs:
+        engine.cursor.execute('''
+            WITH RECURSIVE n(i) AS (SELECT 0 UNION ALL SELECT i + 1 FROM n WHERE i + 1 < ?)
+            INSERT INTO stock_ledger (med_id, kind, quantity, recorded_at)
+            SELECT (i / 2) % ? + 1, 'adjustment', 1 - 2 * (i % 2), '2024-06-01 00:00:00' FROM n
+        ''', (pairs * 2, medicines))
+        engine.conn.commit()
+    total = engine.cursor.execute("SELECT COUNT(*) FROM stock_ledger").fetchone()[0]
+    print(f"{'ledger seeded':<24} {total:>10} events in {time.perf_counter() - t0:.1f} s")
+
+    timed("ledger check (full)", lambda: engine.check_stock(deep=True))
+    timed("ledger snapshot (first)", lambda: engine.snapshot_stock()[0], unit="snapshot")
+    for i in range(1000):
+        items = [engine.make_bill_item((i * 7 + j) % medicines + 1, 1) for j in range(3)]
+        engine.generate_bill("Ledger", items)
+    timed("ledger check (snapshot)", engine.check_stock)
+    timed("ledger snapshot (incr.)", lambda: engine.snapshot_stock()[0], unit="snapshot")
+
+    # Stock written around the engine, as after a bad restore or manual edit
+    engine.cursor.execute("UPDATE medicines SET quantity = quantity + 1 WHERE med_id % 1000 = 0")
+    engine.conn.commit()
+    timed("ledger rebuild", engine.rebuild_stock)
+    timed("ledger check (after)", engine.check_stock)
+
+
+def measure_receipts(engine, receipts, directory):
+    """Group seeded sales into bills, then time spooling every receipt to a zip"""
+    engine.cursor.execute('''
+        INSERT INTO bills_data (bill_id, customer_name, total_paise, bill_ts)
+        SELECT (SELECT COALESCE(MAX(bill_id), 0) FROM bills_data) + 1 + (sale_id - 1) / 3,
+               'Customer ' || ((sale_id - 1) / 3), SUM(total_paise), MIN(sale_ts)
+        FROM sales_data WHERE sale_id <= ? AND bill_id IS NULL
+        GROUP BY (sale_id - 1) / 3
+    ''', (receipts * 3,))
+    engine.cursor.execute('''
+        UPDATE sales_data SET bill_id = (SELECT MAX(bill_id) FROM bills_data) - ? + 1 + (sale_id - 1) / 3
+        WHERE sale_id <= ? AND bill_id IS NULL
+    ''', (receipts, receipts * 3))
+    engine.conn.commit()
+
+    for fmt, workers in (('txt', 0), ('txt', None), ('pdf', 0), ('pdf', None)):
+        target = os.path.join(directory, f"receipts_{fmt}_{workers}.zip")
+        t0 = time.perf_counter()
+        count = spool_receipts(engine, target, fmt=fmt, workers=workers)
+        elapsed = time.perf_counter() - t0
+        label = f"receipts {fmt} ({'pool' if workers is None else 'inline'})"
+        print(f"{label:<24} {count / elapsed:>10.0f} receipts/s  "
+              f"({count} in {elapsed:.2f} s, {os.path.getsize(target) // 1024} KiB)")
+
+
+def measure_archive(engine, db_path, directory, iterations):
+    """Archive the seeded years of sales, timing backup and VACUUM before and after, then the reports"""
+    def upkeep(name):
+        target = os.path.join(directory, "backup.db")
+        t0 = time.perf_counter()
+        backup = sqlite3.connect(target)
+        engine.conn.backup(backup)
+        backup.close()
+        backed_up = time.perf_counter() - t0
+        os.remove(target)
+        t0 = time.perf_counter()
+        engine.conn.execute("VACUUM")
+        vacuumed = time.perf_counter() - t0
+        print(f"{name:<24} backup {backed_up * 1000:>9.0f} ms   vacuum {vacuumed * 1000:>9.0f} ms   "
+              f"({file_size(engine.conn, db_path) / 2 ** 20:.0f} MiB)")
+
+    def history():
+        engine.attach_archives()
+        return engine.cursor.execute("SELECT COUNT(*), SUM(total_paise) FROM sales_history").fetchone()
+
+    expected = history()
+    upkeep("upkeep (all history)")
+    archive(db_path)
+    upkeep("upkeep (archived)")
+    found = history()
+    print(f"{'archive check':<24} {'ok' if found == expected else 'MISMATCH':>10}      "
+          f"({found[0]} sales across {len(engine.archive_years)} archives)")
+
+    def week(i):
+        day = datetime.date(2024, 1, 1) + datetime.timedelta(days=i % 700)
+        return day.isoformat(), (day + datetime.timedelta(days=6)).isoformat()
+
+    measure("sales page (newest)", lambda i: engine.sales_page(), iterations)
+    measure("sales page (archived)", lambda i: engine.sales_page(*week(i)), iterations)
+    measure("reporting (archived)", lambda i: engine.filter_sales(*week(i)), max(1, iterations // 10))
+
+
+def print_statements(top):
+    """Print the statements that took the most time overall"""
+    statements = sorted(METRICS.snapshot()['statements'].items(),
+                        key=lambda item: item[1]['total_ms'], reverse=True)
+    print(f"top {top} statements by total time:")
+    for sql, summary in statements[:top]:
+        print(f"  {summary['total_ms']:>10.1f} ms  {summary['count']:>8} x  "
+              f"p50 {summary['p50_ms']:>8.3f}  p99 {summary['p99_ms']:>8.3f} ms  {sql[:70]}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--medicines", type=int, default=100_000)
+    parser.add_argument("--sales", type=int, default=5_000_000)
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--db", help="database path (default: temporary file)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--csv-rows", type=int, default=200_000,
+                        help="new rows written to the CSV import benchmark")
+    parser.add_argument("--receipts", type=int, default=10_000,
+                        help="bills grouped from seeded sales for the receipt spool benchmark")
+    parser.add_argument("--ledger-events", type=int, default=10_000_000,
+                        help="stock ledger size for the check/snapshot/rebuild benchmark")
+    parser.add_argument("--top-statements", type=int, default=10,
+                        help="statements listed by total time at the end")
+    parser.add_argument("--check-plans", action="store_true",
+                        help="only check report query plans for table scans")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    tmpdir = None
+    db_path = args.db
+    if not db_path:
+        tmpdir = tempfile.TemporaryDirectory()
+        db_path = os.path.join(tmpdir.name, "bench_store.db")
+
+    if args.check_plans:
+        engine = StoreEngine(db_path)
+        scans = engine.table_scans()
+        for sql, plan in scans.items():
+            print(f"TABLE SCAN: {' '.join(sql.split())}\n    {plan}")
+        print("report query plans:", "FAIL" if scans else "ok")
+        engine.close()
+        if tmpdir:
+            tmpdir.cleanup()
+        sys.exit(1 if scans else 0)
+
+    # Seeded as an older store would have it, then converted
+    engine = StoreEngine(db_path, schema_version=LEGACY_VERSION)
+    t0 = time.perf_counter()
+    seed(engine, args.medicines, args.sales, rng)
+    print(f"seeded {args.medicines} medicines / "
+          f"{engine.cursor.execute('SELECT COUNT(*) FROM batches').fetchone()[0]} lots / {args.sales} sales "
+          f"in {time.perf_counter() - t0:.1f} s")
+    engine.close()
+    compact(db_path)
+    engine = StoreEngine(db_path)
+
+    def billing(_):
+        items = [engine.make_bill_item(rng.randint(1, args.medicines), 1)
+                 for _ in range(rng.randint(1, 5))]
+        engine.generate_bill("Benchmark", items)
+
+    def search(i):
+        engine.search_medicines(f"{i % 1000:03d}")
+
+    def suggest(i):
+        engine.suggest_medicines(f"Medicine {i % 1000:03d}"[:9 + i % 4])
+
+    def reporting(i):
+        day = datetime.date(2024, 1, 1) + datetime.timedelta(days=i % 700)
+        engine.filter_sales(day.isoformat(), (day + datetime.timedelta(days=6)).isoformat())
+
+    def year(i):
+        day = datetime.date(2024, 1, 1) + datetime.timedelta(days=i % 300)
+        return day.isoformat(), (day + datetime.timedelta(days=365)).isoformat()
+
+    def rollup(i):
+        engine.sales_summary(*year(i))
+        engine.sales_trend(*year(i))
+
+    def top_sellers(i):
+        engine.top_sellers(*year(i))
+
+    measure("billing", billing, args.iterations)
+    # Same workload with statement timing off, to show what instrumentation costs
+    METRICS.enabled = False
+    measure("billing (unmetered)", billing, args.iterations)
+    METRICS.enabled = True
+    measure("search", search, args.iterations)
+    measure("search-as-you-type", suggest, args.iterations)
+    measure("reporting (7 days)", reporting, max(1, args.iterations // 10))
+    measure("totals+trend (1 year)", rollup, args.iterations)
+    measure("top sellers (1 year)", top_sellers, max(1, args.iterations // 10))
+    measure("near expiry (90 days)", lambda i: engine.near_expiry(90 + i % 30), args.iterations)
+    print(f"catalog cache: {engine.catalog.stats()}")
+
+    with tempfile.TemporaryDirectory() as analytics_dir:
+        measure_analytics(engine, analytics_dir, max(1, args.iterations // 10))
+    measure_reprice(engine, args.medicines, rng)
+    with tempfile.TemporaryDirectory() as csv_dir:
+        measure_csv(engine, args.csv_rows, csv_dir, rng)
+    with tempfile.TemporaryDirectory() as receipt_dir:
+        measure_receipts(engine, min(args.receipts, args.sales // 3), receipt_dir)
+    measure_ledger(engine, args.ledger_events, args.medicines)
+    with tempfile.TemporaryDirectory() as archive_dir:
+        measure_archive(engine, db_path, archive_dir, args.iterations)
+    print_statements(args.top_statements)
+
+    engine.close()
+    if tmpdir:
+        tmpdir.cleanup()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""Benchmark syncing a branch's day of sales into a head office database.
+
+Seeds a throwaway branch, syncs its catalog to an empty hub, checks out
+a day's sales on the branch and times the sync that ships them:
+
+    python bench_sync.py --medicines 10000 --sales 50000
+
+Reports rows/s, batches and compressed bytes for each sync, then checks
+that the hub's sales and stock match the branch's.
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from store_engine import StoreEngine
+from store_sync import SyncHub, node_id, sync
+
+
+def seed(engine, medicines):
+    """Create medicines with enough stock in one lot each for the day"""
+    engine.cursor.executemany('''
+        INSERT INTO medicines (name, company, category, purchase_price,
+                             sale_price, quantity, expiry_date)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', ((f"Medicine {i:06d}", "Branch Pharma", "Tablet", 1.0, 2.0, 100_000, "2030-12-31")
+          for i in range(medicines)))
+    engine.cursor.execute('''
+        INSERT INTO batches (med_id, expiry_date, quantity)
+        SELECT med_id, expiry_date, quantity FROM medicines
+    ''')
+    engine.cursor.execute('''
+        INSERT INTO stock_ledger (med_id, kind, quantity, recorded_at)
+        SELECT med_id, 'opening', quantity, datetime('now', 'localtime') FROM medicines
+    ''')
+    engine.conn.commit()
+
+
+def timed_sync(name, engine, hub):
+    t0 = time.perf_counter()
+    result = sync(engine, hub)
+    elapsed = time.perf_counter() - t0
+    rows = result.pushed + result.pulled
+    print(f"{name:<24} {elapsed * 1000:>10.1f} ms   {rows / elapsed if rows else 0:>9.0f} rows/s   "
+          f"{result.batches:>4} batches  {result.sent + result.received:>11,} bytes")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--medicines", type=int, default=10_000)
+    parser.add_argument("--sales", type=int, default=50_000, help="sale lines checked out on the branch")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        branch = StoreEngine(os.path.join(tmpdir, "branch.db"))
+        hub = SyncHub(os.path.join(tmpdir, "hub.db"))
+        seed(branch, args.medicines)
+        timed_sync("initial sync (catalog)", branch, hub)
+        timed_sync("idle sync", branch, hub)
+
+        t0 = time.perf_counter()
+        lines = 0
+        while lines < args.sales:
+            count = min(rng.randint(1, 5), args.sales - lines)
+            med_ids = rng.sample(range(1, args.medicines + 1), count)
+            branch.generate_bill("Branch", [branch.make_bill_item(med_id, rng.randint(1, 3))
+                                            for med_id in med_ids])
+            lines += count
+        print(f"checked out {lines} sale lines in {time.perf_counter() - t0:.1f} s")
+
+        result = timed_sync("day sync (sales)", branch, hub)
+        print(f"  {result.summary()}")
+        timed_sync("idle sync", branch, hub)
+
+        # Head office moves stock out of every 100th medicine while the branch keeps selling
+        origin = node_id(branch)
+        moved = hub.engine.cursor.execute('''
+            SELECT row_id FROM sync_rows WHERE tbl = 'medicines' AND origin = ? AND origin_id % 100 = 0
+        ''', (origin,)).fetchall()
+        for row_id, in moved:
+            hub.engine.adjust_stock(row_id, -5, "transfer")
+        branch.generate_bill("Branch", [branch.make_bill_item(100, 1)])
+        timed_sync("transfer sync", branch, hub)
+
+        hub_sales = hub.engine.cursor.execute("SELECT COUNT(*), SUM(total_paise) FROM sales_data").fetchone()
+        branch_sales = branch.cursor.execute("SELECT COUNT(*), SUM(total_paise) FROM sales_data").fetchone()
+        hub_stock = dict(hub.engine.cursor.execute('''
+            SELECT r.origin_id, m.quantity FROM sync_rows r JOIN medicines m ON m.med_id = r.row_id
+            WHERE r.tbl = 'medicines' AND r.origin = ?
+        ''', (origin,)).fetchall())
+        branch_stock = dict(branch.cursor.execute("SELECT med_id, quantity FROM medicines").fetchall())
+        same = hub_sales == branch_sales and hub_stock == branch_stock
+        print(f"{'hub check':<24} {'ok' if same else 'MISMATCH':>10}      "
+              f"({hub_sales[0]} sales, {len(hub_stock)} medicines; "
+              f"ledger mismatches: hub {len(hub.engine.check_stock())}, branch {len(branch.check_stock())})")
+
+        hub.close()
+        branch.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,295 @@
+"""Columnar sales analytics: top sellers, margin by category, hourly curves.
+
+    python store_analytics.py --db medical_store.db --from 2024-01-01 --to 2024-12-31
+
+Needs NumPy, which the rest of the store does not.
+"""
+import argparse
+import datetime
+import json
+import os
+
+try:
+    import numpy as np
+except ImportError:  # optional: only this module needs it
+    np = None
+
+from store_db import DB_PATH
+from store_engine import StoreEngine, StoreError
+
+CHUNK_SIZE = 100_000
+# Cached sales columns and their dtypes, in query order
+COLUMNS = (
+    ('sale_id', 'int64'),
+    ('med_id', 'int32'),
+    ('quantity', 'int32'),
+    ('total', 'float64'),
+    ('sale_ts', 'int64'),
+)
+DAY = 24 * 60 * 60
+META_FILE = "meta.json"
+
+
+def available() -> bool:
+    """Return True if NumPy is installed"""
+    return np is not None
+
+
+def _epoch_day(value) -> int:
+    """Seconds from 1970-01-01 to the start of an ISO date"""
+    try:
+        day = datetime.date.fromisoformat(value)
+    except ValueError:
+        raise StoreError("Dates must be in YYYY-MM-DD format!")
+    return (day - datetime.date(1970, 1, 1)).days * DAY
+
+
+class SalesColumns:
+    """Sales history as NumPy column arrays, for vectorized group-bys.
+
+    Rows are read from SQLite with fetchmany, chunk_size at a time, in
+    sale_id order, archived sales included (sales_history). With
+    cache_dir set, each column is also appended to a raw <column>.bin
+    file there, and the files are memory-mapped when the cache is next
+    opened. After that only sales past the saved sale_id watermark are
+    read from the database. Sales are only ever appended (the single
+    SQLite writer hands out sale_ids in commit order). If the highest
+    sale_id the database has handed out drops below the watermark, the
+    cache is rebuilt.
+
+    sale_ts is the sale's local wall-clock time as seconds since 1970,
+    counted as if it were UTC (as sales_data stores it), so day and hour
+    buckets are plain integer division. Cost uses each medicine's current
+    purchase price, as the sales_daily rollup does. Reports reflect the
+    last refresh().
+    """
+
+    def __init__(self, engine, cache_dir=None, chunk_size=CHUNK_SIZE):
+        if np is None:
+            raise StoreError("Columnar analytics needs NumPy (pip install numpy)!")
+        self.engine = engine
+        self.cache_dir = cache_dir
+        self.chunk_size = chunk_size
+        self._reset()
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+            self._open_cache()
+        self.refresh()
+
+    def __len__(self):
+        return len(self.columns['sale_id'])
+
+    def _reset(self):
+        self.watermark = 0
+        self.columns = {name: np.empty(0, dtype) for name, dtype in COLUMNS}
+
+    # Loading
+    def _path(self, name):
+        return os.path.join(self.cache_dir, name)
+
+    def _open_cache(self):
+        """Memory-map the cached columns, dropping any tail a crash left unrecorded"""
+        try:
+            with open(self._path(META_FILE)) as f:
+                meta = json.load(f)
+            rows, self.watermark = meta['rows'], meta['watermark']
+        except (OSError, ValueError, KeyError):
+            rows = 0
+        for name, dtype in COLUMNS:
+            path = self._path(name + ".bin")
+            size = rows * np.dtype(dtype).itemsize
+            if not os.path.exists(path) or os.path.getsize(path) < size:
+                # Missing or short column: start the cache again
+                self._clear_cache()
+                return
+            if os.path.getsize(path) > size:
+                os.truncate(path, size)
+        self._map(rows)
+
+    def _map(self, rows):
+        for name, dtype in COLUMNS:
+            self.columns[name] = (np.memmap(self._path(name + ".bin"), dtype=dtype, mode='r', shape=(rows,))
+                                  if rows else np.empty(0, dtype))
+
+    def _clear_cache(self):
+        self._reset()
+        for name, _ in COLUMNS:
+            open(self._path(name + ".bin"), 'wb').close()
+        self._save_meta()
+
+    def _save_meta(self):
+        temp = self._path(META_FILE + ".tmp")
+        with open(temp, 'w') as f:
+            json.dump({'rows': len(self), 'watermark': self.watermark}, f)
+        os.replace(temp, self._path(META_FILE))
+
+    def refresh(self) -> int:
+        """Read sales added since the watermark and the medicine lookups; return rows read"""
+        self.engine.attach_archives()
+        cursor = self.engine.conn.cursor()
+        # Not MAX(sale_id): archiving may have moved every sale out of sales_data
+        highest = cursor.execute(
+            "SELECT COALESCE(MAX(seq), 0) FROM sqlite_sequence WHERE name = 'sales_data'").fetchone()[0]
+        if highest < self.watermark:
+            if self.cache_dir:
+                self._clear_cache()
+            else:
+                self._reset()
+
+        cursor.execute('''
+            SELECT sale_id, COALESCE(med_id, 0), quantity, total_paise / 100.0, sale_ts
+            FROM sales_history WHERE sale_id > ? ORDER BY sale_id
+        ''', (self.watermark,))
+        record = np.dtype(list(COLUMNS))
+        chunks = []
+        read = 0
+        files = {name: open(self._path(name + ".bin"), 'ab') for name, _ in COLUMNS} if self.cache_dir else {}
+        try:
+            while True:
+                rows = cursor.fetchmany(self.chunk_size)
+                if not rows:
+                    break
+                chunk = np.array(rows, dtype=record)
+                if files:
+                    for name, f in files.items():
+                        f.write(chunk[name].tobytes())
+                else:
+                    chunks.append(chunk)
+                read += len(chunk)
+                self.watermark = int(chunk['sale_id'][-1])
+        finally:
+            for f in files.values():
+                f.close()
+
+        if read and files:
+            self._map(len(self) + read)
+            self._save_meta()
+        elif read:
+            for name, _ in COLUMNS:
+                self.columns[name] = np.concatenate([self.columns[name]] + [chunk[name] for chunk in chunks])
+
+        self._load_medicines()
+        return read
+
+    def _load_medicines(self):
+        """Index purchase price and category by med_id"""
+        rows = self.engine.conn.execute(
+            "SELECT med_id, COALESCE(purchase_price, 0), COALESCE(category, '') FROM medicines").fetchall()
+        size = max(int(self.columns['med_id'].max(initial=0)), max((r[0] for r in rows), default=0)) + 1
+        self.purchase_price = np.zeros(size)
+        self.category_of = np.zeros(size, dtype=np.int32)  # 0: unknown medicine
+        self.categories = ["(unknown)"]
+        codes = {}
+        for med_id, price, category in rows:
+            self.purchase_price[med_id] = price
+            code = codes.get(category)
+            if code is None:
+                code = codes[category] = len(self.categories)
+                self.categories.append(category or "(none)")
+            self.category_of[med_id] = code
+
+    # Reports
+    def _select(self, from_date, to_date, *names):
+        """Return the named columns restricted to sales in the date range (inclusive)"""
+        ts = self.columns['sale_ts']
+        mask = None
+        if from_date:
+            mask = ts >= _epoch_day(from_date)
+        if to_date:
+            before = ts < _epoch_day(to_date) + DAY
+            mask = before if mask is None else mask & before
+        if mask is None:
+            return [self.columns[name] for name in names]
+        return [self.columns[name][mask] for name in names]
+
+    def _by_medicine(self, from_date, to_date):
+        med_id, quantity, total = self._select(from_date, to_date, 'med_id', 'quantity', 'total')
+        size = len(self.purchase_price)
+        units = np.bincount(med_id, weights=quantity, minlength=size)
+        revenue = np.bincount(med_id, weights=total, minlength=size)
+        return units, revenue, revenue - units * self.purchase_price
+
+    def top_sellers(self, from_date=None, to_date=None, limit=10, by='revenue') -> list:
+        """Return (med_id, name, quantity, revenue, margin) rows like StoreEngine.top_sellers"""
+        units, revenue, margin = self._by_medicine(from_date, to_date)
+        key = {'quantity': units, 'revenue': revenue, 'margin': margin}.get(by)
+        if key is None:
+            raise StoreError(f"Cannot rank sellers by {by}")
+
+        sold = np.flatnonzero(units)
+        sold = sold[sold > 0]  # med_id 0: sales of deleted medicines
+        if len(sold) > limit:
+            sold = sold[np.argpartition(-key[sold], limit - 1)[:limit]]
+        top = sold[np.lexsort((sold, -key[sold]))]
+        ids = [int(med_id) for med_id in top]
+        names = dict(self.engine.conn.execute(
+            f"SELECT med_id, name FROM medicines WHERE med_id IN ({', '.join('?' * len(ids))})", ids)
+            .fetchall()) if ids else {}
+        return [(med_id, names.get(med_id), int(units[med_id]), float(revenue[med_id]),
+                 float(margin[med_id])) for med_id in ids]
+
+    def margin_by_category(self, from_date=None, to_date=None) -> list:
+        """Return (category, quantity, revenue, cost, margin) rows, highest revenue first"""
+        units, revenue, margin = self._by_medicine(from_date, to_date)
+        count = len(self.categories)
+        units = np.bincount(self.category_of, weights=units, minlength=count)
+        revenue_by = np.bincount(self.category_of, weights=revenue, minlength=count)
+        margin_by = np.bincount(self.category_of, weights=margin, minlength=count)
+        order = np.argsort(-revenue_by, kind='stable')
+        return [(self.categories[i], int(units[i]), float(revenue_by[i]),
+                 float(revenue_by[i] - margin_by[i]), float(margin_by[i]))
+                for i in order if units[i]]
+
+    def hourly_curve(self, from_date=None, to_date=None) -> list:
+        """Return (hour, quantity, revenue) for each hour of the day over the range"""
+        ts, quantity, total = self._select(from_date, to_date, 'sale_ts', 'quantity', 'total')
+        hour = (ts // 3600) % 24
+        units = np.bincount(hour, weights=quantity, minlength=24)
+        revenue = np.bincount(hour, weights=total, minlength=24)
+        return [(h, int(units[h]), float(revenue[h])) for h in range(24)]
+
+    def daily_totals(self, from_date=None, to_date=None) -> list:
+        """Return (day, quantity, revenue) for each day with sales, like StoreEngine.sales_trend"""
+        ts, quantity, total = self._select(from_date, to_date, 'sale_ts', 'quantity', 'total')
+        if not len(ts):
+            return []
+        day = ts // DAY
+        first = int(day.min())
+        day -= first
+        units = np.bincount(day, weights=quantity)
+        revenue = np.bincount(day, weights=total)
+        start = datetime.date(1970, 1, 1) + datetime.timedelta(days=first)
+        return [((start + datetime.timedelta(days=int(d))).isoformat(), int(units[d]), float(revenue[d]))
+                for d in np.flatnonzero(units)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--db", default=DB_PATH,
+                        help="database file (default: $MEDICAL_STORE_DB or medical_store.db)")
+    parser.add_argument("--cache", help="column cache directory (default: <db>_columns)")
+    parser.add_argument("--from", dest="from_date")
+    parser.add_argument("--to", dest="to_date")
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args()
+
+    engine = StoreEngine(args.db)
+    try:
+        columns = SalesColumns(engine, args.cache or os.path.splitext(args.db)[0] + "_columns")
+    except StoreError as e:
+        parser.exit(1, f"{e}\n")
+
+    print(f"{len(columns)} sales up to sale_id {columns.watermark}\n\nTop sellers:")
+    for med_id, name, quantity, revenue, margin in columns.top_sellers(args.from_date, args.to_date, args.top):
+        print(f"  {med_id:>8}  {name or '?':<30} {quantity:>8}  ₹{revenue:>12.2f}  margin ₹{margin:>12.2f}")
+    print("\nMargin by category:")
+    for category, quantity, revenue, cost, margin in columns.margin_by_category(args.from_date, args.to_date):
+        print(f"  {category:<20} {quantity:>10}  ₹{revenue:>14.2f}  margin ₹{margin:>14.2f}")
+    print("\nSales by hour:")
+    for hour, quantity, revenue in columns.hourly_curve(args.from_date, args.to_date):
+        print(f"  {hour:02d}:00  {quantity:>10}  ₹{revenue:>14.2f}")
+    engine.close()
+
+
+if __name__ == "__main__":
+    main()
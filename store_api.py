@@ -0,0 +1,348 @@
+"""Serve the store database as a JSON API for several billing counters.
+
+    python store_api.py --db medical_store.db --port 8080
+
+Endpoints:
+
+    GET  /health
+    GET  /medicines?q=para&limit=20        catalog search (first page by name without q)
+    GET  /medicines/<barcode or id>        stock lookup with open lots
+    POST /checkout                         {"customer": "...", "items": [{"med_id": 1, "quantity": 2}]}
+    GET  /reports/sales?from=2024-01-01&to=2024-01-31&top=10
+    GET  /metrics                          Prometheus text (see store_metrics)
+"""
+import argparse
+import asyncio
+import concurrent.futures
+import datetime
+import http
+import json
+import threading
+import time
+import urllib.parse
+
+from store_db import DB_PATH, ConnectionPool
+from store_engine import PAGE_SIZE, InsufficientStock, StoreEngine, StoreError
+from store_metrics import METRICS
+
+HOST = '127.0.0.1'
+PORT = 8080
+READERS = 4
+# Queued writes the writer task hands to its thread in one hop
+WRITE_BATCH = 64
+MAX_BODY = 1024 * 1024
+MAX_HEADERS = 100
+
+MEDICINE_FIELDS = ('med_id', 'name', 'company', 'category', 'purchase_price',
+                   'sale_price', 'quantity', 'expiry_date')
+
+
+class HTTPError(Exception):
+    """Ends a request with an error status and a JSON {"error": message} body"""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def _medicine(row):
+    return dict(zip(MEDICINE_FIELDS, row))
+
+
+def _int(query, name, default, low=1, high=None):
+    value = query.get(name, default)
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        raise HTTPError(400, f"{name} must be an integer")
+    if high is None and value < low:
+        raise HTTPError(400, f"{name} must be at least {low}")
+    if value < low or (high is not None and value > high):
+        raise HTTPError(400, f"{name} must be between {low} and {high}")
+    return value
+
+
+def _date(query, name):
+    value = query.get(name) or None
+    if value is not None:
+        try:
+            datetime.date.fromisoformat(value)
+        except ValueError:
+            raise HTTPError(400, f"{name} must be a date (YYYY-MM-DD)")
+    return value
+
+
+class StoreAPI:
+    """JSON API over one store database, for several counters billing at once.
+
+    Requests are handled concurrently on one asyncio event loop. Reads run
+    on a pool of reader threads, each with its own tuned connection from a
+    ConnectionPool. Every write goes through a single writer task: writes
+    are queued, and the task hands whatever has queued up (up to
+    WRITE_BATCH) to one writer thread in a single hop. Checkouts therefore
+    never contend for SQLite's write lock or wait on busy_timeout; they
+    queue in memory instead.
+    """
+
+    def __init__(self, db_path=DB_PATH, readers=READERS):
+        self.pool = ConnectionPool(db_path)
+        self._local = threading.local()
+        self.readers = concurrent.futures.ThreadPoolExecutor(readers, thread_name_prefix="store-api-read")
+        self.writer = concurrent.futures.ThreadPoolExecutor(1, thread_name_prefix="store-api-write")
+        self.writes = None  # asyncio.Queue of (func, args, future), made on the loop
+        self.routes = {
+            ('GET', '/health'): self.health,
+            ('GET', '/medicines'): self.search,
+            ('GET', '/medicines/<code>'): self.medicine,
+            ('POST', '/checkout'): self.checkout,
+            ('GET', '/reports/sales'): self.sales_report,
+            ('GET', '/metrics'): self.metrics,
+        }
+
+    # Backends
+    def _engine(self):
+        """Return the calling thread's engine, opening it on first use"""
+        engine = getattr(self._local, 'engine', None)
+        if engine is None:
+            engine = self._local.engine = StoreEngine(self.pool.db_path, conn=self.pool.connection())
+        return engine
+
+    def _call(self, func, args):
+        return func(self._engine(), *args)
+
+    async def read(self, func, *args):
+        """Run func(engine, *args) on a reader thread"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.readers, self._call, func, args)
+
+    async def write(self, func, *args):
+        """Queue func(engine, *args) for the writer and wait for its result"""
+        future = asyncio.get_running_loop().create_future()
+        await self.writes.put((func, args, future))
+        return await future
+
+    async def _write_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            jobs = [await self.writes.get()]
+            while len(jobs) < WRITE_BATCH and not self.writes.empty():
+                jobs.append(self.writes.get_nowait())
+            results = await loop.run_in_executor(self.writer, self._run_writes, jobs)
+            for (_, _, future), (ok, value) in zip(jobs, results):
+                if future.done():
+                    continue  # the client went away
+                if ok:
+                    future.set_result(value)
+                else:
+                    future.set_exception(value)
+
+    def _run_writes(self, jobs):
+        """Writer thread: run each job in turn; one failing does not affect the rest"""
+        engine = self._engine()
+        results = []
+        for func, args, _ in jobs:
+            try:
+                results.append((True, func(engine, *args)))
+            except Exception as e:
+                results.append((False, e))
+        return results
+
+    # Endpoints
+    async def health(self, query, body):
+        return {'ok': True}
+
+    async def search(self, query, body):
+        limit = _int(query, 'limit', 20, high=PAGE_SIZE)
+        term = query.get('q', '').strip()
+        if term:
+            rows = await self.read(lambda engine: engine.search_medicines(term, limit))
+        else:
+            rows = await self.read(lambda engine: engine.medicine_page(limit=limit))
+        return {'medicines': [_medicine(row) for row in rows]}
+
+    async def medicine(self, query, body, code):
+        def lookup(engine):
+            row = engine.lookup_medicine(urllib.parse.unquote(code))
+            return row, engine.medicine_lots(row[0]) if row else []
+
+        row, lots = await self.read(lookup)
+        if row is None:
+            raise HTTPError(404, "Medicine not found!")
+        result = _medicine(row)
+        result['lots'] = [dict(zip(('batch_id', 'batch_no', 'expiry_date', 'quantity'), lot))
+                          for lot in lots]
+        return result
+
+    async def checkout(self, query, body):
+        customer = body.get('customer') or None
+        items = body.get('items')
+        if not isinstance(items, list) or not items:
+            raise HTTPError(400, "items must be a non-empty list")
+
+        # One line per medicine, as the billing screen merges repeated adds
+        quantities = {}
+        for item in items:
+            try:
+                med_id, quantity = int(item['med_id']), int(item['quantity'])
+            except (TypeError, KeyError, ValueError):
+                raise HTTPError(400, "each item needs an integer med_id and quantity")
+            quantities[med_id] = quantities.get(med_id, 0) + quantity
+
+        def bill(engine):
+            # Stock is checked in generate_bill's transaction, so a shortage is a 409 listing every line
+            lines = [engine.make_bill_item(med_id, quantity, stock_check=False)
+                     for med_id, quantity in quantities.items()]
+            bill_id, date = engine.generate_bill(customer, lines)
+            # The stored total, summed in paise, not a float sum of the lines
+            return {'bill_id': bill_id, 'date': date, 'total': engine.bill_total(bill_id), 'items': lines}
+
+        return await self.write(bill)
+
+    async def sales_report(self, query, body):
+        from_date, to_date = _date(query, 'from'), _date(query, 'to')
+        top = _int(query, 'top', 10, high=PAGE_SIZE)
+
+        def report(engine):
+            return (engine.sales_summary(from_date, to_date),
+                    engine.top_sellers(from_date, to_date, limit=top))
+
+        (quantity, revenue, cost, margin), sellers = await self.read(report)
+        return {
+            'from': from_date, 'to': to_date,
+            'quantity': quantity, 'revenue': revenue, 'cost': cost, 'margin': margin,
+            'top_sellers': [dict(zip(('med_id', 'name', 'quantity', 'revenue', 'margin'), row))
+                            for row in sellers],
+        }
+
+    async def metrics(self, query, body):
+        return METRICS.prometheus()
+
+    # HTTP
+    async def dispatch(self, method, target, body):
+        """Route one request and return (status, payload, route)"""
+        url = urllib.parse.urlsplit(target)
+        query = dict(urllib.parse.parse_qsl(url.query))
+        path = url.path.rstrip('/') or '/'
+        args = ()
+        route = (method, path)
+        if path.startswith('/medicines/'):
+            route, args = (method, '/medicines/<code>'), (path[len('/medicines/'):],)
+
+        handler = self.routes.get(route)
+        if handler is None:
+            known = any(p == route[1] for _, p in self.routes)
+            return (405, {'error': "Method not allowed"}, None) if known else (
+                404, {'error': "Not found"}, None)
+        try:
+            if method == 'POST':
+                try:
+                    body = json.loads(body or b'{}')
+                except ValueError:
+                    raise HTTPError(400, "Body must be JSON")
+                if not isinstance(body, dict):
+                    raise HTTPError(400, "Body must be a JSON object")
+            return 200, await handler(query, body, *args), route
+        except HTTPError as e:
+            return e.status, {'error': str(e)}, route
+        except InsufficientStock as e:
+            return 409, {'error': str(e), 'shortages': [
+                {'name': name, 'requested': requested, 'available': available}
+                for name, requested, available in e.shortages]}, route
+        except StoreError as e:
+            return 422, {'error': str(e)}, route
+
+    async def handle(self, reader, writer):
+        """Serve requests on one keep-alive connection"""
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                started = time.perf_counter()
+                try:
+                    method, target, version = line.decode('latin-1').split()
+                    headers = await self._read_headers(reader)
+                    length = int(headers.get('content-length', 0))
+                    if not 0 <= length <= MAX_BODY:
+                        raise ValueError("bad Content-Length")
+                except (ValueError, UnicodeDecodeError):
+                    self._respond(writer, 400, {'error': "Bad request"}, close=True)
+                    break
+                body = await reader.readexactly(length) if length else b''
+
+                try:
+                    status, payload, route = await self.dispatch(method, target, body)
+                except Exception as e:
+                    status, payload, route = 500, {'error': f"Internal error: {e}"}, None
+
+                connection = headers.get('connection', '').lower()
+                close = connection == 'close' or (version == 'HTTP/1.0' and connection != 'keep-alive')
+                self._respond(writer, status, payload, close)
+                await writer.drain()
+                if route:
+                    METRICS.observe_handler(f"api {route[0]} {route[1]}", time.perf_counter() - started)
+                if close:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _read_headers(self, reader):
+        headers = {}
+        for _ in range(MAX_HEADERS):
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                return headers
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        raise ValueError("too many headers")
+
+    def _respond(self, writer, status, payload, close=False):
+        if isinstance(payload, str):
+            body, content_type = payload.encode('utf-8'), 'text/plain; version=0.0.4; charset=utf-8'
+        else:
+            body, content_type = json.dumps(payload).encode('utf-8'), 'application/json'
+        writer.write(
+            f"HTTP/1.1 {status} {http.HTTPStatus(status).phrase}\r\n"
+            f"Content-Type: {content_type}\r\nContent-Length: {len(body)}\r\n"
+            f"Connection: {'close' if close else 'keep-alive'}\r\n\r\n".encode('latin-1') + body)
+
+    async def serve(self, host=HOST, port=PORT, ready=None):
+        """Serve until cancelled; ready(port) is called once listening"""
+        self.writes = asyncio.Queue()
+        write_loop = asyncio.create_task(self._write_loop())
+        server = await asyncio.start_server(self.handle, host, port)
+        if ready:
+            ready(server.sockets[0].getsockname()[1])
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            write_loop.cancel()
+            self.readers.shutdown()
+            self.writer.shutdown()
+            self.pool.close_all()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--db", default=DB_PATH,
+                        help="database file (default: $MEDICAL_STORE_DB or medical_store.db)")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT, help="0 picks a free port")
+    parser.add_argument("--readers", type=int, default=READERS, help="reader threads")
+    args = parser.parse_args()
+
+    # Open (and migrate) the database once before serving
+    StoreEngine(args.db).close()
+    api = StoreAPI(args.db, readers=args.readers)
+    try:
+        asyncio.run(api.serve(args.host, args.port,
+                              ready=lambda port: print(f"serving on http://{args.host}:{port}", flush=True)))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""Move closed months of sales out of the store database into yearly archives.
+
+    python store_archive.py --db medical_store.db --keep-months 3 --vacuum
+
+The GUI archives in the background a batch at a time (see
+StoreEngine.archive_sales). This moves a whole backlog in one go, out of
+hours, and with --vacuum hands the freed pages back to the disk, so
+backups and vacuums of the database stay as quick as its recent months.
+Archives are <db>_sales_<year>.db next to it: copy them along with it.
+"""
+import argparse
+import os
+import time
+
+from store_compact import file_size
+from store_db import DB_PATH
+from store_engine import ARCHIVE_KEEP_MONTHS, StoreEngine, StoreError
+
+# Rows of each table per pass: nothing else is expected to be writing
+BATCH = 100_000
+
+
+def archive(db_path, keep_months=ARCHIVE_KEEP_MONTHS, vacuum=False, batch=BATCH, report=print) -> int:
+    """Archive everything older than keep_months into the yearly files; return the rows moved"""
+    engine = StoreEngine(db_path)
+    try:
+        before = file_size(engine.conn, db_path)
+        t0 = time.perf_counter()
+        moved = 0
+        while True:
+            count = engine.archive_sales(keep_months, batch)
+            if not count:
+                break
+            moved += count
+        report(f"moved {moved} rows in {time.perf_counter() - t0:.1f} s")
+        if vacuum and moved:
+            t0 = time.perf_counter()
+            engine.conn.execute("VACUUM")
+            report(f"vacuumed in {time.perf_counter() - t0:.1f} s")
+
+        for year in engine.attach_archives():
+            path = engine.archive_path(year)
+            sales, bills = engine.conn.execute(f'''
+                SELECT (SELECT COUNT(*) FROM archive_{year}.sales_data),
+                       (SELECT COUNT(*) FROM archive_{year}.bills_data)
+            ''').fetchone()
+            report(f"{os.path.basename(path):<32} {file_size(engine.conn, path) / 2 ** 20:>10.1f} MiB"
+                   f"  {sales:>10} sales {bills:>10} bills")
+        report(f"{os.path.basename(db_path):<32} {file_size(engine.conn, db_path) / 2 ** 20:>10.1f} MiB"
+               f"  (was {before / 2 ** 20:.1f} MiB)")
+    finally:
+        engine.close()
+    return moved
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--db", default=DB_PATH,
+                        help="database file (default: $MEDICAL_STORE_DB or medical_store.db)")
+    parser.add_argument("--keep-months", type=int, default=ARCHIVE_KEEP_MONTHS,
+                        help="months before the current one to keep in the database "
+                             f"(default: {ARCHIVE_KEEP_MONTHS})")
+    parser.add_argument("--vacuum", action="store_true",
+                        help="shrink the database file afterwards (needs as much free disk as the file)")
+    args = parser.parse_args()
+    if args.keep_months < 0:
+        parser.error("--keep-months cannot be negative")
+    try:
+        archive(args.db, args.keep_months, vacuum=args.vacuum)
+    except StoreError as e:
+        parser.exit(1, f"{e}\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+from decimal import Decimal, ROUND_HALF_UP
+
+# Receipt layout shared by the billing screen and the receipt spool
+RULE = "=" * 40 + "\n"
+RECEIPT_HEADER = (RULE + "MEDICAL STORE BILL\n" + RULE
+                  + f"{'Item':<20} {'Qty':<6} {'Price':<8} {'Total':<8}\n" + "-" * 40 + "\n")
+TOTAL_LABEL = f"{'TOTAL AMOUNT:':<32} ₹"
+
+
+def to_paise(amount) -> int:
+    """Convert a rupee amount (float, str or Decimal) to whole paise"""
+    return int((Decimal(str(amount)) * 100).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+
+def format_paise(paise: int) -> str:
+    """Format paise as rupees with two decimals"""
+    sign = "-" if paise < 0 else ""
+    rupees, paise = divmod(abs(paise), 100)
+    return f"{sign}{rupees}.{paise:02d}"
+
+
+def receipt_line(name, quantity, price, total) -> str:
+    """Format one receipt line; price and total are paise"""
+    return f"{name[:20]:<20} {quantity:<6} ₹{format_paise(price):<7} ₹{format_paise(total):<7}\n"
+
+
+class BillLine:
+    """One medicine on a bill; amounts are integer paise"""
+
+    __slots__ = ('med_id', 'name', 'price', 'quantity')
+
+    def __init__(self, med_id, name, price, quantity):
+        self.med_id = med_id
+        self.name = name
+        self.price = price
+        self.quantity = quantity
+
+    @property
+    def total(self):
+        return self.price * self.quantity
+
+
+class Bill:
+    """A bill being built: one line per medicine and a running total in paise.
+
+    Adding a medicine that is already on the bill merges into its line.
+    Every change adjusts the total by the line's difference, so edits cost
+    O(1) however long the bill is, and the total never picks up float
+    rounding error.
+    """
+
+    def __init__(self):
+        self.lines = {}  # med_id -> BillLine, in the order first added
+        self.total = 0
+
+    def __len__(self):
+        return len(self.lines)
+
+    def __iter__(self):
+        return iter(self.lines.values())
+
+    def quantity_of(self, med_id) -> int:
+        """Return the quantity of med_id already on the bill"""
+        line = self.lines.get(med_id)
+        return line.quantity if line else 0
+
+    def add(self, med_id, name, price, quantity) -> BillLine:
+        """Add quantity of a medicine at price (rupees) and return its line"""
+        line = self.lines.get(med_id)
+        if line is None:
+            line = self.lines[med_id] = BillLine(med_id, name, to_paise(price), 0)
+        self.total += line.price * quantity
+        line.quantity += quantity
+        return line
+
+    def set_quantity(self, med_id, quantity) -> BillLine:
+        """Change a line's quantity (0 removes it) and return the line"""
+        if quantity <= 0:
+            return self.remove(med_id)
+        line = self.lines[med_id]
+        self.total += line.price * (quantity - line.quantity)
+        line.quantity = quantity
+        return line
+
+    def remove(self, med_id) -> BillLine:
+        """Take a medicine off the bill and return its old line"""
+        line = self.lines.pop(med_id)
+        self.total -= line.total
+        return line
+
+    def clear(self):
+        """Remove every line"""
+        self.lines.clear()
+        self.total = 0
+
+    @property
+    def total_rupees(self) -> Decimal:
+        return Decimal(self.total) / 100
+
+    def items(self) -> list:
+        """Return the lines as item dicts for StoreEngine.generate_bill"""
+        return [{
+            'med_id': line.med_id,
+            'name': line.name,
+            'price': line.price / 100,
+            'quantity': line.quantity,
+            'total': line.total / 100,
+        } for line in self.lines.values()]
@@ -0,0 +1,194 @@
+class MedicineRecord:
+    """Compact in-memory copy of one medicines row"""
+
+    __slots__ = ('med_id', 'name', 'company', 'category', 'purchase_price',
+                 'sale_price', 'quantity', 'expiry_date', 'reorder_level')
+
+    def __init__(self, med_id, name, company, category, purchase_price,
+                 sale_price, quantity, expiry_date, reorder_level):
+        self.med_id = med_id
+        self.name = name
+        self.company = company
+        self.category = category
+        self.purchase_price = purchase_price
+        self.sale_price = sale_price
+        self.quantity = quantity or 0
+        self.expiry_date = expiry_date
+        self.reorder_level = reorder_level
+
+
+class CatalogCache:
+    """Process-wide write-through cache of the medicines table keyed by med_id.
+
+    The catalog is loaded in one query on first use. The owning engine
+    writes its own changes through (put, set_price, adjust_quantity) after
+    committing them; changes committed by any other connection bump
+    PRAGMA data_version, which invalidates the cache. After that each
+    record is re-read from the database the first time it is looked up
+    (a miss), so busy multi-terminal databases pay one row read per
+    lookup rather than a full reload per foreign commit; only low_stock
+    reloads everything. The ids below their reorder level (the level the
+    low-stock alert triggers use) are tracked as a set so the stock
+    warning never scans the catalog.
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.records = None
+        # med_ids re-read since the last invalidation; None when all are current
+        self.verified = None
+        self.low_ids = set()
+        self.data_version = None
+        # Write-throughs so far; fill() drops records read before the latest one
+        self.writes = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def load(self):
+        """Load every medicine into memory"""
+        self.data_version = self._data_version()
+        self._install(self.read_records())
+
+    def read_records(self) -> dict:
+        """Read every medicine into a {med_id: MedicineRecord} dict"""
+        cursor = self.conn.execute('''
+            SELECT med_id, name, company, category, purchase_price,
+                   sale_price, quantity, expiry_date, reorder_level
+            FROM medicines
+        ''')
+        return {row[0]: MedicineRecord(*row) for row in cursor}
+
+    def fill_token(self):
+        """Return the state fill() needs; take it before reading records elsewhere"""
+        return self._data_version(), self.writes
+
+    def fill(self, token, records) -> bool:
+        """Install records read on another connection after fill_token().
+
+        Lets a worker thread do the initial load. Nothing is installed if
+        the cache has loaded meanwhile or written through (this
+        connection's own commits do not move data_version); commits by
+        other connections since the token invalidate the cache as usual.
+        """
+        data_version, writes = token
+        if self.records is not None or writes != self.writes:
+            return False
+        self.data_version = data_version
+        self._install(records)
+        return True
+
+    def _install(self, records):
+        self.records = records
+        self.verified = None
+        self.low_ids = {med_id for med_id, record in self.records.items()
+                        if record.quantity < record.reorder_level}
+
+    def invalidate(self):
+        """Mark every record stale; each is re-read on its next lookup"""
+        self.writes += 1
+        if self.records is not None:
+            self.verified = set()
+        self.invalidations += 1
+
+    def get(self, med_id):
+        """Return the MedicineRecord for med_id, or None if it does not exist"""
+        self._validate()
+        record = self.records.get(med_id)
+        if record is not None and (self.verified is None or med_id in self.verified):
+            self.hits += 1
+            return record
+
+        self.misses += 1
+        row = self.conn.execute('''
+            SELECT med_id, name, company, category, purchase_price,
+                   sale_price, quantity, expiry_date, reorder_level
+            FROM medicines WHERE med_id = ?
+        ''', (med_id,)).fetchone()
+        if self.verified is not None:
+            self.verified.add(med_id)
+        if row is None:
+            self.records.pop(med_id, None)
+            self.low_ids.discard(med_id)
+            return None
+        return self.put(MedicineRecord(*row))
+
+    def low_stock(self, threshold=None):
+        """Return records below their reorder level (or threshold if given), lowest stock first"""
+        self._validate()
+        if self.verified is not None:
+            self.load()
+        if threshold is None:
+            records = [self.records[med_id] for med_id in self.low_ids]
+        else:
+            records = [r for r in self.records.values() if r.quantity < threshold]
+        records.sort(key=lambda r: (r.quantity, r.med_id))
+        return records
+
+    def stats(self):
+        """Return hit/miss counters and size"""
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'invalidations': self.invalidations,
+            'size': len(self.records) if self.records is not None else 0,
+        }
+
+    # Write-through, called by the engine after it commits
+    def put(self, record):
+        """Add or replace a record"""
+        self.writes += 1
+        if self.records is not None:
+            self.records[record.med_id] = record
+            self._track(record)
+        return record
+
+    def set_price(self, med_id, sale_price):
+        """Record a committed sale price change"""
+        self.writes += 1
+        record = self.records.get(med_id) if self.records is not None else None
+        if record is not None:
+            record.sale_price = sale_price
+
+    def set_expiry(self, med_id, expiry_date):
+        """Record a committed expiry date change"""
+        self.writes += 1
+        record = self.records.get(med_id) if self.records is not None else None
+        if record is not None:
+            record.expiry_date = expiry_date
+
+    def set_reorder_level(self, med_id, level):
+        """Record a committed reorder level change"""
+        self.writes += 1
+        record = self.records.get(med_id) if self.records is not None else None
+        if record is not None:
+            record.reorder_level = level
+            self._track(record)
+
+    def adjust_quantity(self, med_id, delta):
+        """Record a committed stock change"""
+        self.writes += 1
+        record = self.records.get(med_id) if self.records is not None else None
+        if record is not None:
+            record.quantity += delta
+            self._track(record)
+
+    def _track(self, record):
+        """Keep low_ids in step with a record's quantity"""
+        if record.quantity < record.reorder_level:
+            self.low_ids.add(record.med_id)
+        else:
+            self.low_ids.discard(record.med_id)
+
+    def _data_version(self):
+        return self.conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def _validate(self):
+        """Load if never loaded; invalidate if another connection has committed"""
+        if self.records is not None:
+            data_version = self._data_version()
+            if data_version != self.data_version:
+                self.data_version = data_version
+                self.invalidate()
+        if self.records is None:
+            self.load()
@@ -0,0 +1,161 @@
+"""Convert a store database to the compact sales layout and measure it.
+
+    python store_compact.py --db medical_store.db
+
+Migration 12 moves sales and bills into STRICT tables (sales_data,
+bills_data) with money as integer paise and times as integer seconds,
+and leaves sales and bills behind as views in their old shape. Any
+StoreEngine runs it when it next opens the database, but on a store with
+years of sales it rewrites millions of rows: run this first, out of
+hours. It times a few report queries and measures the file, converts,
+VACUUMs the freed pages away and measures again.
+"""
+import argparse
+import calendar
+import datetime
+import os
+import sqlite3
+import statistics
+import time
+
+from store_db import DB_PATH
+from store_engine import COMPACT_TABLES, DAY, SALE_ROWS, SCHEMA_VERSION, StoreEngine, StoreError
+
+# The last schema with REAL money and TEXT times in sales and bills
+LEGACY_VERSION = 11
+REPEAT = 5
+
+# (name, query on the old tables, the same report on the compact ones).
+# Times bind as "YYYY-MM-DD" text before and as seconds after.
+REPORTS = [
+    ("sales page (month)",
+     '''SELECT sale_id, med_name, quantity, price, total, sale_date FROM sales
+        WHERE sale_date >= :month AND sale_date < :end
+        ORDER BY sale_date DESC, sale_id DESC LIMIT 100''',
+     f'''{SALE_ROWS.format(sales='sales_data')} WHERE s.sale_ts >= :month AND s.sale_ts < :end
+        ORDER BY s.sale_ts DESC, s.sale_id DESC LIMIT 100'''),
+    ("sales rows (month)",
+     '''SELECT sale_id, med_name, quantity, price, total, sale_date FROM sales
+        WHERE sale_date >= :month AND sale_date < :end ORDER BY sale_date DESC''',
+     f'''{SALE_ROWS.format(sales='sales_data')} WHERE s.sale_ts >= :month AND s.sale_ts < :end
+        ORDER BY s.sale_ts DESC'''),
+    ("daily totals (year)",
+     '''SELECT substr(sale_date, 1, 10), SUM(quantity), SUM(total) FROM sales
+        WHERE sale_date >= :year AND sale_date < :end GROUP BY 1''',
+     f'''SELECT sale_ts / {DAY}, SUM(quantity), SUM(total_paise) FROM sales_data
+        WHERE sale_ts >= :year AND sale_ts < :end GROUP BY 1'''),
+    ("medicine history",
+     "SELECT sale_date, quantity, total FROM sales WHERE med_id = :med_id ORDER BY sale_date",
+     "SELECT sale_ts, quantity, total_paise FROM sales_data WHERE med_id = :med_id ORDER BY sale_ts"),
+]
+
+
+def file_size(conn, db_path) -> int:
+    """Bytes on disk once the WAL is checkpointed into the database file"""
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    wal = db_path + "-wal"
+    return os.path.getsize(db_path) + (os.path.getsize(wal) if os.path.exists(wal) else 0)
+
+
+def table_sizes(conn) -> dict:
+    """Return {table: bytes} including each table's indexes, under the pre-12 names"""
+    try:
+        rows = conn.execute('''
+            SELECT m.tbl_name, SUM(d.pgsize) FROM dbstat d
+            JOIN sqlite_master m ON m.name = d.name GROUP BY 1
+        ''').fetchall()
+    except sqlite3.OperationalError:
+        return {}  # SQLite built without the dbstat table
+    old_names = {new: old for old, new in COMPACT_TABLES.items()}
+    sizes = {}
+    for table, size in rows:
+        table = old_names.get(table, table)
+        sizes[table] = sizes.get(table, 0) + size
+    return sizes
+
+
+def report_params(conn):
+    """Pick the report ranges from the newest sale (the last 30 and 365 days), or None"""
+    newest, med_id = conn.execute(
+        "SELECT sale_date, med_id FROM sales ORDER BY sale_id DESC LIMIT 1").fetchone() or (None, None)
+    if newest is None:
+        return None
+    end = datetime.date.fromisoformat(newest[:10]) + datetime.timedelta(days=1)
+    return {'end': end, 'month': end - datetime.timedelta(days=30),
+            'year': end - datetime.timedelta(days=365), 'med_id': med_id}
+
+
+def time_reports(conn, params, compact) -> dict:
+    """Return {report: median seconds} over REPEAT runs, after one warm-up"""
+    if params is None:
+        return {}
+    bound = {name: (calendar.timegm(value.timetuple()) if compact else value.isoformat())
+             if isinstance(value, datetime.date) else value
+             for name, value in params.items()}
+    timings = {}
+    for name, legacy, query in REPORTS:
+        sql = query if compact else legacy
+        conn.execute(sql, bound).fetchall()
+        samples = []
+        for _ in range(REPEAT):
+            t0 = time.perf_counter()
+            conn.execute(sql, bound).fetchall()
+            samples.append(time.perf_counter() - t0)
+        timings[name] = statistics.median(samples)
+    return timings
+
+
+def compact(db_path, vacuum=True, report=print):
+    """Convert db_path to the compact layout, reporting size and report timings.
+
+    Returns False if it already was compact.
+    """
+    engine = StoreEngine(db_path, schema_version=LEGACY_VERSION)
+    try:
+        if engine.migrate(LEGACY_VERSION) > LEGACY_VERSION:
+            report(f"{db_path} is already compact (schema {SCHEMA_VERSION})")
+            return False
+        conn = engine.conn
+        params = report_params(conn)
+        before = (file_size(conn, db_path), table_sizes(conn), time_reports(conn, params, compact=False))
+
+        t0 = time.perf_counter()
+        engine.migrate()
+        report(f"converted in {time.perf_counter() - t0:.1f} s")
+        if vacuum:
+            t0 = time.perf_counter()
+            conn.execute("VACUUM")
+            report(f"vacuumed in {time.perf_counter() - t0:.1f} s")
+        after = (file_size(conn, db_path), table_sizes(conn), time_reports(conn, params, compact=True))
+    finally:
+        engine.close()
+
+    def row(name, old, new, unit):
+        change = f"{(new - old) / old:+.0%}" if old else ""
+        report(f"{name:<24} {old:>10.1f} {unit:<3} {new:>10.1f} {unit:<3} {change:>6}")
+
+    report(f"{'':<24} {'before':>14} {'after':>14}")
+    row("file size", before[0] / 2 ** 20, after[0] / 2 ** 20, "MiB")
+    for table in ('sales', 'bills', 'sales_daily', 'sales_daily_totals'):
+        if table in before[1]:
+            row(f"  {table}", before[1][table] / 2 ** 20, after[1].get(table, 0) / 2 ** 20, "MiB")
+    for name in before[2]:
+        row(name, before[2][name] * 1000, after[2][name] * 1000, "ms")
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--db", default=DB_PATH,
+                        help="database file (default: $MEDICAL_STORE_DB or medical_store.db)")
+    parser.add_argument("--no-vacuum", action="store_true",
+                        help="leave the freed pages in the file (VACUUM needs as much free disk as the file)")
+    args = parser.parse_args()
+    try:
+        compact(args.db, vacuum=not args.no_vacuum)
+    except StoreError as e:
+        parser.exit(1, f"{e}\n")
+
+
+if __name__ == "__main__":
+    main()
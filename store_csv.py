@@ -0,0 +1,274 @@
+import csv
+import datetime
+
+CHUNK_SIZE = 5000
+MAX_ERRORS = 1000
+
+# CSV header -> medicines column, in export order
+CSV_COLUMNS = [
+    ("Name", "name"),
+    ("Company", "company"),
+    ("Category", "category"),
+    ("Purchase Price", "purchase_price"),
+    ("Sale Price", "sale_price"),
+    ("Quantity", "quantity"),
+    ("Expiry Date", "expiry_date"),
+    ("Barcode", "barcode"),
+]
+
+
+class ImportResult:
+    """Counts and per-row errors from an import"""
+
+    def __init__(self):
+        self.inserted = 0
+        self.updated = 0
+        self.errors = []  # [(line number, message), ...]
+
+    @property
+    def skipped(self):
+        return len(self.errors)
+
+    def summary(self):
+        text = f"{self.inserted} added, {self.updated} updated, {self.skipped} skipped"
+        if self.errors:
+            text += "\n" + "\n".join(f"Line {line}: {message}" for line, message in self.errors[:10])
+            if len(self.errors) > 10:
+                text += f"\n... and {len(self.errors) - 10} more"
+        return text
+
+
+def export_medicines(engine, filename, progress=None, chunk_size=CHUNK_SIZE):
+    """Stream the medicine list to a CSV file and return the row count.
+
+    Rows are read with fetchmany so memory stays flat; progress(rows) is
+    called after each chunk.
+    """
+    cursor = engine.conn.cursor()
+    cursor.execute(f'''
+        SELECT {", ".join(column for _, column in CSV_COLUMNS)}
+        FROM medicines ORDER BY name
+    ''')
+
+    count = 0
+    with open(filename, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow([header for header, _ in CSV_COLUMNS])
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            writer.writerows(rows)
+            count += len(rows)
+            if progress:
+                progress(count)
+    return count
+
+
+def _text(value):
+    return value.strip() or None
+
+
+def _name(value):
+    value = value.strip()
+    if not value:
+        raise ValueError("Name is required")
+    return value
+
+
+def _price(value):
+    value = value.strip()
+    if not value:
+        return None
+    try:
+        price = float(value)
+    except ValueError:
+        raise ValueError(f"invalid price {value!r}")
+    if price < 0:
+        raise ValueError(f"negative price {value!r}")
+    return price
+
+
+def _quantity(value):
+    value = value.strip()
+    if not value:
+        return None
+    try:
+        quantity = int(value)
+    except ValueError:
+        raise ValueError(f"invalid quantity {value!r}")
+    if quantity < 0:
+        raise ValueError(f"negative quantity {value!r}")
+    return quantity
+
+
+def _expiry(value):
+    value = value.strip()
+    if not value:
+        return None
+    try:
+        return datetime.date.fromisoformat(value).isoformat()
+    except ValueError:
+        raise ValueError(f"invalid expiry date {value!r} (use YYYY-MM-DD)")
+
+
+# medicines column -> converter raising ValueError with a readable message
+PARSERS = {
+    'name': _name,
+    'company': _text,
+    'category': _text,
+    'purchase_price': _price,
+    'sale_price': _price,
+    'quantity': _quantity,
+    'expiry_date': _expiry,
+    'barcode': _text,
+}
+
+
+def import_medicines(engine, filename, progress=None, batch_size=CHUNK_SIZE):
+    """Bulk upsert medicines from a CSV file and return an ImportResult.
+
+    Columns are matched by header name (see CSV_COLUMNS); only the columns
+    present are written, so a price list with just Name, Company and Sale
+    Price reprices existing medicines, and a blank cell leaves a matched
+    medicine's value as it is (a new medicine gets no stock). Sale price
+    changes are recorded in price_history with the reason "import". A row
+    matches an existing medicine by Barcode when it has one, otherwise by
+    Name and Company. Invalid rows
+    are skipped and reported; valid rows are written batch_size at a time,
+    one transaction per batch, and progress(rows read) is called after
+    each batch.
+    """
+    result = ImportResult()
+
+    # Existing keys, kept up to date as batches insert new medicines
+    by_barcode, by_name = {}, {}
+
+    def remember(rows):
+        for med_id, name, company, barcode in rows:
+            if barcode:
+                by_barcode[barcode] = med_id
+            by_name.setdefault((name, company), med_id)
+
+    remember(engine.conn.execute("SELECT med_id, name, company, barcode FROM medicines"))
+
+    with open(filename, newline='', encoding='utf-8-sig') as f:
+        reader = csv.reader(f)
+        header = next(reader, None)
+        if header is None:
+            return result
+
+        known = {name.lower(): column for name, column in CSV_COLUMNS}
+        positions = {}
+        for i, name in enumerate(header):
+            column = known.get(name.strip().lower())
+            if column is not None and column not in positions:
+                positions[column] = i
+        if 'name' not in positions:
+            result.errors.append((1, "Header must include a Name column"))
+            return result
+
+        columns = list(positions)
+        fields = [(positions[column], PARSERS[column]) for column in columns]
+        width = max(positions.values()) + 1
+        name_at = columns.index('name')
+        company_at = columns.index('company') if 'company' in positions else None
+        barcode_at = columns.index('barcode') if 'barcode' in positions else None
+        quantity_at = columns.index('quantity') if 'quantity' in positions else None
+
+        inserts, updates, pending = [], [], set()
+        read = 0
+
+        def flush():
+            if inserts or updates:
+                remember(engine.bulk_upsert_medicines(columns, inserts, updates))
+                result.inserted += len(inserts)
+                result.updated += len(updates)
+                inserts.clear()
+                updates.clear()
+                pending.clear()
+
+        for line, row in enumerate(reader, start=2):
+            read += 1
+            if not row:
+                continue
+            if len(row) < width:
+                row += [""] * (width - len(row))
+            try:
+                values = [parse(row[i]) for i, parse in fields]
+            except ValueError as e:
+                if len(result.errors) < MAX_ERRORS:
+                    result.errors.append((line, str(e)))
+                continue
+
+            barcode = values[barcode_at] if barcode_at is not None else None
+            if barcode:
+                key = barcode
+            else:
+                key = (values[name_at], values[company_at] if company_at is not None else None)
+            med_id = by_barcode.get(key) if barcode else by_name.get(key)
+            # A new medicine is pending by its key, an existing one by its
+            # med_id (a barcode and a name can both reach it). Twice in one
+            # batch: write the first before matching again
+            if (key if med_id is None else med_id) in pending:
+                flush()
+                med_id = by_barcode.get(key) if barcode else by_name.get(key)
+
+            if med_id is None:
+                if quantity_at is not None and values[quantity_at] is None:
+                    values[quantity_at] = 0
+                inserts.append(values)
+            else:
+                values.append(med_id)
+                updates.append(values)
+            pending.add(key if med_id is None else med_id)
+
+            if len(inserts) + len(updates) >= batch_size:
+                flush()
+                if progress:
+                    progress(read)
+
+        flush()
+        if progress:
+            progress(read)
+
+    engine.catalog.invalidate()
+    return result
+
+
+def read_price_list(filename):
+    """Read (med_id, sale price) pairs from a CSV with ID and Sale Price columns.
+
+    Returns (prices, errors) where errors holds (line number, message) for
+    rows that were skipped.
+    """
+    prices, errors = [], []
+    with open(filename, newline='', encoding='utf-8-sig') as f:
+        reader = csv.reader(f)
+        header = [name.strip().lower() for name in next(reader, [])]
+        if 'id' not in header or 'sale price' not in header:
+            return prices, [(1, "Header must include ID and Sale Price columns")]
+        id_at, price_at = header.index('id'), header.index('sale price')
+        width = max(id_at, price_at) + 1
+
+        for line, row in enumerate(reader, start=2):
+            if not row:
+                continue
+            if len(row) < width:
+                errors.append((line, "missing ID or Sale Price"))
+                continue
+            try:
+                med_id = int(row[id_at])
+            except ValueError:
+                errors.append((line, f"invalid ID {row[id_at]!r}"))
+                continue
+            try:
+                price = _price(row[price_at])
+            except ValueError as e:
+                errors.append((line, str(e)))
+                continue
+            if price is None:
+                errors.append((line, "missing Sale Price"))
+                continue
+            prices.append((med_id, price))
+    return prices, errors
@@ -0,0 +1,73 @@
+import os
+import sqlite3
+import threading
+
+from store_metrics import MeteredConnection
+
+DB_PATH = os.environ.get('MEDICAL_STORE_DB', 'medical_store.db')
+
+# Applied to every connection. WAL lets report readers run alongside the
+# billing writer; synchronous=NORMAL is durable across application crashes
+# in WAL mode and only fsyncs at checkpoints. auto_vacuum must come before
+# journal_mode to take on a new file; an existing one switches to it at its
+# next VACUUM (see store_maintenance).
+PRAGMAS = {
+    'auto_vacuum': 'INCREMENTAL',
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000,
+    'cache_size': -32000,
+    'mmap_size': 256 * 1024 * 1024,
+    'temp_store': 'MEMORY',
+}
+
+
+def connect(db_path=DB_PATH, check_same_thread=True, **pragmas):
+    """Open a connection with the store's pragmas (overridable by keyword).
+
+    Every statement run on it is timed into store_metrics.METRICS.
+    """
+    settings = dict(PRAGMAS, **pragmas)
+    conn = sqlite3.connect(db_path, timeout=settings['busy_timeout'] / 1000,
+                           check_same_thread=check_same_thread, factory=MeteredConnection)
+    for name, value in settings.items():
+        if value is not None:
+            conn.execute(f"PRAGMA {name} = {value}")
+    return conn
+
+
+class ConnectionPool:
+    """Hands each thread its own tuned connection to one database"""
+
+    def __init__(self, db_path=DB_PATH, **pragmas):
+        self.db_path = db_path
+        self.pragmas = pragmas
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+
+    def connection(self):
+        """Return the calling thread's connection, opening it on first use"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = connect(self.db_path, check_same_thread=False, **self.pragmas)
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def close(self):
+        """Close the calling thread's connection"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            self._local.conn = None
+            with self._lock:
+                self._connections.remove(conn)
+            conn.close()
+
+    def close_all(self):
+        """Close every connection handed out (call once the threads are done)"""
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            conn.close()
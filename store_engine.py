@@ -0,0 +1,2306 @@
+import calendar
+import heapq
+import itertools
+import json
+import os
+import re
+import shutil
+import sqlite3
+import datetime
+import time
+
+from store_bill import to_paise
+from store_cache import CatalogCache, MedicineRecord
+from store_db import DB_PATH, connect
+
+LOW_STOCK_THRESHOLD = 10
+PAGE_SIZE = 100
+
+# Lots expiring within this many days raise an expiry alert
+EXPIRY_ALERT_DAYS = 30
+# Cleared alerts kept for the alert history
+ALERT_HISTORY = 1000
+
+# Stock ledger event kinds; quantity is the signed change in stock
+LEDGER_KINDS = ('opening', 'sale', 'restock', 'adjustment', 'return')
+# Snapshots kept, and ledger events between automatic snapshots
+STOCK_SNAPSHOTS = 3
+SNAPSHOT_EVENTS = 100_000
+
+# Sales and bills dated before the month this many months before the
+# current one move to yearly archive files, at most ARCHIVE_BATCH rows of
+# each per archiving pass
+ARCHIVE_KEEP_MONTHS = 3
+ARCHIVE_BATCH = 10_000
+
+# Pages copied per online backup step and seconds between steps, and
+# free pages handed back to the filesystem per incremental vacuum step
+BACKUP_PAGES = 1024
+BACKUP_PAUSE = 0.01
+VACUUM_PAGES = 256
+
+# Tables whose changes are logged for branch sync, with their keys
+SYNC_TABLES = {'medicines': 'med_id', 'bills_data': 'bill_id', 'sales_data': 'sale_id'}
+
+DAY = 24 * 60 * 60
+
+MEDICINE_COLUMNS = '''med_id, name, company, category, purchase_price,
+                   sale_price, quantity, expiry_date'''
+
+# Sales and bills in the shape reports return them: rupees and local
+# "YYYY-MM-DD HH:MM:SS" times. {sales} and {bills} name the table read:
+# the hot one, an archive's copy or a history view.
+SALE_ROWS = '''
+    SELECT s.sale_id, COALESCE(s.med_name, m.name), s.quantity, s.price_paise / 100.0,
+           s.total_paise / 100.0, datetime(s.sale_ts, 'unixepoch')
+    FROM {sales} s LEFT JOIN medicines m ON m.med_id = s.med_id'''
+BILL_ROWS = '''
+    SELECT b.bill_id, b.customer_name, b.total_paise / 100.0, datetime(b.bill_ts, 'unixepoch')
+    FROM {bills} b'''
+
+
+SUGGESTION_LIMIT = 10
+
+
+# Keep medicines_fts in step with single-row writes. Bulk writes drop the
+# insert/update triggers for the transaction instead: FTS5 flushes its
+# pending terms at every trigger sub-statement, which makes per-row
+# maintenance several times slower than indexing the batch in one go.
+MEDICINE_FTS_TRIGGERS = {
+    'medicines_fts_insert': '''
+        CREATE TRIGGER medicines_fts_insert AFTER INSERT ON medicines BEGIN
+            INSERT INTO medicines_fts(rowid, name, company, category)
+            VALUES (new.med_id, new.name, new.company, new.category);
+        END
+    ''',
+    'medicines_fts_delete': '''
+        CREATE TRIGGER medicines_fts_delete AFTER DELETE ON medicines BEGIN
+            INSERT INTO medicines_fts(medicines_fts, rowid, name, company, category)
+            VALUES ('delete', old.med_id, old.name, old.company, old.category);
+        END
+    ''',
+    'medicines_fts_update': '''
+        CREATE TRIGGER medicines_fts_update AFTER UPDATE OF name, company, category ON medicines BEGIN
+            INSERT INTO medicines_fts(medicines_fts, rowid, name, company, category)
+            VALUES ('delete', old.med_id, old.name, old.company, old.category);
+            INSERT INTO medicines_fts(rowid, name, company, category)
+            VALUES (new.med_id, new.name, new.company, new.category);
+        END
+    ''',
+}
+FTS_COLUMNS = {'name', 'company', 'category'}
+
+
+def _create_medicine_fts(cursor):
+    """Create the trigram full-text index over medicines, if FTS5 is available"""
+    try:
+        cursor.execute('''
+            CREATE VIRTUAL TABLE medicines_fts USING fts5(
+                name, company, category,
+                content='medicines', content_rowid='med_id',
+                tokenize='trigram'
+            )
+        ''')
+    except sqlite3.OperationalError:
+        # SQLite built without FTS5 (or trigram): searches fall back to LIKE
+        return
+
+    # Name matches outrank company matches, which outrank category matches
+    cursor.execute("INSERT INTO medicines_fts(medicines_fts, rank) VALUES('rank', 'bm25(10.0, 2.0, 1.0)')")
+    cursor.execute("INSERT INTO medicines_fts(medicines_fts) VALUES('rebuild')")
+    for trigger in MEDICINE_FTS_TRIGGERS.values():
+        cursor.execute(trigger)
+
+
+def _epoch(moment) -> int:
+    """Return a local wall-clock time (or date) as seconds since 1970, counted as if it were UTC.
+
+    Sales and bills store their times this way, so datetime(ts, 'unixepoch')
+    gives the local time back and ts // DAY is the local day.
+    """
+    return calendar.timegm(moment.timetuple())
+
+
+def _sale_key(key):
+    """Turn a (sale_date, sale_id) page key into (sale_ts, sale_id)"""
+    if key is None:
+        return None
+    try:
+        return _epoch(datetime.datetime.fromisoformat(key[0])), key[1]
+    except ValueError:
+        raise StoreError("Sale dates must be in YYYY-MM-DD HH:MM:SS format!")
+
+
+def _table_options(*options):
+    """Table options for CREATE TABLE, plus STRICT where SQLite has it (3.37+)"""
+    if sqlite3.sqlite_version_info >= (3, 37, 0):
+        options += ('STRICT',)
+    return ", ".join(options)
+
+
+# Unit cost in paise from a medicine's current purchase price (rupees)
+UNIT_COST = "CAST(round(COALESCE(m.purchase_price, 0) * 100) AS INTEGER)"
+
+
+def _rebuild_sales_daily(cursor):
+    """Recompute the daily rollups from the raw sales rows, archived ones included.
+
+    Reads sales_history (see StoreEngine.attach_archives). Cost uses each
+    medicine's current purchase price, since sales rows do not record
+    what the stock cost.
+    """
+    cursor.execute("DELETE FROM sales_daily")
+    cursor.execute("DELETE FROM sales_daily_totals")
+    cursor.execute(f'''
+        INSERT INTO sales_daily (sale_day, med_id, quantity, revenue_paise, cost_paise)
+        SELECT s.sale_ts / {DAY}, s.med_id, SUM(s.quantity), SUM(s.total_paise),
+               SUM(s.quantity * {UNIT_COST})
+        FROM sales_history s LEFT JOIN medicines m ON m.med_id = s.med_id
+        WHERE s.med_id IS NOT NULL
+        GROUP BY 1, 2
+    ''')
+    cursor.execute('''
+        INSERT INTO sales_daily_totals (sale_day, quantity, revenue_paise, cost_paise)
+        SELECT sale_day, SUM(quantity), SUM(revenue_paise), SUM(cost_paise)
+        FROM sales_daily GROUP BY sale_day
+    ''')
+
+
+def _open_batches(cursor):
+    """Give every medicine in stock one opening lot holding its current quantity"""
+    # Cast: text compares above every number, so a stray '' would pass quantity > 0
+    cursor.execute('''
+        INSERT INTO batches (med_id, batch_no, expiry_date, quantity, cost, received_at)
+        SELECT med_id, 'OPENING', NULLIF(expiry_date, ''), CAST(quantity AS INTEGER),
+               NULLIF(purchase_price, ''), datetime('now', 'localtime')
+        FROM medicines WHERE CAST(quantity AS INTEGER) > 0
+    ''')
+
+
+def _raise_alerts(cursor):
+    """Open alerts for stock that is already low or close to expiry"""
+    cursor.execute('''
+        INSERT OR IGNORE INTO alerts (kind, med_id, raised_at)
+        SELECT 'low_stock', med_id, datetime('now', 'localtime') FROM medicines
+        WHERE CAST(quantity AS INTEGER) < reorder_level
+    ''')
+    # '' sorts before every date: a lot without an expiry date never expires
+    cursor.execute(f'''
+        INSERT OR IGNORE INTO alerts (kind, med_id, batch_id, raised_at)
+        SELECT 'expiry', med_id, batch_id, datetime('now', 'localtime') FROM batches
+        WHERE quantity > 0 AND expiry_date != ''
+          AND expiry_date <= date('now', 'localtime', '+{EXPIRY_ALERT_DAYS} days')
+    ''')
+
+
+def _open_ledger(cursor):
+    """Start the ledger with each medicine's current quantity as its opening balance.
+
+    Fails the migration if any balance then differs from its medicine's
+    stock, so check_stock starts out clean.
+    """
+    # A blank ('') quantity left by the original GUI counts as no stock
+    cursor.execute("UPDATE medicines SET quantity = CAST(quantity AS INTEGER) WHERE typeof(quantity) = 'text'")
+    cursor.execute('''
+        INSERT INTO stock_ledger (med_id, kind, quantity, recorded_at)
+        SELECT med_id, 'opening', CAST(quantity AS INTEGER), datetime('now', 'localtime')
+        FROM medicines WHERE CAST(quantity AS INTEGER) != 0
+        ORDER BY med_id
+    ''')
+    differ = cursor.execute('''
+        SELECT COUNT(*) FROM medicines m
+        WHERE COALESCE(m.quantity, 0) != (SELECT COALESCE(SUM(l.quantity), 0) FROM stock_ledger l
+                                          WHERE l.med_id = m.med_id)
+    ''').fetchone()[0]
+    if differ:
+        raise StoreError(f"{differ} medicines' stock differs from their opening ledger balance")
+
+
+def _sync_trigger(table, key, event):
+    """Log a row change to sync_log, tagged with the node it was synced from.
+
+    Only medicines are relayed between branches, so synced-in sales and
+    bills are not logged again.
+    """
+    source = "(SELECT value FROM sync_state WHERE key = 'source')"
+    when = "" if table == 'medicines' else f" WHEN {source} IS NULL"
+    return f'''
+        CREATE TRIGGER sync_{table}_{event} AFTER {event.upper()} ON {table}{when} BEGIN
+            INSERT INTO sync_log (tbl, row_id, source)
+            VALUES ('{table}', new.{key}, {source});
+        END
+    '''
+
+
+# Old table name -> its compact replacement (migration 12)
+COMPACT_TABLES = {'sales': 'sales_data', 'bills': 'bills_data'}
+
+
+def _carry_sequences(cursor):
+    """Continue each compact table's AUTOINCREMENT sequence from the table it replaces"""
+    for old, new in COMPACT_TABLES.items():
+        cursor.execute("DELETE FROM sqlite_sequence WHERE name = ?", (new,))
+        cursor.execute('''
+            INSERT INTO sqlite_sequence (name, seq) SELECT ?, seq FROM sqlite_sequence WHERE name = ?
+        ''', (new, old))
+
+
+# sales and bills as they looked before migration 12, over the compact
+# tables. Writes through them are converted by INSTEAD OF triggers, so
+# older scripts and ad hoc SQL keep working; the engine uses the tables.
+PAISE = "CAST(round(COALESCE({}, 0) * 100) AS INTEGER)"
+EPOCH = "COALESCE(CAST(strftime('%s', {}) AS INTEGER), CAST(strftime('%s', 'now', 'localtime') AS INTEGER))"
+COMPAT_VIEWS = [
+    '''
+    CREATE VIEW sales AS
+    SELECT s.sale_id, s.med_id, COALESCE(s.med_name, m.name) AS med_name, s.quantity,
+           s.price_paise / 100.0 AS price, s.total_paise / 100.0 AS total,
+           datetime(s.sale_ts, 'unixepoch') AS sale_date, s.bill_id
+    FROM sales_data s LEFT JOIN medicines m ON m.med_id = s.med_id
+    ''',
+    f'''
+    CREATE TRIGGER sales_insert INSTEAD OF INSERT ON sales BEGIN
+        INSERT INTO sales_data (sale_id, bill_id, med_id, quantity, price_paise, total_paise,
+                                sale_ts, med_name)
+        VALUES (new.sale_id, new.bill_id, new.med_id, COALESCE(new.quantity, 0),
+                {PAISE.format('new.price')}, {PAISE.format('new.total')}, {EPOCH.format('new.sale_date')},
+                NULLIF(new.med_name, (SELECT name FROM medicines WHERE med_id = new.med_id)));
+    END
+    ''',
+    f'''
+    CREATE TRIGGER sales_update INSTEAD OF UPDATE ON sales BEGIN
+        UPDATE sales_data SET
+            bill_id = new.bill_id, med_id = new.med_id, quantity = COALESCE(new.quantity, 0),
+            price_paise = {PAISE.format('new.price')}, total_paise = {PAISE.format('new.total')},
+            sale_ts = {EPOCH.format('new.sale_date')},
+            med_name = NULLIF(new.med_name, (SELECT name FROM medicines WHERE med_id = new.med_id))
+        WHERE sale_id = old.sale_id;
+    END
+    ''',
+    '''
+    CREATE TRIGGER sales_delete INSTEAD OF DELETE ON sales BEGIN
+        DELETE FROM sales_data WHERE sale_id = old.sale_id;
+    END
+    ''',
+    '''
+    CREATE VIEW bills AS
+    SELECT bill_id, customer_name, total_paise / 100.0 AS total_amount,
+           datetime(bill_ts, 'unixepoch') AS bill_date
+    FROM bills_data
+    ''',
+    f'''
+    CREATE TRIGGER bills_insert INSTEAD OF INSERT ON bills BEGIN
+        INSERT INTO bills_data (bill_id, customer_name, total_paise, bill_ts)
+        VALUES (new.bill_id, new.customer_name, {PAISE.format('new.total_amount')},
+                {EPOCH.format('new.bill_date')});
+    END
+    ''',
+    f'''
+    CREATE TRIGGER bills_update INSTEAD OF UPDATE ON bills BEGIN
+        UPDATE bills_data SET
+            customer_name = new.customer_name, total_paise = {PAISE.format('new.total_amount')},
+            bill_ts = {EPOCH.format('new.bill_date')}
+        WHERE bill_id = old.bill_id;
+    END
+    ''',
+    '''
+    CREATE TRIGGER bills_delete INSTEAD OF DELETE ON bills BEGIN
+        DELETE FROM bills_data WHERE bill_id = old.bill_id;
+    END
+    ''',
+]
+
+
+# Tables archiving moves out of the hot file, with their key and time
+# columns, and the TEMP views reading each across every archive
+ARCHIVED_TABLES = {'sales_data': ('sale_id', 'sale_ts'), 'bills_data': ('bill_id', 'bill_ts')}
+HISTORY_VIEWS = {'sales_history': 'sales_data', 'bills_history': 'bills_data'}
+
+
+def _unarchived(table, alias):
+    """WHERE clause for an archive's rows that the hot file no longer holds.
+
+    Archiving copies rows before deleting them from the hot table, so
+    until the delete commits (or after a pass was cut short) a row is in
+    both, and the hot copy is the one read.
+    """
+    key = ARCHIVED_TABLES[table][0]
+    return f"NOT EXISTS (SELECT 1 FROM main.{table} h WHERE h.{key} = {alias}.{key})"
+
+
+def _archive_cutoff(today, keep_months):
+    """Return the first day of the month keep_months before today's, in _epoch seconds"""
+    month = today.year * 12 + today.month - 1 - keep_months
+    return _epoch(datetime.date(month // 12, month % 12 + 1, 1))
+
+
+# Versioned schema changes applied on top of the base tables created by
+# init_db. Each entry is (version, description, steps); a step is an SQL
+# string or a callable taking the cursor. PRAGMA user_version records the
+# last version applied.
+MIGRATIONS = [
+    (1, "Report and stock indexes", [
+        # The first versions saved blank entries as '', which sorts after
+        # every number; later migrations seed lots and the ledger from these
+        "UPDATE medicines SET quantity = 0 WHERE quantity IS NULL OR typeof(quantity) = 'text'",
+        "UPDATE medicines SET purchase_price = NULL WHERE typeof(purchase_price) = 'text'",
+        "UPDATE medicines SET sale_price = NULL WHERE typeof(sale_price) = 'text'",
+        "UPDATE medicines SET expiry_date = NULL WHERE expiry_date = ''",
+        "CREATE INDEX IF NOT EXISTS idx_sales_sale_date ON sales(sale_date)",
+        "CREATE INDEX IF NOT EXISTS idx_sales_med_date ON sales(med_id, sale_date)",
+        "CREATE INDEX IF NOT EXISTS idx_medicines_quantity ON medicines(quantity)",
+        "CREATE INDEX IF NOT EXISTS idx_medicines_name ON medicines(name)",
+        "CREATE INDEX IF NOT EXISTS idx_medicines_expiry ON medicines(expiry_date)",
+    ]),
+    (2, "Full-text medicine search", [
+        "CREATE INDEX IF NOT EXISTS idx_medicines_name_nocase ON medicines(name COLLATE NOCASE)",
+        _create_medicine_fts,
+    ]),
+    (3, "Medicine barcodes", [
+        "ALTER TABLE medicines ADD COLUMN barcode TEXT",
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_medicines_barcode ON medicines(barcode)",
+    ]),
+    (4, "Bill line linkage", [
+        "ALTER TABLE sales ADD COLUMN bill_id INTEGER REFERENCES bills(bill_id)",
+        "CREATE INDEX IF NOT EXISTS idx_sales_bill ON sales(bill_id)",
+        '''
+        CREATE TABLE IF NOT EXISTS bill_items (
+            bill_id INTEGER NOT NULL REFERENCES bills(bill_id),
+            sale_id INTEGER NOT NULL REFERENCES sales(sale_id),
+            PRIMARY KEY (bill_id, sale_id)
+        ) WITHOUT ROWID
+        ''',
+    ]),
+    (5, "Daily sales rollup", [
+        '''
+        CREATE TABLE IF NOT EXISTS sales_daily (
+            sale_day TEXT NOT NULL,
+            med_id INTEGER NOT NULL,
+            quantity INTEGER NOT NULL DEFAULT 0,
+            revenue REAL NOT NULL DEFAULT 0,
+            cost REAL NOT NULL DEFAULT 0,
+            margin REAL GENERATED ALWAYS AS (revenue - cost) VIRTUAL,
+            PRIMARY KEY (sale_day, med_id)
+        ) WITHOUT ROWID
+        ''',
+        # One row per day, so totals and trends cost O(days)
+        '''
+        CREATE TABLE IF NOT EXISTS sales_daily_totals (
+            sale_day TEXT PRIMARY KEY,
+            quantity INTEGER NOT NULL DEFAULT 0,
+            revenue REAL NOT NULL DEFAULT 0,
+            cost REAL NOT NULL DEFAULT 0,
+            margin REAL GENERATED ALWAYS AS (revenue - cost) VIRTUAL
+        ) WITHOUT ROWID
+        ''',
+        '''
+        INSERT INTO sales_daily (sale_day, med_id, quantity, revenue, cost)
+        SELECT substr(s.sale_date, 1, 10), s.med_id, SUM(s.quantity), SUM(s.total),
+               SUM(s.quantity * COALESCE(m.purchase_price, 0))
+        FROM sales s LEFT JOIN medicines m ON m.med_id = s.med_id
+        WHERE s.med_id IS NOT NULL
+        GROUP BY 1, 2
+        ''',
+        '''
+        INSERT INTO sales_daily_totals (sale_day, quantity, revenue, cost)
+        SELECT sale_day, SUM(quantity), SUM(revenue), SUM(cost)
+        FROM sales_daily GROUP BY sale_day
+        ''',
+    ]),
+    (6, "Sale price history", [
+        '''
+        CREATE TABLE IF NOT EXISTS price_history (
+            change_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            med_id INTEGER NOT NULL REFERENCES medicines(med_id),
+            old_price REAL,
+            new_price REAL,
+            changed_at TEXT NOT NULL,
+            reason TEXT
+        )
+        ''',
+        "CREATE INDEX IF NOT EXISTS idx_price_history_med ON price_history(med_id, changed_at)",
+    ]),
+    (7, "Stock lots with expiry", [
+        '''
+        CREATE TABLE IF NOT EXISTS batches (
+            batch_id INTEGER PRIMARY KEY,
+            med_id INTEGER NOT NULL REFERENCES medicines(med_id),
+            batch_no TEXT,
+            expiry_date TEXT,
+            quantity INTEGER NOT NULL DEFAULT 0 CHECK (quantity >= 0),
+            cost REAL,
+            received_at TEXT
+        )
+        ''',
+        # Only lots with stock left are ever allocated from or reported on
+        "CREATE INDEX IF NOT EXISTS idx_batches_fefo ON batches(med_id, expiry_date) WHERE quantity > 0",
+        "CREATE INDEX IF NOT EXISTS idx_batches_expiry ON batches(expiry_date) WHERE quantity > 0",
+        _open_batches,
+    ]),
+    # Alerts are raised and cleared by triggers as stock changes, so each
+    # checkout costs one index probe per line instead of a rescan.
+    (8, "Reorder levels and stock alerts", [
+        f"ALTER TABLE medicines ADD COLUMN reorder_level INTEGER NOT NULL DEFAULT {LOW_STOCK_THRESHOLD}",
+        '''
+        CREATE TABLE IF NOT EXISTS alerts (
+            alert_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            med_id INTEGER NOT NULL,
+            batch_id INTEGER NOT NULL DEFAULT 0,
+            raised_at TEXT NOT NULL,
+            cleared_at TEXT
+        )
+        ''',
+        # At most one open alert per medicine (low_stock) or lot (expiry)
+        '''
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_alerts_open
+        ON alerts(kind, med_id, batch_id) WHERE cleared_at IS NULL
+        ''',
+        '''
+        CREATE TRIGGER alerts_new_medicine AFTER INSERT ON medicines
+        WHEN new.quantity < new.reorder_level BEGIN
+            INSERT OR IGNORE INTO alerts (kind, med_id, raised_at)
+            VALUES ('low_stock', new.med_id, datetime('now', 'localtime'));
+        END
+        ''',
+        '''
+        CREATE TRIGGER alerts_low_stock AFTER UPDATE OF quantity, reorder_level ON medicines
+        WHEN new.quantity < new.reorder_level BEGIN
+            INSERT OR IGNORE INTO alerts (kind, med_id, raised_at)
+            VALUES ('low_stock', new.med_id, datetime('now', 'localtime'));
+        END
+        ''',
+        '''
+        CREATE TRIGGER alerts_restocked AFTER UPDATE OF quantity, reorder_level ON medicines
+        WHEN new.quantity >= new.reorder_level AND old.quantity < old.reorder_level BEGIN
+            UPDATE alerts SET cleared_at = datetime('now', 'localtime')
+            WHERE kind = 'low_stock' AND med_id = new.med_id AND batch_id = 0 AND cleared_at IS NULL;
+        END
+        ''',
+        f'''
+        CREATE TRIGGER alerts_expiring AFTER INSERT ON batches
+        WHEN new.quantity > 0
+         AND new.expiry_date <= date('now', 'localtime', '+{EXPIRY_ALERT_DAYS} days') BEGIN
+            INSERT OR IGNORE INTO alerts (kind, med_id, batch_id, raised_at)
+            VALUES ('expiry', new.med_id, new.batch_id, datetime('now', 'localtime'));
+        END
+        ''',
+        '''
+        CREATE TRIGGER alerts_lot_sold_out AFTER UPDATE OF quantity ON batches
+        WHEN new.quantity = 0 AND old.quantity > 0 BEGIN
+            UPDATE alerts SET cleared_at = datetime('now', 'localtime')
+            WHERE kind = 'expiry' AND med_id = new.med_id AND batch_id = new.batch_id
+              AND cleared_at IS NULL;
+        END
+        ''',
+        # Keep the queue bounded: every 100th alert drops old cleared ones
+        f'''
+        CREATE TRIGGER alerts_prune AFTER INSERT ON alerts
+        WHEN new.alert_id % 100 = 0 BEGIN
+            DELETE FROM alerts
+            WHERE alert_id <= new.alert_id - {ALERT_HISTORY} AND cleared_at IS NOT NULL;
+        END
+        ''',
+        _raise_alerts,
+    ]),
+    (9, "Bill date index", [
+        "CREATE INDEX IF NOT EXISTS idx_bills_date ON bills(bill_date)",
+    ]),
+    # Every stock movement is an event in stock_ledger; medicines.quantity
+    # is its running total, written in the same transaction. Snapshots
+    # fold the ledger up to an event so balances only need the tail.
+    (10, "Stock ledger", [
+        f'''
+        CREATE TABLE IF NOT EXISTS stock_ledger (
+            event_id INTEGER PRIMARY KEY,
+            med_id INTEGER NOT NULL,
+            kind TEXT NOT NULL CHECK (kind IN {LEDGER_KINDS}),
+            quantity INTEGER NOT NULL,
+            ref_id INTEGER,
+            note TEXT,
+            recorded_at TEXT NOT NULL
+        )
+        ''',
+        # Covering: balances and history never touch the table rows
+        "CREATE INDEX IF NOT EXISTS idx_stock_ledger_med ON stock_ledger(med_id, event_id, quantity)",
+        '''
+        CREATE TABLE IF NOT EXISTS stock_snapshots (
+            snapshot_id INTEGER PRIMARY KEY,
+            event_id INTEGER NOT NULL,
+            taken_at TEXT NOT NULL
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS stock_snapshot_rows (
+            snapshot_id INTEGER NOT NULL,
+            med_id INTEGER NOT NULL,
+            quantity INTEGER NOT NULL,
+            PRIMARY KEY (snapshot_id, med_id)
+        ) WITHOUT ROWID
+        ''',
+        # Events are never changed, and only deleted once a snapshot holds them
+        '''
+        CREATE TRIGGER stock_ledger_no_update BEFORE UPDATE ON stock_ledger BEGIN
+            SELECT RAISE(ABORT, 'stock_ledger is append-only');
+        END
+        ''',
+        '''
+        CREATE TRIGGER stock_ledger_no_delete BEFORE DELETE ON stock_ledger
+        WHEN old.event_id > (SELECT COALESCE(MAX(event_id), 0) FROM stock_snapshots) BEGIN
+            SELECT RAISE(ABORT, 'stock_ledger events must be snapshotted before pruning');
+        END
+        ''',
+        _open_ledger,
+    ]),
+    # See store_sync. Existing medicines are logged so the first sync
+    # carries the catalog; earlier sales and bills stay local.
+    # AUTOINCREMENT: pushed entries are deleted, and ids must never
+    # fall back below the push cursor.
+    (11, "Branch sync change log", [
+        '''
+        CREATE TABLE IF NOT EXISTS sync_state (
+            key TEXT PRIMARY KEY,
+            value
+        )
+        ''',
+        "INSERT OR IGNORE INTO sync_state (key, value) VALUES ('node_id', lower(hex(randomblob(16))))",
+        '''
+        CREATE TABLE IF NOT EXISTS sync_log (
+            change_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            tbl TEXT NOT NULL,
+            row_id INTEGER NOT NULL,
+            source TEXT
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS sync_rows (
+            tbl TEXT NOT NULL,
+            row_id INTEGER NOT NULL,
+            origin TEXT NOT NULL,
+            origin_id INTEGER NOT NULL,
+            version TEXT NOT NULL,
+            writer TEXT NOT NULL,
+            digest TEXT,
+            stock TEXT,
+            PRIMARY KEY (tbl, row_id)
+        ) WITHOUT ROWID
+        ''',
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_sync_rows_origin ON sync_rows(tbl, origin, origin_id)",
+        *[_sync_trigger(table, key, event)
+          for table, key in (('medicines', 'med_id'), ('bills', 'bill_id'), ('sales', 'sale_id'))
+          for event in ('insert', 'update')],
+        "INSERT INTO sync_log (tbl, row_id) SELECT 'medicines', med_id FROM medicines ORDER BY med_id",
+    ]),
+    # Money as integer paise and times as integer seconds (see _epoch), in
+    # STRICT tables. A sale keeps its medicine's name only if it differs
+    # from the catalog's (renamed or deleted since). sales and bills stay
+    # readable and writable as views (COMPAT_VIEWS). On a large store this
+    # rewrites every sale: see store_compact to run it ahead of time.
+    (12, "Compact sales and bills", [
+        f'''
+        CREATE TABLE bills_data (
+            bill_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            customer_name TEXT,
+            total_paise INTEGER NOT NULL DEFAULT 0,
+            bill_ts INTEGER NOT NULL
+        ) {_table_options()}
+        ''',
+        f'''
+        INSERT INTO bills_data (bill_id, customer_name, total_paise, bill_ts)
+        SELECT bill_id, customer_name, {PAISE.format('total_amount')}, {EPOCH.format('bill_date')}
+        FROM bills ORDER BY bill_id
+        ''',
+        f'''
+        CREATE TABLE sales_data (
+            sale_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            bill_id INTEGER,
+            med_id INTEGER,
+            quantity INTEGER NOT NULL DEFAULT 0,
+            price_paise INTEGER NOT NULL DEFAULT 0,
+            total_paise INTEGER NOT NULL DEFAULT 0,
+            sale_ts INTEGER NOT NULL,
+            med_name TEXT
+        ) {_table_options()}
+        ''',
+        f'''
+        INSERT INTO sales_data (sale_id, bill_id, med_id, quantity, price_paise, total_paise,
+                                sale_ts, med_name)
+        SELECT s.sale_id, s.bill_id, s.med_id, COALESCE(s.quantity, 0), {PAISE.format('s.price')},
+               {PAISE.format('s.total')}, {EPOCH.format('s.sale_date')}, NULLIF(s.med_name, m.name)
+        FROM sales s LEFT JOIN medicines m ON m.med_id = s.med_id
+        ORDER BY s.sale_id
+        ''',
+        _carry_sequences,
+        "DROP TABLE sales",
+        "DROP TABLE bills",
+        "CREATE INDEX idx_sales_ts ON sales_data(sale_ts)",
+        "CREATE INDEX idx_sales_med_ts ON sales_data(med_id, sale_ts)",
+        "CREATE INDEX idx_sales_bill ON sales_data(bill_id)",
+        "CREATE INDEX idx_bills_ts ON bills_data(bill_ts)",
+        *COMPAT_VIEWS,
+        *[_sync_trigger(table, SYNC_TABLES[table], event)
+          for table in COMPACT_TABLES.values() for event in ('insert', 'update')],
+        "UPDATE sync_log SET tbl = tbl || '_data' WHERE tbl IN ('sales', 'bills')",
+        "UPDATE sync_rows SET tbl = tbl || '_data' WHERE tbl IN ('sales', 'bills')",
+        # Days since 1970 and paise, converted row for row: re-aggregating
+        # every sale would take far longer
+        "ALTER TABLE sales_daily RENAME TO sales_daily_real",
+        "ALTER TABLE sales_daily_totals RENAME TO sales_daily_totals_real",
+        f'''
+        CREATE TABLE sales_daily (
+            sale_day INTEGER NOT NULL,
+            med_id INTEGER NOT NULL,
+            quantity INTEGER NOT NULL DEFAULT 0,
+            revenue_paise INTEGER NOT NULL DEFAULT 0,
+            cost_paise INTEGER NOT NULL DEFAULT 0,
+            margin_paise INTEGER GENERATED ALWAYS AS (revenue_paise - cost_paise) VIRTUAL,
+            PRIMARY KEY (sale_day, med_id)
+        ) {_table_options('WITHOUT ROWID')}
+        ''',
+        f'''
+        CREATE TABLE sales_daily_totals (
+            sale_day INTEGER PRIMARY KEY,
+            quantity INTEGER NOT NULL DEFAULT 0,
+            revenue_paise INTEGER NOT NULL DEFAULT 0,
+            cost_paise INTEGER NOT NULL DEFAULT 0,
+            margin_paise INTEGER GENERATED ALWAYS AS (revenue_paise - cost_paise) VIRTUAL
+        ) {_table_options('WITHOUT ROWID')}
+        ''',
+        f'''
+        INSERT INTO sales_daily (sale_day, med_id, quantity, revenue_paise, cost_paise)
+        SELECT CAST(strftime('%s', sale_day) AS INTEGER) / {DAY}, med_id, quantity,
+               {PAISE.format('revenue')}, {PAISE.format('cost')}
+        FROM sales_daily_real ORDER BY sale_day, med_id
+        ''',
+        f'''
+        INSERT INTO sales_daily_totals (sale_day, quantity, revenue_paise, cost_paise)
+        SELECT CAST(strftime('%s', sale_day) AS INTEGER) / {DAY}, quantity,
+               {PAISE.format('revenue')}, {PAISE.format('cost')}
+        FROM sales_daily_totals_real ORDER BY sale_day
+        ''',
+        "DROP TABLE sales_daily_real",
+        "DROP TABLE sales_daily_totals_real",
+    ]),
+    # Yearly files that closed months of sales and bills move to (see
+    # StoreEngine.archive_sales), by file name next to the database
+    (13, "Sales archives", [
+        '''
+        CREATE TABLE IF NOT EXISTS sales_archives (
+            year INTEGER PRIMARY KEY,
+            path TEXT NOT NULL
+        )
+        ''',
+    ]),
+    # add_medicine used to store a blank expiry as '', which sorts before
+    # every date: expiry alerts and reports took such lots as expired
+    (14, "Undated lots", [
+        "UPDATE batches SET expiry_date = NULL WHERE expiry_date = ''",
+        "UPDATE medicines SET expiry_date = NULL WHERE expiry_date = ''",
+        '''
+        UPDATE alerts SET cleared_at = datetime('now', 'localtime')
+        WHERE kind = 'expiry' AND cleared_at IS NULL
+          AND batch_id IN (SELECT batch_id FROM batches WHERE expiry_date IS NULL)
+        ''',
+    ]),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+# Plan lines for a full scan, and for subquery results (which may be scanned)
+PLAN_SCAN = re.compile(r"^SCAN (\w+)$")
+PLAN_SUBQUERY = re.compile(r"^(?:CO-ROUTINE|MATERIALIZE) (\w+)")
+# Tables of a few rows that reports may read whole
+SMALL_TABLES = {'sales_archives'}
+
+
+class StoreError(Exception):
+    """Raised when a store operation cannot be completed"""
+
+
+class InsufficientStock(StoreError):
+    """Raised when checkout finds less stock than a bill needs"""
+
+    def __init__(self, shortages):
+        # shortages: [(name, requested, available), ...]
+        self.shortages = shortages
+        details = ", ".join(f"{name} (requested {requested}, available {available})"
+                            for name, requested, available in shortages)
+        super().__init__(f"Insufficient stock! {details}")
+
+
+class StoreEngine:
+    """Headless inventory and billing service that owns the SQLite connection"""
+
+    def __init__(self, db_path=DB_PATH, conn=None, schema_version=SCHEMA_VERSION):
+        """Open db_path, or wrap conn (e.g. from a ConnectionPool) without owning it.
+
+        schema_version stops the migrations early, for tools that work on
+        an older layout (see store_compact); the engine's own methods
+        need SCHEMA_VERSION.
+        """
+        self.db_path = db_path
+        self.owns_conn = conn is None
+        self.conn = conn or connect(db_path)
+        self.last_lock_wait = 0.0
+        self.last_checkout = 0.0
+        self.init_db(schema_version)
+
+    def init_db(self, schema_version=SCHEMA_VERSION):
+        """Initialize database and create tables"""
+        self.cursor = self.conn.cursor()
+
+        # Create medicines table
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS medicines (
+                med_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT NOT NULL,
+                company TEXT,
+                category TEXT,
+                purchase_price REAL,
+                sale_price REAL,
+                quantity INTEGER,
+                expiry_date TEXT
+            )
+        ''')
+
+        # Create sales table
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS sales (
+                sale_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                med_id INTEGER,
+                med_name TEXT,
+                quantity INTEGER,
+                price REAL,
+                total REAL,
+                sale_date TEXT,
+                FOREIGN KEY (med_id) REFERENCES medicines(med_id)
+            )
+        ''')
+
+        # Create bills table
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS bills (
+                bill_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                customer_name TEXT,
+                total_amount REAL,
+                bill_date TEXT
+            )
+        ''')
+
+        self.conn.commit()
+        self.archive_years = None
+        if self.migrate(schema_version) >= SCHEMA_VERSION:
+            self.attach_archives()
+
+        self.cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'medicines_fts'")
+        self.has_fts = self.cursor.fetchone() is not None
+
+        # Loaded on first lookup; see warm_cache
+        self.catalog = CatalogCache(self.conn)
+
+    def warm_cache(self):
+        """Load the catalog cache now rather than on the first lookup"""
+        self.catalog.load()
+
+    def migrate(self, schema_version=SCHEMA_VERSION):
+        """Apply pending schema migrations up to schema_version and return the version"""
+        version = self.cursor.execute("PRAGMA user_version").fetchone()[0]
+        for target, description, steps in MIGRATIONS:
+            if target <= version or target > schema_version:
+                continue
+
+            # Take the write lock first so concurrent openers migrate once
+            self.cursor.execute("BEGIN IMMEDIATE")
+            try:
+                version = self.cursor.execute("PRAGMA user_version").fetchone()[0]
+                if target <= version:
+                    self.conn.rollback()
+                    continue
+                for step in steps:
+                    if callable(step):
+                        step(self.cursor)
+                    else:
+                        self.cursor.execute(step)
+                self.cursor.execute(f"PRAGMA user_version = {target}")
+                self.conn.commit()
+                version = target
+            except Exception as e:
+                self.conn.rollback()
+                raise StoreError(f"Migration {target} ({description}) failed: {e}") from e
+        return version
+
+    def close(self):
+        """Close database connection, unless it belongs to a pool"""
+        if self.owns_conn:
+            self.conn.close()
+
+    def _keyset_page(self, select, where, params, order, descending=False,
+                     after=None, before=None, limit=PAGE_SIZE):
+        """Fetch one page of rows ordered by the key columns in order.
+
+        after/before are key tuples from a previously fetched row; the page
+        starts right after (or ends right before) that row, so each page costs
+        O(limit) no matter how deep into the table it is.
+        """
+        where = list(where)
+        params = list(params)
+        keys = ", ".join(order)
+        forward = before is None
+        if after is not None or before is not None:
+            op = '>' if forward != descending else '<'
+            where.append(f"({keys}) {op} ({', '.join('?' * len(order))})")
+            params.extend(after if forward else before)
+
+        direction = 'DESC' if descending == forward else 'ASC'
+        query = select
+        if where:
+            query += " WHERE " + " AND ".join(where)
+        query += " ORDER BY " + ", ".join(f"{col} {direction}" for col in order)
+        query += " LIMIT ?"
+        params.append(limit)
+
+        self.cursor.execute(query, params)
+        rows = self.cursor.fetchall()
+        return rows if forward else rows[::-1]
+
+    # Medicines
+    def add_medicine(self, name: str, company: str = None, category: str = None,
+                     purchase_price: float = None, sale_price: float = None,
+                     quantity: int = None, expiry_date: str = None,
+                     barcode: str = None) -> int:
+        """Insert a medicine and return its med_id"""
+        if not name:
+            raise StoreError("Medicine Name is required!")
+        # A blank date means none: '' would sort before every date and sell first
+        expiry_date = expiry_date or None
+
+        try:
+            self.cursor.execute('''
+                INSERT INTO medicines (name, company, category, purchase_price,
+                                     sale_price, quantity, expiry_date, barcode)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (name, company, category, purchase_price, sale_price, quantity,
+                  expiry_date, barcode or None))
+        except sqlite3.IntegrityError:
+            self.conn.rollback()
+            raise StoreError(f"Barcode {barcode} is already assigned to another medicine!")
+        med_id = self.cursor.lastrowid
+        if quantity:
+            self.cursor.execute('''
+                INSERT INTO batches (med_id, expiry_date, quantity, cost, received_at)
+                VALUES (?, ?, ?, ?, datetime('now', 'localtime'))
+            ''', (med_id, expiry_date, quantity, purchase_price))
+            self._record_stock('restock', {med_id: quantity}, ref_id=self.cursor.lastrowid)
+        self.conn.commit()
+
+        self.catalog.put(MedicineRecord(med_id, name, company, category, purchase_price,
+                                        sale_price, quantity, expiry_date, LOW_STOCK_THRESHOLD))
+        return med_id
+
+    def bulk_upsert_medicines(self, columns, inserts, updates) -> list:
+        """Apply many medicine writes in one transaction.
+
+        columns names the medicines columns being written; each insert is a
+        tuple of their values and each update the same followed by the
+        med_id to update. None in an update leaves that column as it is.
+        Sale price changes are logged to price_history with the reason
+        "import". Returns (med_id, name, company, barcode) for the
+        inserted rows. The cache is not written through; callers invalidate
+        it once they are done.
+        """
+        reindex = self.has_fts and (inserts or FTS_COLUMNS & set(columns))
+        placeholders = ", ".join("?" * len(columns))
+        assignments = ", ".join(f"{column} = COALESCE(?, {column})" for column in columns)
+        changed_ids = json.dumps([row[-1] for row in updates])
+        changed_at = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+        try:
+            self.cursor.execute("BEGIN IMMEDIATE")
+            self.cursor.execute("SELECT COALESCE(MAX(med_id), 0) FROM medicines")
+            last_id = self.cursor.fetchone()[0]
+
+            if reindex:
+                self.cursor.execute("DROP TRIGGER medicines_fts_insert")
+                self.cursor.execute("DROP TRIGGER medicines_fts_update")
+                self.cursor.execute('''
+                    INSERT INTO medicines_fts(medicines_fts, rowid, name, company, category)
+                    SELECT 'delete', med_id, name, company, category FROM medicines
+                    WHERE med_id IN (SELECT value FROM json_each(?))
+                ''', (changed_ids,))
+
+            if 'sale_price' in columns:
+                price_at = columns.index('sale_price')
+                self.cursor.executemany('''
+                    INSERT INTO price_history (med_id, old_price, new_price, changed_at, reason)
+                    SELECT med_id, sale_price, ?, ?, 'import' FROM medicines
+                    WHERE med_id = ? AND sale_price IS NOT ?
+                ''', [(row[price_at], changed_at, row[-1], row[price_at])
+                      for row in updates if row[price_at] is not None])
+            self.cursor.executemany(f"UPDATE medicines SET {assignments} WHERE med_id = ?", updates)
+            self.cursor.executemany(
+                f"INSERT INTO medicines ({', '.join(columns)}) VALUES ({placeholders})", inserts)
+
+            if reindex:
+                self.cursor.execute('''
+                    INSERT INTO medicines_fts(rowid, name, company, category)
+                    SELECT med_id, name, company, category FROM medicines
+                    WHERE med_id IN (SELECT value FROM json_each(?)) OR med_id > ?
+                ''', (changed_ids, last_id))
+                self.cursor.execute(MEDICINE_FTS_TRIGGERS['medicines_fts_insert'])
+                self.cursor.execute(MEDICINE_FTS_TRIGGERS['medicines_fts_update'])
+
+            self.cursor.execute('''
+                SELECT med_id, name, company, barcode FROM medicines WHERE med_id > ?
+            ''', (last_id,))
+            added = self.cursor.fetchall()
+            if 'quantity' in columns:
+                self.reconcile_stock([row[-1] for row in updates] + [row[0] for row in added], "import")
+            self.conn.commit()
+        except sqlite3.IntegrityError as e:
+            self.conn.rollback()
+            raise StoreError(f"Import rejected: {e}")
+        except sqlite3.Error:
+            self.conn.rollback()
+            raise
+        return added
+
+    def get_medicine(self, med_id: int) -> MedicineRecord:
+        """Return the cached record for a medicine, or None"""
+        return self.catalog.get(med_id)
+
+    def list_medicines(self) -> list:
+        """Return full medicine rows ordered by name"""
+        self.cursor.execute(f"SELECT {MEDICINE_COLUMNS} FROM medicines ORDER BY name")
+        return self.cursor.fetchall()
+
+    def _fts_query(self, term):
+        """Return an FTS5 MATCH expression for term, or None to fall back to LIKE.
+
+        Every word becomes a quoted substring phrase; the trigram tokenizer
+        cannot match words shorter than three characters, so those are
+        dropped, and a term made only of short words is not searchable.
+        """
+        if not self.has_fts:
+            return None
+        words = [w for w in term.split() if len(w) >= 3]
+        if not words:
+            return None
+        return " ".join('"' + w.replace('"', '""') + '"' for w in words)
+
+    def _search_filter(self, term):
+        """Build WHERE clauses and params matching term in name, company or category"""
+        match = self._fts_query(term)
+        if match:
+            return ["med_id IN (SELECT rowid FROM medicines_fts WHERE medicines_fts MATCH ?)"], [match]
+        like = f"%{term}%"
+        return ["(name LIKE ? OR company LIKE ? OR category LIKE ?)"], [like, like, like]
+
+    def search_medicines(self, term: str, limit: int = None) -> list:
+        """Return medicine rows matching term, best matches first"""
+        if not term:
+            return self.list_medicines()
+
+        limit = -1 if limit is None else limit
+        match = self._fts_query(term)
+        if match:
+            self.cursor.execute(f'''
+                SELECT {MEDICINE_COLUMNS}
+                FROM medicines
+                JOIN (SELECT rowid AS hit, rank AS score FROM medicines_fts
+                      WHERE medicines_fts MATCH ? ORDER BY rank LIMIT ?) ON med_id = hit
+                ORDER BY score
+            ''', (match, limit))
+        else:
+            where, params = self._search_filter(term)
+            self.cursor.execute(f'''
+                SELECT {MEDICINE_COLUMNS}
+                FROM medicines
+                WHERE {where[0]}
+                ORDER BY name LIMIT ?
+            ''', params + [limit])
+        return self.cursor.fetchall()
+
+    def suggest_medicines(self, term: str, limit: int = SUGGESTION_LIMIT,
+                          in_stock: bool = False) -> list:
+        """Return the top matches for search-as-you-type.
+
+        Ranking is tiered rather than scored so every step stops after limit
+        rows: names starting with term (name index), then names containing
+        it, then company/category matches (full-text index). With in_stock
+        only medicines with quantity > 0 are returned.
+        """
+        term = (term or "").strip()
+        if not term:
+            return []
+        stock_filter = " AND quantity > 0" if in_stock else ""
+
+        prefix = term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+        self.cursor.execute(f'''
+            SELECT {MEDICINE_COLUMNS} FROM medicines
+            WHERE name LIKE ? ESCAPE '\\'{stock_filter}
+            ORDER BY name COLLATE NOCASE LIMIT ?
+        ''', (prefix, limit))
+        rows = self.cursor.fetchall()
+
+        match = self._fts_query(term)
+        for expression in ((f"name : ({match})", match) if match else ()):
+            if len(rows) >= limit:
+                break
+            seen = {row[0] for row in rows}
+            # Over-fetch when filtering on stock so out-of-stock hits don't starve the list
+            candidates = (limit + len(seen)) * (5 if in_stock else 1)
+            self.cursor.execute(f'''
+                SELECT {MEDICINE_COLUMNS} FROM medicines
+                WHERE med_id IN (SELECT rowid FROM medicines_fts
+                                 WHERE medicines_fts MATCH ? LIMIT ?){stock_filter}
+            ''', (expression, candidates))
+            rows.extend(row for row in self.cursor.fetchall() if row[0] not in seen)
+
+        return rows[:limit]
+
+    def lookup_medicine(self, code: str):
+        """Return the medicine row for a scanned barcode or typed med_id, or None"""
+        code = (code or "").strip()
+        if not code:
+            return None
+
+        self.cursor.execute(f"SELECT {MEDICINE_COLUMNS} FROM medicines WHERE barcode = ?", (code,))
+        row = self.cursor.fetchone()
+        if row is None and code.isdigit():
+            self.cursor.execute(f"SELECT {MEDICINE_COLUMNS} FROM medicines WHERE med_id = ?",
+                                (int(code),))
+            row = self.cursor.fetchone()
+        return row
+
+    def medicine_page(self, term: str = None, after=None, before=None,
+                      limit: int = PAGE_SIZE) -> list:
+        """Return one page of medicine rows ordered by name, keyed on (name, med_id)"""
+        where, params = self._search_filter(term) if term else ([], [])
+        return self._keyset_page(
+            f"SELECT {MEDICINE_COLUMNS} FROM medicines", where, params,
+            ("name", "med_id"), after=after, before=before, limit=limit)
+
+    def update_rate(self, med_id: int, new_price: float, reason: str = None) -> float:
+        """Set a medicine's sale price and return the old one"""
+        medicine = self.get_medicine(med_id)
+        if not medicine:
+            raise StoreError("Medicine not found!")
+        old_price = medicine.sale_price
+
+        self.cursor.execute("UPDATE medicines SET sale_price = ? WHERE med_id = ?",
+                            (float(new_price), med_id))
+        self.cursor.execute('''
+            INSERT INTO price_history (med_id, old_price, new_price, changed_at, reason)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (med_id, old_price, float(new_price),
+              datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"), reason))
+        self.conn.commit()
+        self.catalog.set_price(med_id, float(new_price))
+        return old_price
+
+    def _reprice_source(self, company=None, category=None, percent=None, margin=None,
+                        prices=None):
+        """Return (SELECT med_id, new_price ..., params) for a repricing rule.
+
+        The rule is either a price list of (med_id, new_price) pairs, or a
+        percentage change to the sale price (percent) or a margin over the
+        purchase price (margin), optionally limited to one company and/or
+        category. A price list is staged in a temp table, so callers must
+        be inside a transaction they commit or roll back.
+        """
+        if prices is not None:
+            try:
+                prices = [(int(med_id), float(price)) for med_id, price in prices]
+            except (TypeError, ValueError):
+                raise StoreError("Price list entries must be a medicine ID and a price!")
+            self.cursor.execute('''
+                CREATE TEMP TABLE IF NOT EXISTS reprice_list (
+                    med_id INTEGER PRIMARY KEY,
+                    new_price REAL NOT NULL
+                )
+            ''')
+            self.cursor.execute("DELETE FROM temp.reprice_list")
+            self.cursor.executemany("INSERT OR REPLACE INTO temp.reprice_list VALUES (?, ?)", prices)
+            return "SELECT med_id, new_price FROM temp.reprice_list", []
+
+        if (percent is None) == (margin is None):
+            raise StoreError("Enter either a percentage change or a margin!")
+        try:
+            factor = 1 + float(percent if percent is not None else margin) / 100
+        except ValueError:
+            raise StoreError("Please enter a valid percentage!")
+        if factor <= 0:
+            raise StoreError("Prices cannot drop by 100% or more!")
+
+        base = "sale_price" if percent is not None else "purchase_price"
+        conditions, params = [f"{base} IS NOT NULL"], [factor]
+        if company:
+            conditions.append("company = ?")
+            params.append(company)
+        if category:
+            conditions.append("category = ?")
+            params.append(category)
+        return (f"SELECT med_id, ROUND({base} * ?, 2) AS new_price FROM medicines "
+                f"WHERE {' AND '.join(conditions)}"), params
+
+    def reprice_preview(self, company=None, category=None, percent=None, margin=None,
+                        prices=None, limit: int = PAGE_SIZE):
+        """Return (number of prices that would change, first rows) for a rule.
+
+        Rows are (med_id, name, old price, new price) ordered by name; see
+        _reprice_source for the rule arguments.
+        """
+        try:
+            source, params = self._reprice_source(company, category, percent, margin, prices)
+            changes = f'''
+                SELECT m.med_id, m.name, m.sale_price, r.new_price
+                FROM ({source}) r JOIN medicines m ON m.med_id = r.med_id
+                WHERE m.sale_price IS NOT r.new_price
+            '''
+            self.cursor.execute(f"SELECT COUNT(*) FROM ({changes})", params)
+            count = self.cursor.fetchone()[0]
+            self.cursor.execute(f"{changes} ORDER BY m.name, m.med_id LIMIT ?", params + [limit])
+            rows = self.cursor.fetchall()
+        finally:
+            self.conn.rollback()
+        return count, rows
+
+    def reprice(self, company=None, category=None, percent=None, margin=None,
+                prices=None, reason: str = None) -> int:
+        """Apply a repricing rule in one transaction and return the number changed.
+
+        Each change is first written to price_history; medicines is then
+        updated from those rows in a single set-based UPDATE.
+        """
+        changed_at = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        try:
+            self.cursor.execute("BEGIN IMMEDIATE")
+            self.cursor.execute("SELECT COALESCE(MAX(change_id), 0) FROM price_history")
+            last_change = self.cursor.fetchone()[0]
+
+            source, params = self._reprice_source(company, category, percent, margin, prices)
+            self.cursor.execute(f'''
+                INSERT INTO price_history (med_id, old_price, new_price, changed_at, reason)
+                SELECT m.med_id, m.sale_price, r.new_price, ?, ?
+                FROM ({source}) r JOIN medicines m ON m.med_id = r.med_id
+                WHERE m.sale_price IS NOT r.new_price
+            ''', [changed_at, reason] + params)
+            changed = self.cursor.rowcount
+
+            self.cursor.execute('''
+                UPDATE medicines SET sale_price = h.new_price
+                FROM price_history h
+                WHERE h.change_id > ? AND h.med_id = medicines.med_id
+            ''', (last_change,))
+            self.conn.commit()
+        except StoreError:
+            self.conn.rollback()
+            raise
+        except sqlite3.Error as e:
+            self.conn.rollback()
+            raise StoreError(f"Repricing failed: {e}")
+
+        if changed:
+            self.catalog.invalidate()
+        return changed
+
+    def price_changes(self, med_id: int, limit: int = 10) -> list:
+        """Return a medicine's latest (changed_at, old_price, new_price, reason) rows"""
+        self.cursor.execute('''
+            SELECT changed_at, old_price, new_price, reason FROM price_history
+            WHERE med_id = ? ORDER BY changed_at DESC, change_id DESC LIMIT ?
+        ''', (med_id, limit))
+        return self.cursor.fetchall()
+
+    # Stock
+    def stock_page(self, after=None, before=None, limit: int = PAGE_SIZE) -> list:
+        """Return one page of stock rows, keyed on (quantity, med_id)"""
+        return self._keyset_page(
+            "SELECT med_id, name, company, category, quantity, expiry_date FROM medicines",
+            [], [], ("quantity", "med_id"), after=after, before=before, limit=limit)
+
+    def receive_stock(self, med_id: int, quantity: int, expiry_date: str = None,
+                      batch_no: str = None, cost: float = None) -> int:
+        """Add a lot of stock for a medicine and return its batch_id"""
+        if not self.get_medicine(med_id):
+            raise StoreError("Medicine not found!")
+        if quantity <= 0:
+            raise StoreError("Please enter a valid quantity!")
+        if expiry_date:
+            try:
+                datetime.date.fromisoformat(expiry_date)
+            except ValueError:
+                raise StoreError("Dates must be in YYYY-MM-DD format!")
+
+        try:
+            self.cursor.execute("BEGIN IMMEDIATE")
+            self.cursor.execute('''
+                INSERT INTO batches (med_id, batch_no, expiry_date, quantity, cost, received_at)
+                VALUES (?, ?, ?, ?, ?, datetime('now', 'localtime'))
+            ''', (med_id, batch_no or None, expiry_date or None, quantity, cost))
+            batch_id = self.cursor.lastrowid
+            self.cursor.execute("UPDATE medicines SET quantity = quantity + ? WHERE med_id = ?",
+                                (quantity, med_id))
+            self._record_stock('restock', {med_id: quantity}, ref_id=batch_id)
+            expiries = self._refresh_expiry([med_id])
+            self.conn.commit()
+        except sqlite3.Error as e:
+            self.conn.rollback()
+            raise StoreError(f"Failed to receive stock: {e}") from e
+
+        self.catalog.adjust_quantity(med_id, quantity)
+        for changed_id, expiry in expiries:
+            self.catalog.set_expiry(changed_id, expiry)
+        return batch_id
+
+    def _take_from_lots(self, needed):
+        """Draw {med_id: quantity} from lots, first expiry first out.
+
+        One set-based UPDATE: a running total over each medicine's
+        non-empty lots (idx_batches_fefo), in expiry order with undated lots
+        last, decides how much every lot gives. Stock not held in any lot is
+        left alone. Call inside the caller's transaction.
+        """
+        values = ", ".join(["(?, ?)"] * len(needed))
+        params = [value for pair in needed.items() for value in pair]
+        self.cursor.execute(f'''
+            WITH need(med_id, quantity) AS (VALUES {values}),
+            lots AS (
+                SELECT b.batch_id, b.quantity, n.quantity AS wanted,
+                       SUM(b.quantity) OVER (
+                           PARTITION BY b.med_id
+                           ORDER BY b.expiry_date IS NULL, b.expiry_date, b.batch_id
+                       ) - b.quantity AS taken_before
+                FROM need n JOIN batches b ON b.med_id = n.med_id AND b.quantity > 0
+            )
+            UPDATE batches SET quantity = batches.quantity - MIN(lots.quantity, lots.wanted - lots.taken_before)
+            FROM lots
+            WHERE batches.batch_id = lots.batch_id AND lots.taken_before < lots.wanted
+        ''', params)
+
+    def _refresh_expiry(self, med_ids):
+        """Set each medicine's expiry_date to its earliest non-empty lot.
+
+        Returns the (med_id, expiry_date) pairs that changed. Medicines with
+        no stocked lot keep the date they had.
+        """
+        placeholders = ", ".join("?" * len(med_ids))
+        self.cursor.execute(f'''
+            UPDATE medicines SET expiry_date = lot.expiry_date
+            FROM (
+                SELECT med_id, MIN(expiry_date) AS expiry_date FROM batches
+                WHERE med_id IN ({placeholders}) AND quantity > 0
+                GROUP BY med_id
+            ) lot
+            WHERE medicines.med_id = lot.med_id
+              AND lot.expiry_date IS NOT NULL
+              AND medicines.expiry_date IS NOT lot.expiry_date
+            RETURNING medicines.med_id, medicines.expiry_date
+        ''', list(med_ids))
+        return self.cursor.fetchall()
+
+    def _reconcile_lots(self, med_ids):
+        """Make lots add up to medicines.quantity after it was set directly.
+
+        A surplus becomes a new lot dated with the medicine's expiry_date;
+        a deficit is drawn from the lots first expiry first out.
+        """
+        if not med_ids:
+            return
+        ids = json.dumps(med_ids)
+        self.cursor.execute('''
+            SELECT m.med_id, m.quantity - COALESCE(SUM(b.quantity), 0)
+            FROM medicines m LEFT JOIN batches b ON b.med_id = m.med_id AND b.quantity > 0
+            WHERE m.med_id IN (SELECT value FROM json_each(?))
+            GROUP BY m.med_id
+            HAVING m.quantity IS NOT COALESCE(SUM(b.quantity), 0)
+        ''', (ids,))
+        differences = self.cursor.fetchall()
+        surplus = [(difference, med_id) for med_id, difference in differences if difference > 0]
+        deficit = {med_id: -difference for med_id, difference in differences if difference < 0}
+
+        self.cursor.executemany('''
+            INSERT INTO batches (med_id, expiry_date, quantity, cost, received_at)
+            SELECT med_id, expiry_date, ?, purchase_price, datetime('now', 'localtime')
+            FROM medicines WHERE med_id = ?
+        ''', surplus)
+        if deficit:
+            self._take_from_lots(deficit)
+
+    def medicine_lots(self, med_id: int) -> list:
+        """Return a medicine's stocked lots as (batch_id, batch_no, expiry_date, quantity), FEFO order"""
+        self.cursor.execute('''
+            SELECT batch_id, batch_no, expiry_date, quantity FROM batches
+            WHERE med_id = ? AND quantity > 0
+            ORDER BY expiry_date, batch_id
+        ''', (med_id,))
+        lots = self.cursor.fetchall()
+        # idx_batches_fefo gives NULL first, but undated lots are sold last
+        return [lot for lot in lots if lot[2] is not None] + [lot for lot in lots if lot[2] is None]
+
+    def adjust_stock(self, med_id: int, change: int, reason: str = None):
+        """Correct a medicine's stock by change units (a count, breakage) and journal it"""
+        self._move_stock('adjustment', med_id, change, note=reason)
+
+    def return_stock(self, med_id: int, quantity: int, bill_id: int = None):
+        """Put returned units back into stock, journalled against the bill they were sold on"""
+        if quantity <= 0:
+            raise StoreError("Please enter a valid quantity!")
+        self._move_stock('return', med_id, quantity, ref_id=bill_id)
+
+    def _move_stock(self, kind, med_id, change, ref_id=None, note=None):
+        if not self.get_medicine(med_id):
+            raise StoreError("Medicine not found!")
+        if not change:
+            raise StoreError("Please enter a valid quantity!")
+
+        try:
+            self.cursor.execute("BEGIN IMMEDIATE")
+            self.cursor.execute('''
+                UPDATE medicines SET quantity = COALESCE(quantity, 0) + ?
+                WHERE med_id = ? AND COALESCE(quantity, 0) + ? >= 0
+            ''', (change, med_id, change))
+            if self.cursor.rowcount == 0:
+                raise InsufficientStock(self._shortages({med_id: -change}))
+            self._record_stock(kind, {med_id: change}, ref_id=ref_id, note=note)
+            self._reconcile_lots([med_id])
+            expiries = self._refresh_expiry([med_id])
+            self.conn.commit()
+        except sqlite3.Error as e:
+            self.conn.rollback()
+            raise StoreError(f"Failed to update stock: {e}") from e
+        except Exception:
+            self.conn.rollback()
+            raise
+
+        self.catalog.adjust_quantity(med_id, change)
+        for changed_id, expiry in expiries:
+            self.catalog.set_expiry(changed_id, expiry)
+
+    def near_expiry(self, days: int = 90, after=None, before=None,
+                    limit: int = PAGE_SIZE) -> list:
+        """Return one page of stocked lots expiring within days, expired first.
+
+        Rows are (expiry_date, batch_id, name, batch_no, quantity, cost),
+        keyed on (expiry_date, batch_id) and served by idx_batches_expiry.
+        """
+        horizon = (datetime.date.today() + datetime.timedelta(days=days)).isoformat()
+        return self._keyset_page(
+            '''SELECT b.expiry_date, b.batch_id, m.name, b.batch_no, b.quantity, b.cost
+               FROM batches b JOIN medicines m ON m.med_id = b.med_id''',
+            ["b.quantity > 0", "b.expiry_date <= ?"], [horizon],
+            ("b.expiry_date", "b.batch_id"), after=after, before=before, limit=limit)
+
+    def expiry_summary(self, days: int = 90):
+        """Return (lots, units, value at cost) expiring within days, and already expired"""
+        today = datetime.date.today()
+        horizon = (today + datetime.timedelta(days=days)).isoformat()
+        self.cursor.execute('''
+            SELECT COUNT(*), COALESCE(SUM(quantity), 0),
+                   COALESCE(SUM(quantity * cost), 0),
+                   COALESCE(SUM(expiry_date < ?), 0)
+            FROM batches
+            WHERE quantity > 0 AND expiry_date <= ?
+        ''', (today.isoformat(), horizon))
+        return self.cursor.fetchone()
+
+    def set_reorder_level(self, med_id: int, level: int):
+        """Set the stock level below which a medicine raises a low-stock alert"""
+        if level < 0:
+            raise StoreError("Please enter a valid reorder level!")
+        self.cursor.execute("UPDATE medicines SET reorder_level = ? WHERE med_id = ?",
+                            (level, med_id))
+        if self.cursor.rowcount == 0:
+            self.conn.rollback()
+            raise StoreError("Medicine not found!")
+        self.conn.commit()
+        self.catalog.set_reorder_level(med_id, level)
+
+    def refresh_expiry_alerts(self, days: int = EXPIRY_ALERT_DAYS) -> int:
+        """Raise alerts for stocked lots that have come within days of expiry.
+
+        Triggers only see lots as they are received; this picks up the ones
+        the calendar has since brought into range (run at startup and daily).
+        Returns the number of new alerts.
+        """
+        horizon = (datetime.date.today() + datetime.timedelta(days=days)).isoformat()
+        self.cursor.execute('''
+            INSERT OR IGNORE INTO alerts (kind, med_id, batch_id, raised_at)
+            SELECT 'expiry', med_id, batch_id, datetime('now', 'localtime') FROM batches
+            WHERE quantity > 0 AND expiry_date <= ?
+        ''', (horizon,))
+        raised = self.cursor.rowcount
+        self.conn.commit()
+        return raised
+
+    def alert_counts(self) -> dict:
+        """Return {kind: number of open alerts}"""
+        self.cursor.execute('''
+            SELECT kind, COUNT(*) FROM alerts WHERE cleared_at IS NULL GROUP BY kind
+        ''')
+        return dict(self.cursor.fetchall())
+
+    def alerts_page(self, after=None, before=None, limit: int = PAGE_SIZE,
+                    open_only: bool = True) -> list:
+        """Return one page of alerts, newest first, keyed on (alert_id,).
+
+        Rows are (alert_id, raised_at, kind, name, stock, detail) where stock
+        is the medicine's quantity or the lot's, and detail the reorder
+        level or the lot and its expiry date.
+        """
+        return self._keyset_page(
+            '''SELECT a.alert_id, a.raised_at, a.kind, m.name,
+                      CASE a.kind WHEN 'expiry' THEN b.quantity ELSE m.quantity END,
+                      CASE a.kind
+                          WHEN 'expiry' THEN 'lot ' || COALESCE(b.batch_no, b.batch_id)
+                                             || ' expires ' || b.expiry_date
+                          ELSE 'reorder level ' || m.reorder_level
+                      END
+               FROM alerts a
+               JOIN medicines m ON m.med_id = a.med_id
+               LEFT JOIN batches b ON a.kind = 'expiry' AND b.batch_id = a.batch_id''',
+            ["a.cleared_at IS NULL"] if open_only else [], [],
+            ("a.alert_id",), descending=True, after=after, before=before, limit=limit)
+
+    def low_stock(self, threshold: int = None) -> list:
+        """Return names of medicines below their reorder level (or threshold if given), lowest first"""
+        return [record.name for record in self.catalog.low_stock(threshold)]
+
+    # Stock ledger
+    def _record_stock(self, kind, changes, ref_id=None, note=None):
+        """Append {med_id: signed change} events to the stock ledger.
+
+        Callers move medicines.quantity by the same amounts in the same
+        transaction; that keeps the projection equal to the ledger.
+        """
+        self.cursor.executemany('''
+            INSERT INTO stock_ledger (med_id, kind, quantity, ref_id, note, recorded_at)
+            VALUES (?, ?, ?, ?, ?, datetime('now', 'localtime'))
+        ''', [(med_id, kind, change, ref_id, note) for med_id, change in changes.items() if change])
+
+    def _snapshot(self, oldest=False):
+        """Return (snapshot_id, event_id) of the newest (or oldest) snapshot, or (0, 0)"""
+        self.cursor.execute(f'''
+            SELECT snapshot_id, event_id FROM stock_snapshots
+            ORDER BY snapshot_id {'ASC' if oldest else 'DESC'} LIMIT 1
+        ''')
+        return self.cursor.fetchone() or (0, 0)
+
+    def _balances(self, snapshot, med_ids=None):
+        """Return SQL and params for (med_id, quantity) ledger balances.
+
+        A balance is the snapshot's quantity plus the events after it. With
+        med_ids the tail is read per medicine on idx_stock_ledger_med.
+        Otherwise a short tail is read by event_id range and grouped in a
+        temp b-tree, and a long one (over a third of the ledger) is summed
+        in med_id order straight off the covering index, which is about
+        three times faster per event than sorting it.
+        """
+        snapshot_id, event_id = snapshot
+        if med_ids is None:
+            # Separate subqueries: MIN and MAX together would scan the table
+            first, last = self.cursor.execute('''
+                SELECT (SELECT COALESCE(MIN(event_id), 0) FROM stock_ledger),
+                       (SELECT COALESCE(MAX(event_id), 0) FROM stock_ledger)
+            ''').fetchone()
+            group = "med_id" if (last - event_id) * 3 > last - first else "+med_id"
+            return f'''
+                SELECT med_id, SUM(quantity) AS quantity FROM (
+                    SELECT med_id, quantity FROM stock_snapshot_rows WHERE snapshot_id = ?
+                    UNION ALL
+                    SELECT med_id, SUM(quantity) FROM stock_ledger WHERE event_id > ? GROUP BY {group}
+                ) GROUP BY med_id
+            ''', [snapshot_id, event_id]
+        ids = json.dumps(list(med_ids))
+        return '''
+            SELECT med_id, SUM(quantity) AS quantity FROM (
+                SELECT med_id, quantity FROM stock_snapshot_rows
+                WHERE snapshot_id = ? AND med_id IN (SELECT value FROM json_each(?))
+                UNION ALL
+                SELECT med_id, quantity FROM stock_ledger
+                WHERE med_id IN (SELECT value FROM json_each(?)) AND event_id > ?
+            ) GROUP BY med_id
+        ''', [snapshot_id, ids, ids, event_id]
+
+    def reconcile_stock(self, med_ids, note=None):
+        """Bring lots and the ledger in line with medicines.quantity after writing it directly.
+
+        Call inside the caller's transaction; the caller refreshes the cache.
+        """
+        self._reconcile_lots(med_ids)
+        self._reconcile_ledger(med_ids, note=note)
+
+    def _reconcile_ledger(self, med_ids, note=None):
+        """Journal an adjustment wherever medicines.quantity was set directly.
+
+        The projection is trusted here (an import or stock count just wrote
+        it), so the ledger takes the difference.
+        """
+        if not med_ids:
+            return
+        balances, params = self._balances(self._snapshot(), med_ids)
+        self.cursor.execute(f'''
+            SELECT m.med_id, COALESCE(m.quantity, 0) - COALESCE(l.quantity, 0)
+            FROM medicines m LEFT JOIN ({balances}) l ON l.med_id = m.med_id
+            WHERE m.med_id IN (SELECT value FROM json_each(?))
+              AND COALESCE(m.quantity, 0) != COALESCE(l.quantity, 0)
+        ''', params + [json.dumps(list(med_ids))])
+        self._record_stock('adjustment', dict(self.cursor.fetchall()), note=note)
+
+    def stock_history(self, med_id: int, after=None, before=None,
+                      limit: int = PAGE_SIZE) -> list:
+        """Return one page of a medicine's ledger events, newest first, keyed on (event_id,).
+
+        Rows are (event_id, recorded_at, kind, quantity, ref_id, note).
+        """
+        return self._keyset_page(
+            "SELECT event_id, recorded_at, kind, quantity, ref_id, note FROM stock_ledger",
+            ["med_id = ?"], [med_id], ("event_id",), descending=True,
+            after=after, before=before, limit=limit)
+
+    def check_stock(self, deep: bool = False) -> list:
+        """Compare medicines.quantity with the ledger and return the mismatches.
+
+        Rows are (med_id, name, quantity, ledger quantity). Balances start
+        from the newest snapshot, or with deep from the oldest one kept, so
+        the newer snapshots are checked too.
+        """
+        balances, params = self._balances(self._snapshot(oldest=deep))
+        self.cursor.execute(f'''
+            SELECT m.med_id, m.name, COALESCE(m.quantity, 0), COALESCE(l.quantity, 0)
+            FROM medicines m LEFT JOIN ({balances}) l ON l.med_id = m.med_id
+            WHERE COALESCE(m.quantity, 0) != COALESCE(l.quantity, 0)
+            ORDER BY m.med_id
+        ''', params)
+        return self.cursor.fetchall()
+
+    def rebuild_stock(self, deep: bool = False) -> list:
+        """Reset medicines.quantity (and lots) to the ledger wherever they differ.
+
+        For recovery after stock was written around the engine. Returns the
+        mismatches that were fixed, as check_stock reports them.
+        """
+        try:
+            self.cursor.execute("BEGIN IMMEDIATE")
+            mismatches = self.check_stock(deep)
+            self.cursor.executemany("UPDATE medicines SET quantity = ? WHERE med_id = ?",
+                                    [(ledger, med_id) for med_id, _, _, ledger in mismatches])
+            med_ids = [row[0] for row in mismatches]
+            self._reconcile_lots(med_ids)
+            if med_ids:
+                self._refresh_expiry(med_ids)
+            self.conn.commit()
+        except sqlite3.Error as e:
+            self.conn.rollback()
+            raise StoreError(f"Stock rebuild failed: {e}") from e
+
+        if mismatches:
+            self.catalog.invalidate()
+        return mismatches
+
+    def snapshot_stock(self, min_events: int = 1, prune: bool = False):
+        """Fold new ledger events into a snapshot of every balance.
+
+        The snapshot is the previous one plus the events since, so it costs
+        O(medicines + new events). Nothing is written unless at least
+        min_events arrived since the last snapshot. Only the newest
+        STOCK_SNAPSHOTS are kept; with prune, events the oldest kept
+        snapshot already holds are deleted from the ledger. Returns
+        (snapshot_id, event_id, events pruned), or None if not due.
+        """
+        try:
+            self.cursor.execute("BEGIN IMMEDIATE")
+            previous = self._snapshot()
+            last = self.cursor.execute("SELECT COALESCE(MAX(event_id), 0) FROM stock_ledger").fetchone()[0]
+            if last - previous[1] < max(min_events, 1):
+                self.conn.rollback()
+                return None
+
+            self.cursor.execute('''
+                INSERT INTO stock_snapshots (event_id, taken_at)
+                VALUES (?, datetime('now', 'localtime'))
+            ''', (last,))
+            snapshot_id = self.cursor.lastrowid
+            balances, params = self._balances(previous)
+            self.cursor.execute(f'''
+                INSERT INTO stock_snapshot_rows (snapshot_id, med_id, quantity)
+                SELECT ?, med_id, quantity FROM ({balances}) WHERE quantity != 0
+            ''', [snapshot_id] + params)
+
+            self.cursor.execute("SELECT snapshot_id FROM stock_snapshots ORDER BY snapshot_id DESC LIMIT 1 OFFSET ?",
+                                (STOCK_SNAPSHOTS,))
+            dropped = self.cursor.fetchone()
+            if dropped:
+                self.cursor.execute("DELETE FROM stock_snapshot_rows WHERE snapshot_id <= ?", dropped)
+                self.cursor.execute("DELETE FROM stock_snapshots WHERE snapshot_id <= ?", dropped)
+            pruned = 0
+            if prune:
+                self.cursor.execute("DELETE FROM stock_ledger WHERE event_id <= ?",
+                                    (self._snapshot(oldest=True)[1],))
+                pruned = self.cursor.rowcount
+            self.conn.commit()
+        except sqlite3.Error as e:
+            self.conn.rollback()
+            raise StoreError(f"Stock snapshot failed: {e}") from e
+        return snapshot_id, last, pruned
+
+    # Billing
+    def make_bill_item(self, med_id: int, quantity: int, stock_check: bool = True) -> dict:
+        """Validate stock and build a bill line for a medicine.
+
+        stock_check=False skips the check against the cached stock, leaving
+        it to generate_bill, which raises InsufficientStock with every short
+        line.
+        """
+        if quantity <= 0:
+            raise StoreError("Please enter a valid quantity!")
+
+        medicine = self.get_medicine(med_id)
+        if not medicine:
+            raise StoreError("Medicine not found!")
+
+        if stock_check and quantity > medicine.quantity:
+            raise StoreError(f"Insufficient stock! Available: {medicine.quantity}")
+
+        return {
+            'med_id': med_id,
+            'name': medicine.name,
+            'price': medicine.sale_price,
+            'quantity': quantity,
+            'total': medicine.sale_price * quantity
+        }
+
+    def generate_bill(self, customer_name: str, items: list):
+        """Save a bill with its sale rows, decrement stock and return (bill_id, date).
+
+        The whole checkout is one BEGIN IMMEDIATE transaction: the bill
+        header, every sale row (executemany) and its bill_items links, and
+        a conditional stock decrement per medicine, journalled as a sale
+        event and drawn from its lots first expiry first out. If any medicine no longer has enough stock
+        at commit time nothing is written and InsufficientStock is raised.
+        """
+        if not items:
+            raise StoreError("No items in the bill!")
+
+        customer_name = customer_name or "Walk-in Customer"
+        now = datetime.datetime.now().replace(microsecond=0)
+        current_date = now.strftime("%Y-%m-%d %H:%M:%S")
+        sale_ts = _epoch(now)
+        # (price, total) in paise per line; the bill total is their exact sum
+        amounts = [(to_paise(item['price']), to_paise(item['price']) * item['quantity']) for item in items]
+        total_paise = sum(total for _, total in amounts)
+
+        # One decrement per medicine even if it appears on several lines
+        needed = {}
+        for item in items:
+            needed[item['med_id']] = needed.get(item['med_id'], 0) + item['quantity']
+
+        try:
+            # Time spent waiting for other terminals to release the write lock
+            started = time.perf_counter()
+            self.cursor.execute("BEGIN IMMEDIATE")
+            self.last_lock_wait = time.perf_counter() - started
+
+            self.cursor.execute('''
+                INSERT INTO bills_data (customer_name, total_paise, bill_ts)
+                VALUES (?, ?, ?)
+            ''', (customer_name, total_paise, sale_ts))
+            bill_id = self.cursor.lastrowid
+
+            self.cursor.executemany('''
+                UPDATE medicines
+                SET quantity = quantity - ?
+                WHERE med_id = ? AND quantity >= ?
+            ''', [(quantity, med_id, quantity) for med_id, quantity in needed.items()])
+            if self.cursor.rowcount != len(needed):
+                raise InsufficientStock(self._shortages(needed))
+            self._record_stock('sale', {med_id: -quantity for med_id, quantity in needed.items()},
+                               ref_id=bill_id)
+            self._take_from_lots(needed)
+            expiries = self._refresh_expiry(needed)
+
+            # med_name stays NULL: lines carry the catalog's current name
+            self.cursor.executemany('''
+                INSERT INTO sales_data (bill_id, med_id, quantity, price_paise, total_paise, sale_ts)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', [(bill_id, item['med_id'], item['quantity'], price, total, sale_ts)
+                  for item, (price, total) in zip(items, amounts)])
+
+            self.cursor.execute('''
+                INSERT INTO bill_items (bill_id, sale_id)
+                SELECT bill_id, sale_id FROM sales_data WHERE bill_id = ?
+            ''', (bill_id,))
+
+            self._roll_up(sale_ts // DAY, items, amounts, needed)
+
+            self.conn.commit()
+            # Lock wait included: what the customer waited for
+            self.last_checkout = time.perf_counter() - started
+        except sqlite3.Error as e:
+            self.conn.rollback()
+            raise StoreError(f"Checkout failed: {e}") from e
+        except Exception:
+            self.conn.rollback()
+            raise
+
+        for med_id, quantity in needed.items():
+            self.catalog.adjust_quantity(med_id, -quantity)
+        for med_id, expiry in expiries:
+            self.catalog.set_expiry(med_id, expiry)
+        return bill_id, current_date
+
+    def _roll_up(self, sale_day, items, amounts, needed):
+        """Add a bill's lines to the daily rollups (inside the checkout transaction)"""
+        revenue = {}
+        for item, (_, total) in zip(items, amounts):
+            revenue[item['med_id']] = revenue.get(item['med_id'], 0) + total
+
+        placeholders = ", ".join("?" * len(needed))
+        self.cursor.execute(f'''
+            SELECT m.med_id, {UNIT_COST} FROM medicines m
+            WHERE m.med_id IN ({placeholders})
+        ''', list(needed))
+        cost = {med_id: unit_cost * needed[med_id] for med_id, unit_cost in self.cursor.fetchall()}
+
+        self.cursor.executemany('''
+            INSERT INTO sales_daily (sale_day, med_id, quantity, revenue_paise, cost_paise)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (sale_day, med_id) DO UPDATE SET
+                quantity = quantity + excluded.quantity,
+                revenue_paise = revenue_paise + excluded.revenue_paise,
+                cost_paise = cost_paise + excluded.cost_paise
+        ''', [(sale_day, med_id, quantity, revenue[med_id], cost.get(med_id, 0))
+              for med_id, quantity in needed.items()])
+        self.cursor.execute('''
+            INSERT INTO sales_daily_totals (sale_day, quantity, revenue_paise, cost_paise)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT (sale_day) DO UPDATE SET
+                quantity = quantity + excluded.quantity,
+                revenue_paise = revenue_paise + excluded.revenue_paise,
+                cost_paise = cost_paise + excluded.cost_paise
+        ''', (sale_day, sum(needed.values()), sum(revenue.values()), sum(cost.values())))
+
+    def roll_up_sales(self, sale_ids):
+        """Add sales rows inserted outside checkout (e.g. synced in) to the daily rollups.
+
+        Call inside the caller's transaction.
+        """
+        if not sale_ids:
+            return
+        ids = json.dumps(list(sale_ids))
+        self.cursor.execute(f'''
+            INSERT INTO sales_daily (sale_day, med_id, quantity, revenue_paise, cost_paise)
+            SELECT s.sale_ts / {DAY}, s.med_id, SUM(s.quantity), SUM(s.total_paise),
+                   SUM(s.quantity * {UNIT_COST})
+            FROM sales_data s LEFT JOIN medicines m ON m.med_id = s.med_id
+            WHERE s.sale_id IN (SELECT value FROM json_each(?)) AND s.med_id IS NOT NULL
+            GROUP BY 1, 2
+            ON CONFLICT (sale_day, med_id) DO UPDATE SET
+                quantity = quantity + excluded.quantity,
+                revenue_paise = revenue_paise + excluded.revenue_paise,
+                cost_paise = cost_paise + excluded.cost_paise
+        ''', (ids,))
+        self.cursor.execute(f'''
+            INSERT INTO sales_daily_totals (sale_day, quantity, revenue_paise, cost_paise)
+            SELECT s.sale_ts / {DAY}, SUM(s.quantity), SUM(s.total_paise),
+                   SUM(s.quantity * {UNIT_COST})
+            FROM sales_data s LEFT JOIN medicines m ON m.med_id = s.med_id
+            WHERE s.sale_id IN (SELECT value FROM json_each(?)) AND s.med_id IS NOT NULL
+            GROUP BY 1
+            ON CONFLICT (sale_day) DO UPDATE SET
+                quantity = quantity + excluded.quantity,
+                revenue_paise = revenue_paise + excluded.revenue_paise,
+                cost_paise = cost_paise + excluded.cost_paise
+        ''', (ids,))
+
+    def _shortages(self, needed):
+        """Return (name, requested, available) for medicines that can't cover needed"""
+        placeholders = ", ".join("?" * len(needed))
+        self.cursor.execute(f'''
+            SELECT med_id, name, quantity FROM medicines WHERE med_id IN ({placeholders})
+        ''', list(needed))
+        found = {row[0]: row for row in self.cursor.fetchall()}
+
+        shortages = []
+        for med_id, quantity in needed.items():
+            _, name, available = found.get(med_id, (med_id, f"Medicine #{med_id}", 0))
+            if (available or 0) < quantity:
+                shortages.append((name, quantity, available or 0))
+        return shortages
+
+    def bill_lines(self, bill_id: int) -> list:
+        """Return (sale_id, med_id, med_name, quantity, price, total) for a bill, archived or not"""
+        self.attach_archives()
+        self.cursor.execute('''
+            SELECT s.sale_id, s.med_id, COALESCE(s.med_name, m.name), s.quantity,
+                   s.price_paise / 100.0, s.total_paise / 100.0
+            FROM sales_history s LEFT JOIN medicines m ON m.med_id = s.med_id
+            WHERE s.bill_id = ?
+            ORDER BY s.sale_id
+        ''', (bill_id,))
+        return self.cursor.fetchall()
+
+    def bill_total(self, bill_id: int) -> float:
+        """Return a bill's stored total (the exact paise sum of its lines) in rupees, archived or not"""
+        self.attach_archives()
+        self.cursor.execute("SELECT total_paise / 100.0 FROM bills_history WHERE bill_id = ?", (bill_id,))
+        row = self.cursor.fetchone()
+        if row is None:
+            raise StoreError("Bill not found!")
+        return row[0]
+
+    def iter_bills(self, from_date: str = None, to_date: str = None, bill_ids=None,
+                   chunk_size: int = 500):
+        """Yield lists of (bill, lines) for receipts, oldest first.
+
+        bill is (bill_id, customer_name, total_amount, bill_date) and lines
+        are (med_name, quantity, price, total). Bills are selected by date
+        range (idx_bills_ts, merged across the archives in range) or by id,
+        read chunk_size at a time, and each chunk's lines come from one
+        query on idx_sales_bill.
+        """
+        if bill_ids is not None:
+            self.attach_archives()
+            bill_ids = sorted(set(bill_ids))
+            chunks = (bill_ids[i:i + chunk_size] for i in range(0, len(bill_ids), chunk_size))
+            for ids in chunks:
+                placeholders = ", ".join("?" * len(ids))
+                bills = self.conn.execute(
+                    f"{BILL_ROWS.format(bills='bills_history')} WHERE b.bill_id IN ({placeholders}) "
+                    f"ORDER BY b.bill_id", ids).fetchall()
+                if bills:
+                    yield self._with_lines(bills)
+            return
+
+        where, params = self._sales_filter(from_date, to_date, column="b.bill_ts")
+        cursors = []
+        for bills, hidden in self._history_sources('bills_data', 'b', from_date, to_date):
+            query = BILL_ROWS.format(bills=bills)
+            if where + hidden:
+                query += " WHERE " + " AND ".join(where + hidden)
+            cursors.append(self.conn.execute(query + " ORDER BY b.bill_ts, b.bill_id", params))
+        bills = heapq.merge(*cursors, key=lambda bill: (bill[3], bill[0]))
+        while True:
+            chunk = list(itertools.islice(bills, chunk_size))
+            if not chunk:
+                break
+            yield self._with_lines(chunk)
+
+    def _with_lines(self, bills):
+        """Attach each bill's sale lines to a chunk of bill rows"""
+        lines = {bill[0]: [] for bill in bills}
+        placeholders = ", ".join("?" * len(lines))
+        rows = self.conn.execute(f'''
+            SELECT s.bill_id, COALESCE(s.med_name, m.name), s.quantity, s.price_paise / 100.0,
+                   s.total_paise / 100.0
+            FROM sales_history s LEFT JOIN medicines m ON m.med_id = s.med_id
+            WHERE s.bill_id IN ({placeholders}) ORDER BY s.bill_id, s.sale_id
+        ''', list(lines))
+        for bill_id, *line in rows:
+            lines[bill_id].append(tuple(line))
+        return [(bill, lines[bill[0]]) for bill in bills]
+
+    # Reports
+    def _sales_filter(self, from_date=None, to_date=None, column="s.sale_ts"):
+        """Build WHERE clauses and params for a sales date range.
+
+        The range is half-open on the raw column (from <= sale_ts < day
+        after to) so the sale_ts index can be used.
+        """
+        where, params = [], []
+
+        try:
+            if from_date:
+                where.append(f"{column} >= ?")
+                params.append(_epoch(datetime.date.fromisoformat(from_date)))
+
+            if to_date:
+                next_day = datetime.date.fromisoformat(to_date) + datetime.timedelta(days=1)
+                where.append(f"{column} < ?")
+                params.append(_epoch(next_day))
+        except ValueError:
+            raise StoreError("Dates must be in YYYY-MM-DD format!")
+
+        return where, params
+
+    def _history_sources(self, table, alias, from_date=None, to_date=None):
+        """Return (table, extra WHERE clauses) for the hot table and each archive in a date range.
+
+        Reports query each source on its own indexes and merge the results:
+        SQLite sorts a UNION ALL view whole rather than merging its arms
+        in index order.
+        """
+        years = self.attach_archives()
+        first = datetime.date.fromisoformat(from_date).year if from_date else None
+        last = datetime.date.fromisoformat(to_date).year if to_date else None
+        return [(table, [])] + [
+            (f"archive_{year}.{table}", [_unarchived(table, alias)]) for year in years
+            if (first is None or year >= first) and (last is None or year <= last)]
+
+    def filter_sales(self, from_date: str = None, to_date: str = None) -> list:
+        """Return sales rows between two YYYY-MM-DD dates (inclusive), newest first"""
+        where, params = self._sales_filter(from_date, to_date)
+        results = []
+        for sales, hidden in self._history_sources('sales_data', 's', from_date, to_date):
+            query = SALE_ROWS.format(sales=sales)
+            if where + hidden:
+                query += " WHERE " + " AND ".join(where + hidden)
+            query += " ORDER BY s.sale_ts DESC, s.sale_id DESC"
+            results.append(self.conn.execute(query, params).fetchall())
+        if len(results) == 1:
+            return results[0]
+        return list(heapq.merge(*results, key=lambda row: (row[5], row[0]), reverse=True))
+
+    def sales_page(self, from_date: str = None, to_date: str = None,
+                   after=None, before=None, limit: int = PAGE_SIZE) -> list:
+        """Return one page of sales rows, newest first, keyed on (sale_date, sale_id)"""
+        where, params = self._sales_filter(from_date, to_date)
+        after, before = _sale_key(after), _sale_key(before)
+        rows = []
+        for sales, hidden in self._history_sources('sales_data', 's', from_date, to_date):
+            rows += self._keyset_page(
+                SALE_ROWS.format(sales=sales), where + hidden, params, ("s.sale_ts", "s.sale_id"),
+                descending=True, after=after, before=before, limit=limit)
+        # Each source gave a page of its own: keep the rows nearest the key
+        rows.sort(key=lambda row: (row[5], row[0]), reverse=True)
+        return rows[:limit] if before is None else rows[-limit:]
+
+    def _rollup_filter(self, from_date=None, to_date=None):
+        """Build WHERE clauses and params for a sales_daily day range (inclusive)"""
+        where, params = [], []
+
+        try:
+            if from_date:
+                where.append("sale_day >= ?")
+                params.append(_epoch(datetime.date.fromisoformat(from_date)) // DAY)
+
+            if to_date:
+                where.append("sale_day <= ?")
+                params.append(_epoch(datetime.date.fromisoformat(to_date)) // DAY)
+        except ValueError:
+            raise StoreError("Dates must be in YYYY-MM-DD format!")
+
+        return " WHERE " + " AND ".join(where) if where else "", params
+
+    def sales_total(self, from_date: str = None, to_date: str = None) -> float:
+        """Return the summed sale totals for a date range"""
+        return self.sales_summary(from_date, to_date)[1]
+
+    def sales_summary(self, from_date: str = None, to_date: str = None) -> tuple:
+        """Return (quantity, revenue, cost, margin) for a date range from the rollup"""
+        where, params = self._rollup_filter(from_date, to_date)
+        self.cursor.execute(f'''
+            SELECT COALESCE(SUM(quantity), 0), COALESCE(SUM(revenue_paise), 0) / 100.0,
+                   COALESCE(SUM(cost_paise), 0) / 100.0, COALESCE(SUM(margin_paise), 0) / 100.0
+            FROM sales_daily_totals{where}
+        ''', params)
+        return self.cursor.fetchone()
+
+    def top_sellers(self, from_date: str = None, to_date: str = None,
+                    limit: int = 10, by: str = 'revenue') -> list:
+        """Return (med_id, name, quantity, revenue, margin) for the best sellers in a range"""
+        if by not in ('quantity', 'revenue', 'margin'):
+            raise StoreError(f"Cannot rank sellers by {by}")
+
+        where, params = self._rollup_filter(from_date, to_date)
+        self.cursor.execute(f'''
+            SELECT d.med_id, m.name, d.quantity, d.revenue / 100.0, d.margin / 100.0
+            FROM (SELECT med_id, SUM(quantity) AS quantity, SUM(revenue_paise) AS revenue,
+                         SUM(margin_paise) AS margin
+                  FROM sales_daily{where} GROUP BY med_id) d
+            LEFT JOIN medicines m ON m.med_id = d.med_id
+            ORDER BY d.{by} DESC LIMIT ?
+        ''', params + [limit])
+        return self.cursor.fetchall()
+
+    def sales_trend(self, from_date: str = None, to_date: str = None) -> list:
+        """Return (day, quantity, revenue, margin) per day in a range"""
+        where, params = self._rollup_filter(from_date, to_date)
+        self.cursor.execute(f'''
+            SELECT date(sale_day * {DAY}, 'unixepoch'), quantity, revenue_paise / 100.0,
+                   margin_paise / 100.0
+            FROM sales_daily_totals{where}
+            ORDER BY sale_day
+        ''', params)
+        return self.cursor.fetchall()
+
+    def rebuild_sales_daily(self):
+        """Recompute the daily rollup from scratch (e.g. after bulk-loading sales)"""
+        self.attach_archives()
+        try:
+            self.cursor.execute("BEGIN IMMEDIATE")
+            _rebuild_sales_daily(self.cursor)
+            self.conn.commit()
+        except sqlite3.Error as e:
+            self.conn.rollback()
+            raise StoreError(f"Rollup rebuild failed: {e}") from e
+
+    # Archives
+    def archive_path(self, year: int) -> str:
+        """Return the archive file for a year's sales, next to the database"""
+        stem = os.path.splitext(os.path.basename(self.db_path))[0]
+        return os.path.join(os.path.dirname(os.path.abspath(self.db_path)), f"{stem}_sales_{year}.db")
+
+    def attach_archives(self) -> list:
+        """Attach the yearly sales archives to this connection and return their years.
+
+        Also (re)creates sales_history and bills_history: TEMP views, as
+        only those can reach attached files, over the hot table and each
+        archive's copy. It costs one small query when nothing changed, so
+        history reads call it first; another connection may have started
+        a new year's archive since. At most ten files attach by default
+        (SQLITE_MAX_ATTACHED).
+        """
+        archives = self.conn.execute("SELECT year, path FROM sales_archives ORDER BY year").fetchall()
+        years = [year for year, _ in archives]
+        if years == self.archive_years:
+            return years
+
+        attached = {row[1] for row in self.conn.execute("PRAGMA database_list")}
+        directory = os.path.dirname(os.path.abspath(self.db_path))
+        for year, path in archives:
+            if f"archive_{year}" in attached:
+                continue
+            path = os.path.join(directory, path)
+            if not os.path.exists(path):
+                raise StoreError(f"Sales archive {path} is missing!")
+            try:
+                self.conn.execute(f"ATTACH DATABASE ? AS archive_{year}", (path,))
+            except sqlite3.Error as e:
+                raise StoreError(f"Cannot open sales archive {path}: {e}") from e
+
+        for view, table in HISTORY_VIEWS.items():
+            columns = ", ".join(row[1] for row in self.conn.execute(f"PRAGMA main.table_info({table})"))
+            arms = [f"SELECT {columns} FROM main.{table}"] + [
+                f"SELECT {columns} FROM archive_{year}.{table} a WHERE {_unarchived(table, 'a')}"
+                for year in years]
+            self.conn.execute(f"DROP VIEW IF EXISTS temp.{view}")
+            self.conn.execute(f"CREATE TEMP VIEW {view} AS {' UNION ALL '.join(arms)}")
+        self.archive_years = years
+        return years
+
+    def _open_archive(self, year):
+        """Create a year's archive with the hot tables' schema if needed, and attach it"""
+        if year in self.attach_archives():
+            return
+        if self.db_path == ":memory:":
+            raise StoreError("An in-memory database cannot be archived!")
+        path = self.archive_path(year)
+        if not os.path.exists(path):
+            tables = ", ".join(f"'{table}'" for table in ARCHIVED_TABLES)
+            schema = self.conn.execute(f'''
+                SELECT sql FROM main.sqlite_master
+                WHERE tbl_name IN ({tables}) AND type IN ('table', 'index') AND sql IS NOT NULL
+                ORDER BY type = 'index'
+            ''').fetchall()
+            # Built aside so a crash never leaves a half-made archive in place
+            building = f"{path}.{os.getpid()}.tmp"
+            archive = connect(building)
+            try:
+                for sql, in schema:
+                    archive.execute(sql)
+                archive.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+                archive.commit()
+            finally:
+                archive.close()
+            os.replace(building, path)
+
+        try:
+            self.cursor.execute("BEGIN IMMEDIATE")
+            self.cursor.execute("INSERT OR IGNORE INTO sales_archives (year, path) VALUES (?, ?)",
+                                (year, os.path.basename(path)))
+            self.conn.commit()
+        except sqlite3.Error as e:
+            self.conn.rollback()
+            raise StoreError(f"Failed to register sales archive {path}: {e}") from e
+        self.attach_archives()
+
+    def archive_sales(self, keep_months: int = ARCHIVE_KEEP_MONTHS, batch: int = ARCHIVE_BATCH) -> int:
+        """Move the oldest sales and bills of closed months to the yearly archives.
+
+        Rows dated before the month keep_months before the current one go,
+        up to batch of each per call, to the archive for their year
+        (archive_path), created on first use. They are copied there first
+        and then deleted here in one short BEGIN IMMEDIATE, so checkout
+        waits at most for one batch's delete; a pass cut short in between
+        leaves rows the next one copies again. Once this store has pushed
+        to a sync hub, rows not pushed yet stay until they are. Meant to be
+        called repeatedly in the background; returns the rows moved, 0
+        when nothing is left to move.
+        """
+        cutoff = _archive_cutoff(datetime.date.today(), keep_months)
+        syncing = self.conn.execute("SELECT 1 FROM sync_state WHERE key = 'pushed'").fetchone()
+        moving = {}
+        for table, (key, column) in ARCHIVED_TABLES.items():
+            unpushed = f'''
+                AND {key} NOT IN (SELECT row_id FROM sync_log WHERE tbl = '{table}' AND source IS NULL)
+            ''' if syncing else ""
+            rows = self.conn.execute(f'''
+                SELECT {key}, {column} FROM {table}
+                WHERE {column} < ? {unpushed} ORDER BY {column}, {key} LIMIT ?
+            ''', (cutoff, batch)).fetchall()
+            for row_id, ts in rows:
+                moving.setdefault(time.gmtime(ts).tm_year, {}).setdefault(table, []).append(row_id)
+        if not moving:
+            return 0
+        for year in moving:
+            self._open_archive(year)
+
+        try:
+            # Only the archives are written: checkout is not held up
+            self.cursor.execute("BEGIN")
+            for year, tables in moving.items():
+                for table, row_ids in tables.items():
+                    columns = ", ".join(row[1] for row in self.conn.execute(
+                        f"PRAGMA archive_{year}.table_info({table})"))
+                    self.cursor.execute(f'''
+                        INSERT OR REPLACE INTO archive_{year}.{table} ({columns})
+                        SELECT {columns} FROM main.{table}
+                        WHERE {ARCHIVED_TABLES[table][0]} IN (SELECT value FROM json_each(?))
+                    ''', (json.dumps(row_ids),))
+            self.conn.commit()
+
+            self.cursor.execute("BEGIN IMMEDIATE")
+            for table, (key, _) in ARCHIVED_TABLES.items():
+                row_ids = json.dumps([row_id for tables in moving.values()
+                                      for row_id in tables.get(table, ())])
+                if table == 'bills_data':
+                    self.cursor.execute('''
+                        DELETE FROM bill_items WHERE bill_id IN (SELECT value FROM json_each(?))
+                    ''', (row_ids,))
+                self.cursor.execute(f'''
+                    DELETE FROM main.{table} WHERE {key} IN (SELECT value FROM json_each(?))
+                ''', (row_ids,))
+            self.conn.commit()
+        except sqlite3.Error as e:
+            self.conn.rollback()
+            raise StoreError(f"Archiving failed: {e}") from e
+        return sum(len(row_ids) for tables in moving.values() for row_ids in tables.values())
+
+    # Maintenance
+    def backup(self, directory: str, pages: int = BACKUP_PAGES, pause: float = BACKUP_PAUSE) -> int:
+        """Copy the database and its sales archives into a new directory while the store runs.
+
+        SQLite's online backup copies pages at a time, sleeping pause
+        seconds between steps. One read transaction is held throughout:
+        checkouts carry on (in WAL mode readers never block the writer),
+        and the copy is of a single snapshot, where a write from another
+        connection would otherwise restart it. The database is read
+        before the archives, so a row archive_sales moves meanwhile is in
+        at least one of the copies. Files keep their names, so the store
+        opens from the directory as it is. Returns the pages copied.
+        """
+        if self.db_path == ":memory:":
+            raise StoreError("An in-memory database cannot be backed up!")
+        if os.path.exists(directory):
+            raise StoreError(f"Backup {directory} already exists!")
+        files = [('main', self.db_path)] + [(f"archive_{year}", self.archive_path(year))
+                                            for year in self.attach_archives()]
+
+        def step(status, remaining, total):
+            if remaining:
+                time.sleep(pause)
+
+        # Built aside so a backup cut short never looks like a finished one
+        building = f"{directory}.{os.getpid()}.tmp"
+        os.makedirs(building)
+        copied = 0
+        try:
+            self.cursor.execute("BEGIN")
+            for schema, _ in files:
+                self.cursor.execute(f"SELECT COUNT(*) FROM {schema}.sqlite_master").fetchone()
+            for schema, path in files:
+                target = sqlite3.connect(os.path.join(building, os.path.basename(path)))
+                try:
+                    self.conn.backup(target, pages=pages, progress=step, name=schema)
+                    copied += target.execute("PRAGMA page_count").fetchone()[0]
+                finally:
+                    target.close()
+            self.conn.rollback()
+        except sqlite3.Error as e:
+            self.conn.rollback()
+            shutil.rmtree(building, ignore_errors=True)
+            raise StoreError(f"Backup failed: {e}") from e
+        os.rename(building, directory)
+        return copied
+
+    def vacuum_step(self, pages: int = VACUUM_PAGES) -> tuple:
+        """Hand up to pages free pages back to the filesystem; return (pages freed, pages still free).
+
+        Holds the write lock for one short step. Needs auto_vacuum=INCREMENTAL,
+        which new databases have (see store_db.PRAGMAS) and older ones get
+        from a full VACUUM; without it nothing is freed.
+        """
+        free = self.conn.execute("PRAGMA freelist_count").fetchone()[0]
+        if not free or self.conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            return 0, free
+        try:
+            # execute would step the pragma once, freeing a single page
+            self.conn.executescript(f"BEGIN IMMEDIATE; PRAGMA incremental_vacuum({int(pages)}); COMMIT;")
+        except sqlite3.Error as e:
+            self.conn.rollback()
+            raise StoreError(f"Incremental vacuum failed: {e}") from e
+        left = self.conn.execute("PRAGMA freelist_count").fetchone()[0]
+        return free - left, left
+
+    def check_integrity(self, deep: bool = False) -> list:
+        """Return the problems PRAGMA quick_check finds in the database and its archives, [] if none.
+
+        With deep, run integrity_check, which also matches every index
+        against its table. Either is one long read, so checkouts carry on.
+        """
+        self.attach_archives()
+        try:
+            problems = [row[0] for row in self.conn.execute(
+                f"PRAGMA {'integrity_check' if deep else 'quick_check'}").fetchall()]
+        except sqlite3.DatabaseError as e:
+            return [str(e)]  # e.g. "database disk image is malformed"
+        return [] if problems == ['ok'] else problems
+
+    # Diagnostics
+    def query_plan(self, query, params=()) -> list:
+        """Return the EXPLAIN QUERY PLAN detail lines for a query"""
+        self.cursor.execute("EXPLAIN QUERY PLAN " + query, params)
+        return [row[3] for row in self.cursor.fetchall()]
+
+    def report_query_plans(self) -> dict:
+        """Run every report query and return {sql: plan lines}"""
+        statements = []
+        self.conn.set_trace_callback(statements.append)
+        try:
+            self.sales_page("2024-01-01", "2024-01-31")
+            self.sales_page(after=("2024-01-31 23:59:59", 1))
+            self.sales_page(before=("2024-01-01 00:00:00", 1))
+            self.sales_summary("2024-01-01", "2024-01-31")
+            self.top_sellers("2024-01-01", "2024-01-31")
+            self.sales_trend("2024-01-01", "2024-01-31")
+            self.stock_page(after=(10, 1))
+            self.near_expiry(after=("2024-01-01", 1))
+            self.medicine_lots(1)
+            self.stock_history(1, after=(1000,))
+            self.expiry_summary()
+            self.alerts_page(after=(1000,))
+            self.alert_counts()
+            self.medicine_page(after=("M", 1))
+        finally:
+            self.conn.set_trace_callback(None)
+
+        return {sql: self.query_plan(sql) for sql in statements}
+
+    def table_scans(self) -> dict:
+        """Return report queries whose plans fall back to a table scan.
+
+        Scanning a subquery's own (already filtered) result or a
+        SMALL_TABLES table is fine, as is sorting grouped totals; sorting
+        raw rows without an index is not.
+        """
+        scans = {}
+        for sql, plan in self.report_query_plans().items():
+            subqueries = {m.group(1) for m in map(PLAN_SUBQUERY.match, plan) if m}
+            for line in plan:
+                scan = PLAN_SCAN.match(line)
+                if (scan and scan.group(1) not in subqueries | SMALL_TABLES) or (
+                        line.startswith("USE TEMP B-TREE FOR ORDER BY")
+                        and "GROUP BY" not in sql.upper()):
+                    scans[sql] = plan
+        return scans
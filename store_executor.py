@@ -0,0 +1,146 @@
+import queue
+import threading
+from concurrent.futures import Future
+
+from store_engine import StoreEngine
+
+POLL_INTERVAL = 50
+
+
+class _Job:
+    """A read (or detached write) submitted to the executor"""
+
+    def __init__(self, func, args, callback, errback, tag, detached):
+        self.future = Future()
+        self.func = func
+        self.args = args
+        self.callback = callback
+        self.errback = errback
+        self.tag = tag
+        self.detached = detached
+        self.engine = None
+        self.cancelled = False
+
+
+class QueryExecutor:
+    """Runs database reads on worker threads so the Tk main loop never blocks.
+
+    Each worker owns its own StoreEngine (and so its own SQLite connection).
+    Finished jobs are handed back to the Tk thread by polling with
+    root.after, where their callback or errback runs. Cancelled jobs never
+    call back; a job that is already running has its query interrupted.
+    Long jobs can report progress from the worker with call_soon. Detached
+    jobs (imports, bulk writes) are never cancelled, so leaving a page does
+    not abort them halfway.
+    """
+
+    def __init__(self, root, db_path, workers=2, poll_interval=POLL_INTERVAL):
+        self.root = root
+        self.db_path = db_path
+        self.poll_interval = poll_interval
+        self._jobs = queue.Queue()
+        self._done = queue.Queue()
+        self._calls = queue.Queue()
+        self._active = set()
+        self._lock = threading.Lock()
+        self._threads = []
+
+        for i in range(workers):
+            thread = threading.Thread(target=self._worker, name=f"store-query-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+        self._after_id = self.root.after(self.poll_interval, self._poll)
+
+    def submit(self, func, *args, callback=None, errback=None, tag=None,
+               detached=False) -> Future:
+        """Queue func(engine, *args) on a worker and return its future"""
+        job = _Job(func, args, callback, errback, tag, detached)
+        with self._lock:
+            self._active.add(job)
+        self._jobs.put(job)
+        return job.future
+
+    def call_soon(self, func, *args):
+        """Run func(*args) on the Tk thread at the next poll (safe from workers)"""
+        self._calls.put((func, args))
+
+    def cancel(self, tag=None):
+        """Cancel pending and running jobs, optionally only those with tag"""
+        with self._lock:
+            jobs = [job for job in self._active
+                    if not job.detached and (tag is None or job.tag == tag)]
+            for job in jobs:
+                job.cancelled = True
+                if not job.future.cancel() and job.engine is not None:
+                    job.engine.conn.interrupt()
+
+    def shutdown(self):
+        """Cancel outstanding work, stop the workers and close their connections"""
+        with self._lock:
+            for job in self._active:
+                job.detached = False
+        self.cancel()
+        if self._after_id is not None:
+            self.root.after_cancel(self._after_id)
+            self._after_id = None
+        for _ in self._threads:
+            self._jobs.put(None)
+        for thread in self._threads:
+            thread.join(timeout=1)
+
+    def _worker(self):
+        """Worker loop: run jobs against this thread's own connection"""
+        engine = StoreEngine(self.db_path)
+        try:
+            while True:
+                job = self._jobs.get()
+                if job is None:
+                    break
+                if not job.future.set_running_or_notify_cancel():
+                    self._finish(job)
+                    continue
+
+                with self._lock:
+                    job.engine = engine
+                try:
+                    job.future.set_result(job.func(engine, *job.args))
+                except BaseException as e:
+                    job.future.set_exception(e)
+                finally:
+                    with self._lock:
+                        job.engine = None
+                self._finish(job)
+        finally:
+            engine.close()
+
+    def _finish(self, job):
+        """Hand a completed job back to the Tk thread"""
+        with self._lock:
+            self._active.discard(job)
+        self._done.put(job)
+
+    def _poll(self):
+        """Deliver finished jobs' callbacks on the Tk thread"""
+        self._after_id = self.root.after(self.poll_interval, self._poll)
+        while True:
+            try:
+                func, args = self._calls.get_nowait()
+            except queue.Empty:
+                break
+            func(*args)
+
+        while True:
+            try:
+                job = self._done.get_nowait()
+            except queue.Empty:
+                break
+            if job.cancelled or job.future.cancelled():
+                continue
+
+            error = job.future.exception()
+            if error is None:
+                if job.callback:
+                    job.callback(job.future.result())
+            elif job.errback:
+                job.errback(error)
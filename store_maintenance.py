@@ -0,0 +1,283 @@
+"""Back up, check and vacuum the store database without stopping the till.
+
+    python store_maintenance.py --db medical_store.db --check --backup --vacuum
+
+The GUI runs these in the background (MaintenanceScheduler): a daily
+quick_check, then an online backup into <db>_backups/, and incremental
+vacuum steps while nobody is checking out. From the command line,
+--check runs the full integrity_check, --backup takes a backup the same
+way and --vacuum rebuilds the file with a full VACUUM, which also turns
+on incremental auto-vacuum for a database created before it was the
+default: run that one out of hours.
+"""
+import argparse
+import datetime
+import math
+import os
+import re
+import shutil
+import time
+
+from store_compact import file_size
+from store_db import DB_PATH
+from store_engine import StoreEngine, StoreError
+from store_metrics import Histogram, maintenance_log
+
+# Seconds between integrity checks and between backups, and backups kept
+CHECK_INTERVAL = 24 * 60 * 60
+BACKUP_INTERVAL = 24 * 60 * 60
+BACKUP_KEEP = 7
+# Seconds before a failed check, backup or vacuum is tried again
+RETRY_INTERVAL = 60 * 60
+# Vacuum steps run once no checkout has happened for IDLE_SECONDS; free
+# pages are looked for again every VACUUM_INTERVAL seconds
+IDLE_SECONDS = 2 * 60
+VACUUM_INTERVAL = 60 * 60
+# Milliseconds between scheduler ticks, and between vacuum steps while idle
+TICK = 60 * 1000
+VACUUM_PAUSE = 1000
+
+# Backups are directories named by the local time they were taken
+STAMP = "%Y-%m-%d_%H%M%S"
+BACKUP_NAME = re.compile(r"^\d{4}-\d{2}-\d{2}_\d{6}$")
+
+
+def backup_root(db_path) -> str:
+    """Default directory for a database's backups: <db>_backups next to it"""
+    return os.path.splitext(db_path)[0] + "_backups"
+
+
+def backups(root) -> list:
+    """Return the names of the finished backups under root, oldest first"""
+    if not os.path.isdir(root):
+        return []
+    return sorted(name for name in os.listdir(root)
+                  if BACKUP_NAME.match(name) and os.path.isdir(os.path.join(root, name)))
+
+
+def last_backup(root):
+    """Return when the newest backup under root was taken (seconds since 1970), or None"""
+    names = backups(root)
+    return time.mktime(time.strptime(names[-1], STAMP)) if names else None
+
+
+def take_backup(engine, root, keep=BACKUP_KEEP) -> tuple:
+    """Back the database up into a new directory under root, keeping the newest keep; return (path, pages)"""
+    os.makedirs(root, exist_ok=True)
+    path = os.path.join(root, datetime.datetime.now().strftime(STAMP))
+    pages = engine.backup(path)
+    for name in backups(root)[:-keep]:
+        shutil.rmtree(os.path.join(root, name))
+    # Left by backups cut short; a day on, none of them can still be running
+    for name in os.listdir(root):
+        stale = os.path.join(root, name)
+        if name.endswith(".tmp") and time.time() - os.path.getmtime(stale) > BACKUP_INTERVAL:
+            shutil.rmtree(stale, ignore_errors=True)
+    return path, pages
+
+
+class _Task:
+    """A running check, backup or run of vacuum steps, and the checkouts made meanwhile"""
+
+    def __init__(self, name):
+        self.name = name
+        self.started = time.perf_counter()
+        self.checkouts = Histogram()
+        self.steps = 0
+        self.pages = 0
+
+
+class MaintenanceScheduler:
+    """Runs integrity checks, backups and incremental vacuum on the executor's workers.
+
+    One task runs at a time, so maintenance never holds more than one
+    worker. Every CHECK_INTERVAL a quick_check runs; the backup due after
+    it is skipped from the first failed check on, so pruning never swaps
+    the last good backups for copies of a damaged database. Vacuum steps
+    run only while no checkout has happened for IDLE_SECONDS and stop at
+    the next one. The till reports each checkout's duration to
+    checkout(), and the maintenance log records every task with what
+    checkouts took while it ran and the rest of the time.
+    """
+
+    def __init__(self, root, executor, db_path, backup_dir=None, on_problem=None):
+        self.root = root
+        self.executor = executor
+        self.backup_dir = backup_dir or backup_root(db_path)
+        self.on_problem = on_problem  # called as on_problem(title, message) on the Tk thread
+        self.checkouts = Histogram()  # checkouts while no task runs
+        self.task = None
+        self.last_checkout = time.monotonic()
+        self.damaged = False
+
+        now = time.time()
+        last = last_backup(self.backup_dir)
+        self.next_check = now
+        self.next_backup = now if last is None else last + BACKUP_INTERVAL
+        self.next_vacuum = now
+        self._after_id = self.root.after(TICK, self._tick)
+
+    def checkout(self, seconds):
+        """Record a checkout's duration (StoreEngine.last_checkout) against the running task, if any"""
+        self.last_checkout = time.monotonic()
+        (self.task.checkouts if self.task else self.checkouts).observe(seconds)
+
+    def stop(self):
+        """Schedule nothing more (a task already running finishes on its worker)"""
+        if self._after_id is not None:
+            self.root.after_cancel(self._after_id)
+            self._after_id = None
+
+    def _schedule(self, delay):
+        self._after_id = self.root.after(delay, self._tick)
+
+    def _tick(self):
+        """Start whichever task is due, or take the next vacuum step while idle"""
+        self._after_id = None
+        now = time.time()
+        idle = time.monotonic() - self.last_checkout >= IDLE_SECONDS
+        if self.task is not None:
+            # Between the steps of a vacuum run
+            if idle:
+                self._submit(lambda engine: engine.vacuum_step(), self._vacuumed)
+                return
+            self._end(f"freed {self.task.pages} pages in {self.task.steps} steps, stopped for checkouts")
+            self.next_vacuum = now
+        if now >= self.next_check:
+            self.task = _Task("quick_check")
+            self._submit(lambda engine: engine.check_integrity(), self._checked)
+        elif now >= self.next_backup and not self.damaged:
+            self.task = _Task("backup")
+            self._submit(lambda engine: take_backup(engine, self.backup_dir), self._backed_up)
+        elif now >= self.next_vacuum and idle:
+            self.task = _Task("incremental vacuum")
+            self._submit(lambda engine: engine.vacuum_step(), self._vacuumed)
+        else:
+            self._schedule(TICK)
+
+    def _submit(self, func, done):
+        """Run func(engine) on a worker, then done(result) here; done returns the delay to the next tick"""
+        def failed(e):
+            task = self.task
+            self._end(f"failed: {e}")
+            if task.name == "backup" and self.on_problem:
+                self.on_problem("Backup Failed", f"The database could not be backed up: {e}")
+            retry = time.time() + RETRY_INTERVAL
+            if task.name == "quick_check":
+                self.next_check = retry
+            elif task.name == "backup":
+                self.next_backup = retry
+            else:
+                self.next_vacuum = retry
+            self._schedule(TICK)
+
+        self.executor.submit(func, callback=lambda result: self._schedule(done(result)),
+                             errback=failed, detached=True)
+
+    def _checked(self, problems):
+        self.next_check = time.time() + CHECK_INTERVAL
+        if not problems:
+            self._end("ok")
+            return TICK
+        self.damaged = True
+        self._end(f"found {len(problems)} problems, backups stopped: {problems[0]}")
+        if self.on_problem:
+            self.on_problem("Database Check",
+                            f"The database check found {len(problems)} problems "
+                            f"(e.g. {problems[0]}).\n\nBackups have stopped so the last good ones "
+                            f"in {self.backup_dir} are kept.")
+        return TICK
+
+    def _backed_up(self, result):
+        path, pages = result
+        self.next_backup = time.time() + BACKUP_INTERVAL
+        self._end(f"of {pages} pages to {path}")
+        return TICK
+
+    def _vacuumed(self, result):
+        freed, left = result
+        self.task.steps += 1
+        self.task.pages += freed
+        if freed and left:
+            return VACUUM_PAUSE
+        if left:
+            self.next_vacuum = math.inf
+            self._end(f"freed nothing: {left} free pages but auto_vacuum is off "
+                      f"(run store_maintenance.py --vacuum out of hours)")
+        elif self.task.pages:
+            self.next_vacuum = time.time() + VACUUM_INTERVAL
+            self._end(f"freed {self.task.pages} pages in {self.task.steps} steps")
+        else:
+            self.next_vacuum = time.time() + VACUUM_INTERVAL
+            self.task = None  # nothing was free: not worth a log line
+        return TICK
+
+    def _end(self, outcome):
+        """Log the finished task with the checkout latency seen during it and otherwise"""
+        task, self.task = self.task, None
+        during, otherwise = task.checkouts, self.checkouts
+        meanwhile = (f"{during.count} checkouts meanwhile: p50 {during.quantile(0.5) * 1000:.1f} ms, "
+                     f"p99 {during.quantile(0.99) * 1000:.1f} ms, max {during.max * 1000:.1f} ms"
+                     if during.count else "no checkouts meanwhile")
+        maintenance_log.info("%s %s in %.1f s; %s (otherwise %d: p50 %.1f ms, p99 %.1f ms)",
+                             task.name, outcome, time.perf_counter() - task.started, meanwhile,
+                             otherwise.count, otherwise.quantile(0.5) * 1000, otherwise.quantile(0.99) * 1000)
+
+
+def maintain(db_path, check=False, backup=False, vacuum=False, backup_dir=None,
+             keep=BACKUP_KEEP, report=print) -> bool:
+    """Run the chosen tasks in order: check, backup, vacuum. Return False if the check found problems"""
+    engine = StoreEngine(db_path)
+    try:
+        if check:
+            t0 = time.perf_counter()
+            problems = engine.check_integrity(deep=True)
+            report(f"integrity check: {f'{len(problems)} problems' if problems else 'ok'} "
+                   f"in {time.perf_counter() - t0:.1f} s")
+            for line in problems[:20]:
+                report(f"  {line}")
+            if problems:
+                return False
+        if backup:
+            t0 = time.perf_counter()
+            path, pages = take_backup(engine, backup_dir or backup_root(db_path), keep)
+            report(f"backed up {pages} pages to {path} in {time.perf_counter() - t0:.1f} s")
+        if vacuum:
+            before = file_size(engine.conn, db_path)
+            t0 = time.perf_counter()
+            engine.conn.execute("VACUUM")
+            report(f"vacuumed in {time.perf_counter() - t0:.1f} s: {before / 2 ** 20:.1f} MiB -> "
+                   f"{file_size(engine.conn, db_path) / 2 ** 20:.1f} MiB")
+    finally:
+        engine.close()
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--db", default=DB_PATH,
+                        help="database file (default: $MEDICAL_STORE_DB or medical_store.db)")
+    parser.add_argument("--check", action="store_true",
+                        help="run PRAGMA integrity_check, and stop there if it finds problems")
+    parser.add_argument("--backup", action="store_true",
+                        help="copy the database and its sales archives into a new directory")
+    parser.add_argument("--backup-dir", help="where backups go (default: <db>_backups)")
+    parser.add_argument("--keep", type=int, default=BACKUP_KEEP,
+                        help=f"backups kept, oldest removed first (default: {BACKUP_KEEP})")
+    parser.add_argument("--vacuum", action="store_true",
+                        help="rebuild the file with incremental auto-vacuum on (needs free disk the size of it)")
+    args = parser.parse_args()
+    if not (args.check or args.backup or args.vacuum):
+        parser.error("nothing to do: pass --check, --backup and/or --vacuum")
+    if args.keep < 1:
+        parser.error("--keep must be at least 1")
+    try:
+        ok = maintain(args.db, args.check, args.backup, args.vacuum, args.backup_dir, args.keep)
+    except StoreError as e:
+        parser.exit(1, f"{e}\n")
+    if not ok:
+        parser.exit(1)
+
+
+if __name__ == "__main__":
+    main()
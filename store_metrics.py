@@ -0,0 +1,363 @@
+import bisect
+import functools
+import json
+import logging
+import logging.handlers
+import re
+import sqlite3
+import threading
+import time
+
+# Histogram bucket upper bounds in seconds (Prometheus "le" labels)
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+           0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Statements at least this slow are written to the slow-query log with their plan
+SLOW_QUERY_SECONDS = 0.1
+# Distinct statement shapes tracked; any beyond this share one "(other)" series
+MAX_STATEMENTS = 500
+# Size and number of old files kept for the slow-query, metrics and maintenance logs
+LOG_MAX_BYTES = 5 * 1024 * 1024
+LOG_BACKUPS = 5
+
+PLANNED = re.compile(r"\s*(SELECT|WITH|INSERT|UPDATE|DELETE|REPLACE)\b", re.IGNORECASE)
+PLACEHOLDER_LIST = re.compile(r"\?(?:\s*,\s*\?)+")
+
+slow_log = logging.getLogger("store.slow_queries")
+metrics_log = logging.getLogger("store.metrics")
+maintenance_log = logging.getLogger("store.maintenance")
+
+
+class Histogram:
+    """Bucketed latency counts for one statement or UI handler"""
+
+    __slots__ = ('counts', 'count', 'total', 'rows', 'max')
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)  # last bucket is +Inf
+        self.count = 0
+        self.total = 0.0
+        self.rows = 0
+        self.max = 0.0
+
+    def observe(self, seconds, rows=0):
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        self.rows += rows
+        if seconds > self.max:
+            self.max = seconds
+
+    def quantile(self, q) -> float:
+        """Estimate a quantile by interpolating within its bucket, like histogram_quantile"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            if n and seen + n >= rank:
+                # The observed maximum narrows the top bucket in use
+                upper = min(BUCKETS[i], self.max) if i < len(BUCKETS) else self.max
+                lower = min(BUCKETS[i - 1], upper) if i else 0.0
+                return lower + (upper - lower) * (rank - seen) / n
+            seen += n
+        return self.max
+
+    def summary(self) -> dict:
+        return {
+            'count': self.count,
+            'rows': self.rows,
+            'total_ms': round(self.total * 1000, 3),
+            'p50_ms': round(self.quantile(0.5) * 1000, 3),
+            'p99_ms': round(self.quantile(0.99) * 1000, 3),
+            'max_ms': round(self.max * 1000, 3),
+            'buckets': list(self.counts),
+        }
+
+
+class Metrics:
+    """Process-wide latency histograms for SQL statements and UI handlers.
+
+    Statements are keyed by their SQL with whitespace collapsed and
+    placeholder lists of any length folded together, so one query shape
+    is one series however many ids it was run with. Every connection from
+    store_db.connect feeds the shared METRICS instance; set enabled to
+    False to measure without it.
+    """
+
+    def __init__(self, slow_seconds=SLOW_QUERY_SECONDS):
+        self.enabled = True
+        self.slow_seconds = slow_seconds
+        self.started = time.time()
+        self.statements = {}  # statement key -> Histogram
+        self.handlers = {}  # handler name -> Histogram
+        self.slow_queries = 0
+        self._keys = {}  # raw SQL -> statement key
+        self._lock = threading.Lock()
+
+    def statement_key(self, sql) -> str:
+        key = self._keys.get(sql)
+        if key is None:
+            key = PLACEHOLDER_LIST.sub("?, ...", " ".join(sql.split()))
+            if len(self._keys) >= 4 * MAX_STATEMENTS:
+                self._keys.clear()
+            self._keys[sql] = key
+        return key
+
+    def observe_statement(self, sql, seconds, rows=0):
+        key = self.statement_key(sql)
+        with self._lock:
+            histogram = self.statements.get(key)
+            if histogram is None:
+                if len(self.statements) >= MAX_STATEMENTS:
+                    key = "(other)"
+                histogram = self.statements.setdefault(key, Histogram())
+            histogram.observe(seconds, rows)
+            if seconds >= self.slow_seconds:
+                self.slow_queries += 1
+
+    def observe_handler(self, name, seconds):
+        with self._lock:
+            histogram = self.handlers.get(name)
+            if histogram is None:
+                histogram = self.handlers[name] = Histogram()
+            histogram.observe(seconds)
+
+    def reset(self):
+        """Forget everything recorded so far"""
+        with self._lock:
+            self.statements.clear()
+            self.handlers.clear()
+            self.slow_queries = 0
+            self.started = time.time()
+
+    def snapshot(self) -> dict:
+        """Return a JSON-ready summary of every series"""
+        with self._lock:
+            return {
+                'since': self.started,
+                'at': time.time(),
+                'slow_queries': self.slow_queries,
+                'statements': {key: h.summary() for key, h in self.statements.items()},
+                'handlers': {name: h.summary() for name, h in self.handlers.items()},
+            }
+
+    def prometheus(self) -> str:
+        """Render every series in the Prometheus text exposition format"""
+        lines = []
+        with self._lock:
+            for metric, label, series, help_text in (
+                    ('store_statement_seconds', 'statement', self.statements,
+                     "SQL statement latency, including fetching its rows"),
+                    ('store_handler_seconds', 'handler', self.handlers,
+                     "Time spent in UI handlers on the Tk thread")):
+                lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} histogram"]
+                for name, histogram in series.items():
+                    labels = f'{label}="{_escape(name)}"'
+                    cumulative = 0
+                    for bound, n in zip(BUCKETS + ("+Inf",), histogram.counts):
+                        cumulative += n
+                        lines.append(f'{metric}_bucket{{{labels},le="{bound}"}} {cumulative}')
+                    lines.append(f"{metric}_sum{{{labels}}} {histogram.total}")
+                    lines.append(f"{metric}_count{{{labels}}} {histogram.count}")
+
+            lines += ["# HELP store_statement_rows_total Rows returned or changed by SQL statements",
+                      "# TYPE store_statement_rows_total counter"]
+            for name, histogram in self.statements.items():
+                lines.append(f'store_statement_rows_total{{statement="{_escape(name)}"}} {histogram.rows}')
+            lines += ["# HELP store_slow_queries_total Statements slower than the slow-query threshold",
+                      "# TYPE store_slow_queries_total counter",
+                      f"store_slow_queries_total {self.slow_queries}"]
+        return "\n".join(lines) + "\n"
+
+
+METRICS = Metrics()
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _record(conn, sql, parameters, seconds, rows, explain=True):
+    """Record one statement and log it with its plan if it was slow"""
+    METRICS.observe_statement(sql, seconds, rows)
+    if seconds < METRICS.slow_seconds or not slow_log.isEnabledFor(logging.INFO):
+        return
+    plan = []
+    if explain and parameters is not None and PLANNED.match(sql):
+        try:
+            # The base class execute is not metered, so this is not recorded itself
+            plan = [row[3] for row in sqlite3.Connection.execute(
+                conn, "EXPLAIN QUERY PLAN " + sql, parameters)]
+        except sqlite3.Error as e:
+            plan = [f"(no plan: {e})"]
+    slow_log.info("%.1f ms, %d rows: %s%s", seconds * 1000, rows, " ".join(sql.split()),
+                  "".join("\n    " + line for line in plan))
+
+
+class MeteredCursor(sqlite3.Cursor):
+    """Cursor that times every statement into METRICS.
+
+    A statement's time includes fetching its rows with fetchone (the first
+    row), fetchmany or fetchall. Rows read by iterating the cursor are not
+    timed or counted; the statement is recorded when the cursor runs its
+    next statement, is closed or is garbage collected.
+    """
+
+    def __init__(self, connection):
+        super().__init__(connection)
+        # [sql, parameters, seconds, rows] while a query's rows are being fetched
+        self._pending = None
+
+    def execute(self, sql, parameters=()):
+        if not METRICS.enabled:
+            return super().execute(sql, parameters)
+        if self._pending is not None:
+            self._finish()
+        started = time.perf_counter()
+        try:
+            super().execute(sql, parameters)
+        except BaseException:
+            _record(self.connection, sql, parameters, time.perf_counter() - started, 0)
+            raise
+        elapsed = time.perf_counter() - started
+        if self.description is None:
+            _record(self.connection, sql, parameters, elapsed, max(self.rowcount, 0))
+        else:
+            self._pending = [sql, parameters, elapsed, 0]
+        return self
+
+    def executemany(self, sql, seq_of_parameters):
+        if not METRICS.enabled:
+            return super().executemany(sql, seq_of_parameters)
+        if self._pending is not None:
+            self._finish()
+        started = time.perf_counter()
+        try:
+            super().executemany(sql, seq_of_parameters)
+        finally:
+            # No plan for executemany: its parameters may be a consumed iterator
+            _record(self.connection, sql, None, time.perf_counter() - started,
+                    max(self.rowcount, 0))
+        return self
+
+    def fetchone(self):
+        if self._pending is None:
+            return super().fetchone()
+        started = time.perf_counter()
+        row = super().fetchone()
+        self._pending[2] += time.perf_counter() - started
+        self._pending[3] += row is not None
+        self._finish()
+        return row
+
+    def fetchmany(self, size=None):
+        if self._pending is None:
+            return super().fetchmany(self.arraysize if size is None else size)
+        size = self.arraysize if size is None else size
+        started = time.perf_counter()
+        rows = super().fetchmany(size)
+        self._pending[2] += time.perf_counter() - started
+        self._pending[3] += len(rows)
+        if len(rows) < size:
+            self._finish()
+        return rows
+
+    def fetchall(self):
+        if self._pending is None:
+            return super().fetchall()
+        started = time.perf_counter()
+        rows = super().fetchall()
+        self._pending[2] += time.perf_counter() - started
+        self._pending[3] += len(rows)
+        self._finish()
+        return rows
+
+    def close(self):
+        if self._pending is not None:
+            self._finish()
+        super().close()
+
+    def __del__(self):
+        if self._pending is not None:
+            # Never query from a finalizer, so no plan here
+            self._finish(explain=False)
+
+    def _finish(self, explain=True):
+        sql, parameters, seconds, rows = self._pending
+        self._pending = None
+        _record(self.connection, sql, parameters, seconds, rows, explain)
+
+
+class MeteredConnection(sqlite3.Connection):
+    """Connection whose cursors, including the execute shortcuts, are metered"""
+
+    def cursor(self, factory=MeteredCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+def timed(name):
+    """Decorator recording each call's duration as UI handler name"""
+    def decorate(func):
+        @functools.wraps(func)
+        def handler(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                METRICS.observe_handler(name, time.perf_counter() - started)
+        return handler
+    return decorate
+
+
+def configure_logs(slow_log_path=None, metrics_log_path=None, maintenance_log_path=None,
+                   max_bytes=LOG_MAX_BYTES, backups=LOG_BACKUPS):
+    """Send slow queries, metrics snapshots and maintenance runs to rotating files"""
+    for logger, path, fmt in ((slow_log, slow_log_path, "%(asctime)s %(message)s"),
+                              (metrics_log, metrics_log_path, "%(message)s"),
+                              (maintenance_log, maintenance_log_path, "%(asctime)s %(message)s")):
+        if not path:
+            continue
+        handler = logging.handlers.RotatingFileHandler(
+            path, maxBytes=max_bytes, backupCount=backups, encoding='utf-8', delay=True)
+        handler.setFormatter(logging.Formatter(fmt))
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+
+
+def log_snapshot():
+    """Append the current snapshot to the metrics log as one JSON line"""
+    if metrics_log.isEnabledFor(logging.INFO):
+        metrics_log.info("%s", json.dumps(METRICS.snapshot(), separators=(',', ':')))
+
+
+def serve_metrics(port, host='127.0.0.1'):
+    """Serve METRICS at http://host:port/metrics from a daemon thread; returns the server"""
+    # Imported here so the GUI only pays for http.server when the endpoint is on
+    import http.server
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = METRICS.prometheus().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="store-metrics", daemon=True).start()
+    return server
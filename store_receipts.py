@@ -0,0 +1,155 @@
+import os
+
+from store_bill import RECEIPT_HEADER, RULE, TOTAL_LABEL, format_paise, receipt_line, to_paise
+
+FORMATS = ('txt', 'pdf')
+CHUNK_SIZE = 500
+
+# PDF page layout, in points (Courier is 0.6 em wide)
+PDF_FONT_SIZE = 10
+PDF_LEADING = 12
+PDF_MARGIN = 20
+
+
+def render_text(bill, lines) -> str:
+    """Render one receipt from a bill row and its sale lines (see StoreEngine.iter_bills)"""
+    bill_id, customer_name, total_amount, bill_date = bill
+    parts = [RECEIPT_HEADER]
+    for name, quantity, price, total in lines:
+        parts.append(receipt_line(name or "", quantity, to_paise(price or 0), to_paise(total or 0)))
+    if not lines:
+        parts.append("(line items not recorded)\n")
+    parts += [RULE, TOTAL_LABEL, format_paise(to_paise(total_amount or 0)), "\n", RULE,
+              f"\nBill ID: {bill_id}\n", f"Customer: {customer_name}\n", f"Date: {bill_date}\n"]
+    return "".join(parts)
+
+
+def render_pdf(text) -> bytes:
+    """Lay receipt text out as a one-page PDF using the built-in Courier font"""
+    lines = text.replace("₹", "Rs.").splitlines()
+    width = 2 * PDF_MARGIN + int(max(map(len, lines), default=0) * PDF_FONT_SIZE * 0.6)
+    height = 2 * PDF_MARGIN + PDF_LEADING * len(lines)
+
+    def escape(line):
+        return line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+    stream = (f"BT /F1 {PDF_FONT_SIZE} Tf {PDF_LEADING} TL "
+              f"{PDF_MARGIN} {height - PDF_MARGIN - PDF_FONT_SIZE} Td "
+              + " ".join(f"({escape(line)}) Tj T*" for line in lines)
+              + " ET").encode('latin-1', 'replace')
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+        (f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {width} {height}] "
+         f"/Resources << /Font << /F1 4 0 R >> >> /Contents 5 0 R >>").encode(),
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Courier /Encoding /WinAnsiEncoding >>",
+        b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream",
+    ]
+
+    pdf = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(pdf))
+        pdf += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref = len(pdf)
+    pdf += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        pdf += b"%010d 00000 n \n" % offset
+    pdf += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return bytes(pdf)
+
+
+def render_receipt(bill, lines, fmt='txt') -> bytes:
+    """Render one receipt as the bytes of a .txt or .pdf file"""
+    text = render_text(bill, lines)
+    return render_pdf(text) if fmt == 'pdf' else text.encode('utf-8')
+
+
+def _render_chunk(fmt, chunk):
+    """Worker: render a chunk of (bill, lines) into (filename, bytes) pairs"""
+    return [(f"bill_{bill[0]:08d}.{fmt}", render_receipt(bill, lines, fmt)) for bill, lines in chunk]
+
+
+class _Writer:
+    """Writes rendered receipts into a directory or a zip archive"""
+
+    def __init__(self, target):
+        self.zip = None
+        self.directory = None
+        if target.lower().endswith('.zip'):
+            import zipfile
+            self.zip = zipfile.ZipFile(target, 'w', zipfile.ZIP_DEFLATED)
+        else:
+            os.makedirs(target, exist_ok=True)
+            self.directory = target
+
+    def write(self, files):
+        for name, data in files:
+            if self.zip is not None:
+                self.zip.writestr(name, data)
+            else:
+                with open(os.path.join(self.directory, name), 'wb') as f:
+                    f.write(data)
+
+    def close(self):
+        if self.zip is not None:
+            self.zip.close()
+
+
+def spool_receipts(engine, target, from_date=None, to_date=None, bill_ids=None, fmt='txt',
+                   workers=None, progress=None, chunk_size=CHUNK_SIZE) -> int:
+    """Render receipts for many bills into a directory or .zip and return the count.
+
+    Bills come from engine.iter_bills (by date range or bill_ids) in
+    chunks, which are rendered in a process pool while the next chunks
+    are read; results are written in order as they complete. workers=0
+    renders in this process, which is faster for a handful of bills.
+    progress(receipts written) is called after each chunk.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown receipt format {fmt!r}")
+
+    chunks = engine.iter_bills(from_date, to_date, bill_ids, chunk_size=chunk_size)
+    if workers is None:
+        # With a single core the pool only adds pickling overhead
+        workers = os.cpu_count() or 1
+        if workers == 1:
+            workers = 0
+
+    writer = _Writer(target)
+    count = 0
+    try:
+        if workers == 0:
+            for chunk in chunks:
+                writer.write(_render_chunk(fmt, chunk))
+                count += len(chunk)
+                if progress:
+                    progress(count)
+            return count
+
+        # Imported here: the pool is only needed for large spools, not at startup
+        import concurrent.futures
+        import multiprocessing
+
+        # spawn: safe to start from a GUI process that already runs threads
+        context = multiprocessing.get_context('spawn')
+        with concurrent.futures.ProcessPoolExecutor(workers, mp_context=context) as pool:
+            pending = []
+            for chunk in chunks:
+                pending.append(pool.submit(_render_chunk, fmt, chunk))
+                # Keep a bounded number of chunks in flight
+                while len(pending) > 2 * workers or (pending and pending[0].done()):
+                    files = pending.pop(0).result()
+                    writer.write(files)
+                    count += len(files)
+                    if progress:
+                        progress(count)
+            for future in pending:
+                files = future.result()
+                writer.write(files)
+                count += len(files)
+                if progress:
+                    progress(count)
+        return count
+    finally:
+        writer.close()
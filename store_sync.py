@@ -0,0 +1,513 @@
+"""Sync a branch store with a head office database in compressed batches.
+
+    python store_sync.py --db medical_store.db --hub head_office.db
+
+Triggers log every insert and update of medicines, bills and sales in
+sync_log (migration 11). A sync pushes the changes this node logged since
+its last push, then pulls what the hub logged since its last pull, up to
+BATCH_ROWS log entries per batch. Each changed row is sent once per batch
+whatever number of times it changed, so a sync costs O(changes since the
+last sync), not O(database).
+
+Rows are identified across stores by (origin node, id at the origin),
+kept in sync_rows with each row's version vector. An edit made on one
+node is applied on another when its version has seen everything the
+local copy has. Concurrent edits of the same medicine go to the version
+with more updates, then the higher node id, on every node alike. Stock
+is not a field: each node counts what it added and removed, merged by
+taking each node's highest counts, so stock moves made at different
+stores all survive any order of syncs. Quantities changed by a sync are
+journalled in the stock ledger as adjustments.
+
+Branches push medicines, bills and sales. Each branch keeps its own
+medicines and stock: the hub sends a branch back only changes made at
+head office to that branch's medicines, such as new prices or stock
+moved in or out, never other branches' rows.
+"""
+import argparse
+import hashlib
+import json
+import zlib
+
+from store_db import DB_PATH
+from store_engine import SYNC_TABLES, StoreEngine, StoreError
+
+BATCH_ROWS = 5000
+COMPRESS_LEVEL = 6
+
+# Synced columns per table, in apply order (referenced tables first).
+# medicines.quantity travels as stock counters instead.
+FIELDS = {
+    'medicines': ('name', 'company', 'category', 'purchase_price', 'sale_price',
+                  'expiry_date', 'barcode', 'reorder_level'),
+    'bills_data': ('customer_name', 'total_paise', 'bill_ts'),
+    'sales_data': ('med_name', 'quantity', 'price_paise', 'total_paise', 'sale_ts'),
+}
+# Columns that hold another synced row's id
+REFERENCES = {
+    'sales_data': (('med_id', 'medicines'), ('bill_id', 'bills_data')),
+}
+
+
+class SyncResult:
+    """Counts and bytes moved by a sync"""
+
+    def __init__(self):
+        self.pushed = 0
+        self.pulled = 0
+        self.conflicts = 0
+        self.batches = 0
+        self.sent = 0
+        self.received = 0
+
+    def summary(self):
+        return (f"{self.pushed} rows pushed, {self.pulled} pulled, {self.conflicts} conflicts "
+                f"in {self.batches} batches ({self.sent:,} bytes sent, {self.received:,} received)")
+
+
+def _state(cursor, key, default=None):
+    row = cursor.execute("SELECT value FROM sync_state WHERE key = ?", (key,)).fetchone()
+    return default if row is None or row[0] is None else row[0]
+
+
+def _set_state(cursor, key, value):
+    cursor.execute("INSERT OR REPLACE INTO sync_state (key, value) VALUES (?, ?)", (key, value))
+
+
+def node_id(engine) -> str:
+    """Return this database's sync node id"""
+    return _state(engine.cursor, 'node_id')
+
+
+def _digest(values):
+    """Fingerprint of a row's synced values, to tell local edits from synced ones.
+
+    repr is stable for the str/int/float/None lists rows are read as, and
+    twice as fast as json.dumps here.
+    """
+    return hashlib.blake2b(repr(values).encode(), digest_size=8).hexdigest()
+
+
+def _dominates(a, b):
+    """True if version vector a has seen every update b has"""
+    return all(a.get(node, 0) >= count for node, count in b.items())
+
+
+def _merge(a, b):
+    return {node: max(a.get(node, 0), b.get(node, 0)) for node in a.keys() | b.keys()}
+
+
+def _stock_total(counters):
+    return sum(added - removed for added, removed in counters.values())
+
+
+def _merge_stock(a, b):
+    """Each node's highest added and removed counts"""
+    merged = dict(a)
+    for node, (added, removed) in b.items():
+        mine = merged.get(node, (0, 0))
+        merged[node] = [max(mine[0], added), max(mine[1], removed)]
+    return merged
+
+
+def _ids(values):
+    return json.dumps(sorted(values))
+
+
+def _origins(cursor, table, row_ids, me):
+    """Map local row ids of a table to their (origin, origin_id)"""
+    origins = {row_id: (me, row_id) for row_id in row_ids}
+    cursor.execute('''
+        SELECT row_id, origin, origin_id FROM sync_rows
+        WHERE tbl = ? AND row_id IN (SELECT value FROM json_each(?))
+    ''', (table, _ids(origins)))
+    for row_id, origin, origin_id in cursor.fetchall():
+        origins[row_id] = (origin, origin_id)
+    return origins
+
+
+def _local_ids(cursor, table, keys, me):
+    """Map (origin, origin_id) pairs to local row ids of a table, where known"""
+    local = {}
+    by_origin = {}
+    for origin, origin_id in keys:
+        by_origin.setdefault(origin, []).append(origin_id)
+    for origin, origin_ids in by_origin.items():
+        cursor.execute('''
+            SELECT origin_id, row_id FROM sync_rows
+            WHERE tbl = ? AND origin = ? AND origin_id IN (SELECT value FROM json_each(?))
+        ''', (table, origin, _ids(origin_ids)))
+        found = dict(cursor.fetchall())
+        if origin == me:
+            # Own rows that were never synced have no sync_rows entry
+            key = SYNC_TABLES[table]
+            cursor.execute(f'''
+                SELECT {key} FROM {table} WHERE {key} IN (SELECT value FROM json_each(?))
+            ''', (_ids(set(origin_ids) - set(found)),))
+            found.update((row_id, row_id) for row_id, in cursor.fetchall())
+        local.update(((origin, origin_id), row_id) for origin_id, row_id in found.items())
+    return local
+
+
+def _read_rows(cursor, table, row_ids, me):
+    """Return {row_id: (values, quantity)} with references as [origin, origin_id]"""
+    key = SYNC_TABLES[table]
+    references = REFERENCES.get(table, ())
+    columns = list(FIELDS[table]) + [column for column, _ in references]
+    if table == 'medicines':
+        columns.append('quantity')
+    cursor.execute(f'''
+        SELECT {key}, {", ".join(columns)} FROM {table}
+        WHERE {key} IN (SELECT value FROM json_each(?))
+    ''', (_ids(row_ids),))
+    rows = {row[0]: list(row[1:]) for row in cursor.fetchall()}
+
+    width = len(FIELDS[table])
+    for offset, (column, target) in enumerate(references, width):
+        origins = _origins(cursor, target, {row[offset] for row in rows.values()} - {None}, me)
+        for row in rows.values():
+            if row[offset] is not None:
+                row[offset] = list(origins[row[offset]])
+    end = width + len(references)
+    return {row_id: (row[:end], row[end] if table == 'medicines' else None)
+            for row_id, row in rows.items()}
+
+
+def _sync_rows(cursor, table, row_ids):
+    """Return {row_id: (origin, origin_id, version, writer, digest, stock)} for synced rows"""
+    cursor.execute('''
+        SELECT row_id, origin, origin_id, version, writer, digest, stock FROM sync_rows
+        WHERE tbl = ? AND row_id IN (SELECT value FROM json_each(?))
+    ''', (table, _ids(row_ids)))
+    return {row[0]: (row[1], row[2], json.loads(row[3]), row[4], row[5], json.loads(row[6] or '{}'))
+            for row in cursor.fetchall()}
+
+
+def _save_sync_rows(cursor, table, rows):
+    cursor.executemany('''
+        INSERT OR REPLACE INTO sync_rows (tbl, row_id, origin, origin_id, version, writer, digest, stock)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ''', [(table, row_id, origin, origin_id, json.dumps(version), writer, digest,
+           json.dumps(stock) if table == 'medicines' else None)
+          for row_id, (origin, origin_id, version, writer, digest, stock) in rows.items()])
+
+
+def collect_changes(engine, since, peer=None, limit=BATCH_ROWS):
+    """Pack the changes logged after change_id since into a compressed batch.
+
+    Without peer these are this node's own changes, for pushing. For a
+    peer (on the hub) they are the changes the peer did not send itself
+    to the peer's own medicines. Rows edited here since they were
+    last sent get their version bumped, and their stock counters take
+    the quantity change. Returns (payload, last change_id read, rows);
+    payload is None when the range held nothing to send.
+    """
+    cursor = engine.cursor
+    me = node_id(engine)
+    try:
+        cursor.execute("BEGIN IMMEDIATE")
+        if peer is None:
+            cursor.execute('''
+                SELECT change_id, tbl, row_id FROM sync_log
+                WHERE change_id > ? AND source IS NULL ORDER BY change_id LIMIT ?
+            ''', (since, limit))
+        else:
+            cursor.execute('''
+                SELECT change_id, tbl, row_id FROM sync_log
+                WHERE change_id > ? AND source IS NOT ? ORDER BY change_id LIMIT ?
+            ''', (since, peer, limit))
+        logged = cursor.fetchall()
+        last = logged[-1][0] if logged else since
+
+        tables = {}
+        count = 0
+        for table in FIELDS:
+            row_ids = {row_id for _, tbl, row_id in logged if tbl == table}
+            if not row_ids or (peer is not None and table != 'medicines'):
+                continue
+            current = _read_rows(cursor, table, row_ids, me)
+            synced = _sync_rows(cursor, table, current)
+            changed = {}
+            rows = []
+            for row_id, (values, quantity) in sorted(current.items()):
+                origin, origin_id, version, writer, digest, stock = synced.get(
+                    row_id, (me, row_id, {}, me, None, {}))
+                state = (origin, origin_id, version, writer, digest, stock)
+                if _digest(values) != digest:
+                    version = dict(version, **{me: version.get(me, 0) + 1})
+                    state = (origin, origin_id, version, me, _digest(values), stock)
+                    changed[row_id] = state
+                if quantity is not None and quantity != _stock_total(stock):
+                    added, removed = stock.get(me, (0, 0))
+                    difference = quantity - _stock_total(stock)
+                    stock = dict(stock, **{me: [added + max(difference, 0), removed + max(-difference, 0)]})
+                    state = state[:5] + (stock,)
+                    changed[row_id] = state
+                if peer is not None and origin != peer:
+                    continue
+                origin, origin_id, version, writer, _, stock = state
+                rows.append([origin, origin_id, version, writer, values]
+                            + ([stock] if table == 'medicines' else []))
+            _save_sync_rows(cursor, table, changed)
+            if rows:
+                tables[table] = rows
+                count += len(rows)
+        engine.conn.commit()
+    except Exception:
+        engine.conn.rollback()
+        raise
+
+    if not tables:
+        return None, last, 0
+    payload = zlib.compress(json.dumps({'node': me, 'tables': tables}).encode(), COMPRESS_LEVEL)
+    return payload, last, count
+
+
+def apply_changes(engine, payload, state=None) -> tuple:
+    """Apply a batch from collect_changes and return (rows applied, conflicts).
+
+    Runs in one transaction, which also stores the {key: value} pairs in
+    state (the caller's sync cursor), so a batch is applied exactly once
+    or not at all. Applying the same batch again changes nothing.
+    """
+    batch = json.loads(zlib.decompress(payload))
+    source = batch['node']
+    cursor = engine.cursor
+    me = node_id(engine)
+    applied = conflicts = 0
+    restocked = []
+    try:
+        cursor.execute("BEGIN IMMEDIATE")
+        _set_state(cursor, 'source', source)
+        for table, rows in ((table, batch['tables'].get(table)) for table in FIELDS):
+            if not rows:
+                continue
+            applied += len(rows)
+            conflicts += _apply_table(engine, table, rows, me, restocked)
+        cursor.execute("DELETE FROM sync_state WHERE key = 'source'")
+        for key, value in (state or {}).items():
+            _set_state(cursor, key, value)
+        if restocked:
+            engine.reconcile_stock(restocked, note=f"sync from {source[:8]}")
+        engine.conn.commit()
+    except Exception:
+        engine.conn.rollback()
+        raise
+
+    if restocked or 'medicines' in batch['tables']:
+        engine.catalog.invalidate()
+    return applied, conflicts
+
+
+def _apply_table(engine, table, rows, me, restocked):
+    """Insert or merge one table's rows from a batch; return the conflicts"""
+    cursor = engine.cursor
+    key = SYNC_TABLES[table]
+    fields = FIELDS[table]
+    references = REFERENCES.get(table, ())
+    local_ids = _local_ids(cursor, table, [(row[0], row[1]) for row in rows], me)
+    current = _read_rows(cursor, table, set(local_ids.values()), me)
+    synced = _sync_rows(cursor, table, current)
+
+    # References to rows this store does not have are left empty
+    targets = {}
+    for offset, (_, target) in enumerate(references, len(fields)):
+        targets[offset] = _local_ids(cursor, target, {tuple(row[4][offset]) for row in rows
+                                                      if row[4][offset] is not None}, me)
+
+    def local_values(values):
+        values = list(values)
+        for offset, found in targets.items():
+            if values[offset] is not None:
+                values[offset] = found.get(tuple(values[offset]))
+        return values
+
+    if table == 'medicines':
+        _drop_taken_barcodes(cursor, rows, local_ids, fields.index('barcode'))
+
+    columns = list(fields) + [column for column, _ in references]
+    inserts, updates, states, quantities = [], [], {}, {}
+    conflicts = 0
+    for row in rows:
+        origin, origin_id, version, writer, values = row[:5]
+        stock = row[5] if table == 'medicines' else {}
+        row_id = local_ids.get((origin, origin_id))
+        if row_id is None:
+            inserts.append((row, local_values(values), _stock_total(stock)))
+            continue
+
+        local, quantity = current[row_id]
+        _, _, mine, my_writer, digest, my_stock = synced.get(row_id, (me, row_id, {}, me, None, {}))
+        if _digest(local) != digest:
+            # Edited here since last sent: count the edit it will be sent as
+            mine_now, writer_now = dict(mine, **{me: mine.get(me, 0) + 1}), me
+        else:
+            mine_now, writer_now = mine, my_writer
+
+        if _dominates(mine_now, version):
+            take = False
+        elif _dominates(version, mine_now):
+            take = True
+        else:
+            conflicts += 1
+            take = (sum(version.values()), writer) > (sum(mine_now.values()), writer_now)
+            if not take and digest == _digest(local):
+                # Nothing queued here would carry the winning values back
+                cursor.execute("INSERT INTO sync_log (tbl, row_id) VALUES (?, ?)", (table, row_id))
+
+        if take:
+            updates.append(local_values(values) + [row_id])
+            digest, my_writer = _digest(values), writer
+        merged_stock = _merge_stock(my_stock, stock)
+        states[row_id] = (origin, origin_id, _merge(mine, version), my_writer, digest, merged_stock)
+        if table == 'medicines':
+            # Stock moved here but not yet counted stays on top of the merge
+            target = _stock_total(merged_stock) + (quantity or 0) - _stock_total(my_stock)
+            if target != quantity:
+                quantities[row_id] = target
+
+    if updates:
+        assignments = ", ".join(f"{column} = ?" for column in columns)
+        cursor.executemany(f"UPDATE {table} SET {assignments} WHERE {key} = ?", updates)
+    if quantities:
+        cursor.executemany("UPDATE medicines SET quantity = ? WHERE med_id = ?",
+                           [(quantity, row_id) for row_id, quantity in quantities.items()])
+        restocked.extend(quantities)
+
+    # Keys are handed out in insert order, so new rows are the ones past the old maximum
+    last_id = cursor.execute(f"SELECT COALESCE(MAX({key}), 0) FROM {table}").fetchone()[0]
+    insert_columns = columns + (['quantity'] if table == 'medicines' else [])
+    cursor.executemany(f'''
+        INSERT INTO {table} ({", ".join(insert_columns)})
+        VALUES ({", ".join("?" * len(insert_columns))})
+    ''', [values + ([quantity] if table == 'medicines' else []) for _, values, quantity in inserts])
+    cursor.execute(f"SELECT {key} FROM {table} WHERE {key} > ? ORDER BY {key}", (last_id,))
+    inserted = [row_id for row_id, in cursor.fetchall()]
+    for row_id, (row, _, _) in zip(inserted, inserts):
+        origin, origin_id, version, writer, remote = row[:5]
+        states[row_id] = (origin, origin_id, version, writer, _digest(remote),
+                          row[5] if table == 'medicines' else {})
+    _save_sync_rows(cursor, table, states)
+
+    if table == 'medicines':
+        restocked.extend(row_id for row_id in inserted if states[row_id][5])
+    elif table == 'sales_data' and inserted:
+        ids = _ids(inserted)
+        cursor.execute('''
+            INSERT INTO bill_items (bill_id, sale_id)
+            SELECT bill_id, sale_id FROM sales_data
+            WHERE sale_id IN (SELECT value FROM json_each(?)) AND bill_id IS NOT NULL
+        ''', (ids,))
+        engine.roll_up_sales(inserted)
+    return conflicts
+
+
+def _drop_taken_barcodes(cursor, rows, local_ids, offset):
+    """Clear synced barcodes another local medicine already has"""
+    barcodes = {row[4][offset] for row in rows if row[4][offset]}
+    if not barcodes:
+        return
+    cursor.execute('''
+        SELECT barcode, med_id FROM medicines WHERE barcode IN (SELECT value FROM json_each(?))
+    ''', (json.dumps(sorted(barcodes)),))
+    owners = dict(cursor.fetchall())
+    for row in rows:
+        barcode = row[4][offset]
+        if barcode in owners and owners[barcode] != local_ids.get((row[0], row[1])):
+            row[4][offset] = None
+
+
+class SyncHub:
+    """The head office end of a sync: a store database branches push to and pull from.
+
+    Stands in for a sync server. Every call is its own transaction, so
+    any number of branches can sync against one hub file.
+    """
+
+    def __init__(self, db_path):
+        self.engine = StoreEngine(db_path)
+        self.node = node_id(self.engine)
+
+    def push(self, payload) -> tuple:
+        """Apply a branch's batch; return (rows applied, conflicts)"""
+        return apply_changes(self.engine, payload)
+
+    def pull(self, node, since, limit=BATCH_ROWS):
+        """Return (payload, last change_id, rows) for a branch, as collect_changes"""
+        return collect_changes(self.engine, since, peer=node, limit=limit)
+
+    def close(self):
+        self.engine.close()
+
+
+def sync(engine, hub, progress=None) -> SyncResult:
+    """Push this node's changes to hub, then pull the hub's; return the counts.
+
+    progress(result) is called after every batch. The push cursor moves
+    only once the hub has applied a batch, and the pull cursor is stored
+    with the batch it covers, so an interrupted sync resumes where it
+    stopped.
+    """
+    result = SyncResult()
+    me = node_id(engine)
+    cursor = engine.cursor
+
+    while True:
+        since = int(_state(cursor, 'pushed', 0))
+        payload, last, count = collect_changes(engine, since)
+        if last == since:
+            break
+        if payload:
+            _, conflicts = hub.push(payload)
+            result.pushed += count
+            result.conflicts += conflicts
+            result.sent += len(payload)
+            result.batches += 1
+        _set_state(cursor, 'pushed', last)
+        # Pushed entries are not needed again
+        cursor.execute("DELETE FROM sync_log WHERE change_id <= ?", (last,))
+        engine.conn.commit()
+        if progress:
+            progress(result)
+
+    while True:
+        since = int(_state(cursor, 'pulled', 0))
+        payload, last, count = hub.pull(me, since)
+        if last == since:
+            break
+        if payload:
+            _, conflicts = apply_changes(engine, payload, state={'pulled': last})
+            result.pulled += count
+            result.conflicts += conflicts
+            result.received += len(payload)
+            result.batches += 1
+        else:
+            _set_state(cursor, 'pulled', last)
+            engine.conn.commit()
+        if progress:
+            progress(result)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--db", default=DB_PATH,
+                        help="branch database (default: $MEDICAL_STORE_DB or medical_store.db)")
+    parser.add_argument("--hub", required=True, help="head office database")
+    args = parser.parse_args()
+
+    engine = StoreEngine(args.db)
+    hub = SyncHub(args.hub)
+    try:
+        if hub.node == node_id(engine):
+            raise StoreError("A database cannot sync with itself!")
+        print(sync(engine, hub).summary())
+    except StoreError as e:
+        parser.exit(1, f"{e}\n")
+    finally:
+        hub.close()
+        engine.close()
+
+
+if __name__ == "__main__":
+    main()
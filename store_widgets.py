@@ -0,0 +1,284 @@
+import collections
+import tkinter as tk
+from tkinter import scrolledtext, ttk
+
+from store_bill import RECEIPT_HEADER, RULE, TOTAL_LABEL, format_paise, receipt_line
+from store_engine import PAGE_SIZE, SUGGESTION_LIMIT
+
+
+class VirtualTable(tk.Frame):
+    """Treeview that keeps only a sliding window of rows loaded.
+
+    Rows are pulled from a keyset-paginated fetch function as the user
+    scrolls, so the number of live Tk items stays bounded by max_pages
+    pages whatever the size of the underlying table.
+
+    fetch(after=None, before=None, limit=...) must return rows in display
+    order; key(row) returns the tuple the fetch function paginates on.
+    """
+
+    def __init__(self, parent, columns, fetch, key, page_size=PAGE_SIZE,
+                 max_pages=3, height=15, column_width=100, **kwargs):
+        super().__init__(parent, bg='white', **kwargs)
+        self.fetch = fetch
+        self.key = key
+        self.page_size = page_size
+        self.max_rows = page_size * max_pages
+
+        self.tree = ttk.Treeview(self, columns=columns, show='headings', height=height)
+        for col in columns:
+            self.tree.heading(col, text=col)
+            self.tree.column(col, width=column_width)
+
+        self.scrollbar = ttk.Scrollbar(self, orient="vertical", command=self.tree.yview)
+        self.tree.configure(yscrollcommand=self._on_scroll)
+
+        self.tree.pack(side='left', fill='both', expand=True)
+        self.scrollbar.pack(side='right', fill='y')
+
+        # (item id, key) for each loaded row, top to bottom
+        self.rows = collections.deque()
+        self.at_start = True
+        self.at_end = True
+        self._pending = None
+
+    def reload(self, fetch=None, rows=None):
+        """Drop every loaded row and show the first page again.
+
+        rows may carry a first page already fetched elsewhere (e.g. on a
+        background worker); otherwise it is fetched here.
+        """
+        if fetch is not None:
+            self.fetch = fetch
+        self.tree.delete(*self.tree.get_children())
+        self.rows.clear()
+
+        if rows is None:
+            rows = self.fetch(limit=self.page_size)
+        for row in rows:
+            self.rows.append((self.tree.insert("", "end", values=row), self.key(row)))
+        self.at_start = True
+        self.at_end = len(rows) < self.page_size
+        self.tree.yview_moveto(0)
+
+    def destroy(self):
+        """Cancel any scheduled page load before the widget goes away"""
+        if self._pending is not None:
+            self.after_cancel(self._pending)
+            self._pending = None
+        super().destroy()
+
+    def _on_scroll(self, first, last):
+        """Mirror the view on the scrollbar and load pages at either edge"""
+        self.scrollbar.set(first, last)
+        if self._pending is not None or not self.rows:
+            return
+        if float(last) >= 1.0 and not self.at_end:
+            self._pending = self.after_idle(self._load_next)
+        elif float(first) <= 0.0 and not self.at_start:
+            self._pending = self.after_idle(self._load_previous)
+
+    def _load_next(self):
+        """Append the page after the last loaded row, trimming from the top"""
+        self._pending = None
+        anchor = self.rows[-1][0]
+        rows = self.fetch(after=self.rows[-1][1], limit=self.page_size)
+        self.at_end = len(rows) < self.page_size
+
+        for row in rows:
+            self.rows.append((self.tree.insert("", "end", values=row), self.key(row)))
+
+        while len(self.rows) > self.max_rows:
+            self.tree.delete(self.rows.popleft()[0])
+            self.at_start = False
+
+        self.tree.see(anchor)
+
+    def _load_previous(self):
+        """Prepend the page before the first loaded row, trimming from the bottom"""
+        self._pending = None
+        anchor = self.rows[0][0]
+        rows = self.fetch(before=self.rows[0][1], limit=self.page_size)
+        self.at_start = len(rows) < self.page_size
+
+        for row in reversed(rows):
+            self.rows.appendleft((self.tree.insert("", 0, values=row), self.key(row)))
+
+        while len(self.rows) > self.max_rows:
+            self.tree.delete(self.rows.pop()[0])
+            self.at_end = False
+
+        self.tree.see(anchor)
+
+
+class MedicinePicker(tk.Frame):
+    """Type-ahead medicine selector.
+
+    Typing runs search(term) after a short debounce and lists at most limit
+    matches; pressing Enter on a code runs lookup(code) so barcode scanners
+    and typed med_ids select directly. The chosen medicine row is kept in
+    `selected` rather than parsed back out of the entry text.
+    """
+
+    NAVIGATION_KEYS = {'Up', 'Down', 'Return', 'KP_Enter', 'Escape', 'Tab'}
+
+    def __init__(self, parent, search, lookup, format=None, on_select=None,
+                 limit=SUGGESTION_LIMIT, delay=150, width=30, **kwargs):
+        super().__init__(parent, bg='white', **kwargs)
+        self.search = search
+        self.lookup = lookup
+        self.format = format or (lambda row: f"{row[0]} - {row[1]}")
+        self.on_select = on_select
+        self.limit = limit
+        self.delay = delay
+
+        self.selected = None
+        self.matches = []
+        self._after = None
+
+        self.var = tk.StringVar()
+        self.entry = tk.Entry(self, textvariable=self.var, font=('Arial', 11), width=width)
+        self.entry.pack(fill='x')
+        self.listbox = tk.Listbox(self, font=('Arial', 10), height=min(limit, 8),
+                                  activestyle='dotbox', exportselection=False)
+
+        self.entry.bind("<KeyRelease>", self._on_key)
+        self.entry.bind("<Return>", self._on_return)
+        self.entry.bind("<KP_Enter>", self._on_return)
+        self.entry.bind("<Down>", self._focus_list)
+        self.entry.bind("<Escape>", lambda e: self._hide())
+        self.listbox.bind("<Return>", self._choose_active)
+        self.listbox.bind("<Double-Button-1>", self._choose_active)
+        self.listbox.bind("<Escape>", lambda e: (self._hide(), self.entry.focus_set()))
+
+    def clear(self):
+        """Forget the selection and empty the entry"""
+        self.selected = None
+        self.var.set("")
+        self._hide()
+
+    def destroy(self):
+        """Cancel a pending search before the widget goes away"""
+        if self._after is not None:
+            self.after_cancel(self._after)
+            self._after = None
+        super().destroy()
+
+    def _on_key(self, event):
+        """Debounce a search after each edit"""
+        if event.keysym in self.NAVIGATION_KEYS:
+            return
+        self.selected = None
+        if self._after is not None:
+            self.after_cancel(self._after)
+        self._after = self.after(self.delay, self._run_search)
+
+    def _run_search(self):
+        """Show the top matches for the current text"""
+        self._after = None
+        self.matches = self.search(self.var.get(), self.limit)
+        self.listbox.delete(0, tk.END)
+        for row in self.matches:
+            self.listbox.insert(tk.END, self.format(row))
+        if self.matches:
+            self.listbox.pack(fill='x')
+        else:
+            self._hide()
+
+    def _on_return(self, event=None):
+        """Select by barcode/ID, or take the best suggestion"""
+        if self.selected is not None:
+            return "break"
+        if self._after is not None:
+            self.after_cancel(self._after)
+            self._after = None
+        row = self.lookup(self.var.get())
+        if row is None:
+            if not self.matches:
+                self._run_search()
+            row = self.matches[0] if self.matches else None
+        if row is not None:
+            self._select(row)
+        return "break"
+
+    def _focus_list(self, event=None):
+        """Move keyboard focus into the suggestion list"""
+        if self.matches:
+            self.listbox.focus_set()
+            self.listbox.selection_clear(0, tk.END)
+            self.listbox.selection_set(0)
+            self.listbox.activate(0)
+        return "break"
+
+    def _choose_active(self, event=None):
+        """Select the highlighted suggestion"""
+        index = self.listbox.index(tk.ACTIVE)
+        if 0 <= index < len(self.matches):
+            self._select(self.matches[index])
+        return "break"
+
+    def _select(self, row):
+        """Record the chosen medicine and show it in the entry"""
+        self.selected = row
+        self.var.set(self.format(row))
+        self._hide()
+        self.entry.icursor(tk.END)
+        if self.on_select:
+            self.on_select(row)
+
+    def _hide(self):
+        """Hide the suggestion list"""
+        self.matches = []
+        self.listbox.pack_forget()
+
+
+class BillView(scrolledtext.ScrolledText):
+    """Receipt text for a Bill that redraws only what changes.
+
+    Each line is tagged with its med_id and the total has its own tag, so
+    adding, editing or removing an item rewrites one line and the total
+    instead of rebuilding the whole receipt.
+    """
+
+    def __init__(self, parent, **kwargs):
+        super().__init__(parent, **kwargs)
+        self.clear()
+
+    def clear(self):
+        """Show an empty bill"""
+        self.delete("1.0", tk.END)
+        for tag in self.tag_names():
+            if tag.startswith("line-"):
+                self.tag_delete(tag)
+        self.insert("1.0", RECEIPT_HEADER)
+        footer = self.index("end-1c")
+        self.insert(tk.END, RULE + TOTAL_LABEL)
+        self.insert(tk.END, "0.00", "total")
+        self.insert(tk.END, "\n" + RULE)
+        # Lines are inserted at this mark, which moves past each one
+        self.mark_set("footer", footer)
+
+    def show_line(self, line):
+        """Add or redraw one BillLine"""
+        tag = f"line-{line.med_id}"
+        text = receipt_line(line.name, line.quantity, line.price, line.total)
+        ranges = self.tag_ranges(tag)
+        if ranges:
+            self.delete(*ranges)
+            self.insert(ranges[0], text, tag)
+        else:
+            self.insert("footer", text, tag)
+
+    def remove_line(self, med_id):
+        """Drop the line for med_id"""
+        tag = f"line-{med_id}"
+        ranges = self.tag_ranges(tag)
+        if ranges:
+            self.delete(*ranges)
+        self.tag_delete(tag)
+
+    def show_total(self, paise):
+        """Redraw the total"""
+        start, end = self.tag_ranges("total")
+        self.delete(start, end)
+        self.insert(start, format_paise(paise), "total")
@@ -0,0 +1,158 @@
+"""Simulate several billing terminals and report readers on one database.
+
+Each terminal thread checks out bills through its own pooled connection
+while reader threads run sales reports; the script reports checkout
+throughput, latency and the time terminals spent waiting for the write
+lock:
+
+    python stress_store.py --terminals 8 --readers 4 --duration 10
+
+With --maintenance another thread backs up, checks and vacuums the
+database back to back meanwhile; compare checkout latency with a run
+without it.
+"""
+import argparse
+import datetime
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+
+from store_db import ConnectionPool
+from store_engine import StoreEngine, StoreError
+
+
+def percentile(samples, fraction):
+    """Return the given percentile of samples in milliseconds"""
+    if not samples:
+        return 0.0
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))] * 1000
+
+
+def terminal(pool, medicines, deadline, stats, seed):
+    """Check out small bills until the deadline"""
+    rng = random.Random(seed)
+    engine = StoreEngine(pool.db_path, conn=pool.connection())
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        try:
+            items = [engine.make_bill_item(rng.randint(1, medicines), 1)
+                     for _ in range(rng.randint(1, 5))]
+            engine.generate_bill("Stress", items)
+        except StoreError as e:
+            with stats['lock']:
+                stats['errors'].append(str(e))
+            continue
+        with stats['lock']:
+            stats['checkout'].append(time.perf_counter() - started)
+            stats['lock_wait'].append(engine.last_lock_wait)
+
+
+def reader(pool, deadline, stats, seed):
+    """Run date-range sales reports until the deadline"""
+    rng = random.Random(seed)
+    engine = StoreEngine(pool.db_path, conn=pool.connection())
+    today = datetime.date.today()
+    while time.perf_counter() < deadline:
+        day = today - datetime.timedelta(days=rng.randint(0, 30))
+        started = time.perf_counter()
+        engine.sales_page(day.isoformat(), today.isoformat())
+        engine.sales_total(day.isoformat(), today.isoformat())
+        with stats['lock']:
+            stats['report'].append(time.perf_counter() - started)
+
+
+def maintenance(pool, deadline, stats, directory):
+    """Back up, quick_check and vacuum back to back until the deadline"""
+    engine = StoreEngine(pool.db_path, conn=pool.connection())
+    rounds = 0
+    while time.perf_counter() < deadline:
+        target = os.path.join(directory, f"backup-{rounds}")
+        for name, task in (("backup", lambda: engine.backup(target)),
+                           ("quick_check", engine.check_integrity),
+                           ("vacuum step", engine.vacuum_step)):
+            started = time.perf_counter()
+            try:
+                task()
+            except StoreError as e:
+                with stats['lock']:
+                    stats['errors'].append(str(e))
+                continue
+            with stats['lock']:
+                stats['maintenance'].setdefault(name, []).append(time.perf_counter() - started)
+        shutil.rmtree(target, ignore_errors=True)
+        rounds += 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--terminals", type=int, default=8)
+    parser.add_argument("--readers", type=int, default=4)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--medicines", type=int, default=10_000)
+    parser.add_argument("--db", help="database path (default: temporary file)")
+    parser.add_argument("--journal-mode", default="WAL",
+                        help="journal mode to compare against, e.g. DELETE")
+    parser.add_argument("--maintenance", action="store_true",
+                        help="run backups, integrity checks and vacuum steps alongside")
+    args = parser.parse_args()
+
+    tmpdir = tempfile.TemporaryDirectory()
+    db_path = args.db or os.path.join(tmpdir.name, "stress_store.db")
+
+    pool = ConnectionPool(db_path, journal_mode=args.journal_mode)
+    setup = StoreEngine(db_path, conn=pool.connection())
+    setup.cursor.executemany('''
+        INSERT INTO medicines (name, company, category, purchase_price,
+                             sale_price, quantity, expiry_date)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', ((f"Medicine {i:06d}", "Stress Pharma", "Tablet", 1.0, 2.0, 1_000_000, "2030-12-31")
+          for i in range(args.medicines)))
+    setup.cursor.execute('''
+        INSERT INTO batches (med_id, expiry_date, quantity)
+        SELECT med_id, expiry_date, quantity FROM medicines
+    ''')
+    setup.cursor.execute('''
+        INSERT INTO stock_ledger (med_id, kind, quantity, recorded_at)
+        SELECT med_id, 'opening', quantity, datetime('now', 'localtime') FROM medicines
+    ''')
+    setup.conn.commit()
+
+    stats = {'lock': threading.Lock(), 'checkout': [], 'lock_wait': [], 'report': [], 'errors': [],
+             'maintenance': {}}
+    deadline = time.perf_counter() + args.duration
+    threads = [threading.Thread(target=terminal, args=(pool, args.medicines, deadline, stats, i))
+               for i in range(args.terminals)]
+    threads += [threading.Thread(target=reader, args=(pool, deadline, stats, 1000 + i))
+                for i in range(args.readers)]
+    if args.maintenance:
+        threads.append(threading.Thread(target=maintenance, args=(pool, deadline, stats, tmpdir.name)))
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    checkouts = stats['checkout']
+    print(f"journal_mode={args.journal_mode} terminals={args.terminals} readers={args.readers}")
+    print(f"checkouts      {len(checkouts) / args.duration:>9.1f} bills/s   "
+          f"p50 {percentile(checkouts, 0.5):>8.2f} ms   p99 {percentile(checkouts, 0.99):>8.2f} ms")
+    print(f"lock wait      {sum(stats['lock_wait']):>9.2f} s total   "
+          f"p50 {percentile(stats['lock_wait'], 0.5):>8.2f} ms   "
+          f"p99 {percentile(stats['lock_wait'], 0.99):>8.2f} ms")
+    print(f"reports        {len(stats['report']) / args.duration:>9.1f} queries/s "
+          f"p50 {percentile(stats['report'], 0.5):>8.2f} ms   p99 {percentile(stats['report'], 0.99):>8.2f} ms")
+    for name, samples in stats['maintenance'].items():
+        print(f"{name:<14} {len(samples):>9} runs      "
+              f"p50 {percentile(samples, 0.5):>8.2f} ms   p99 {percentile(samples, 0.99):>8.2f} ms")
+    print(f"errors         {len(stats['errors'])}"
+          + (f" (first: {stats['errors'][0]})" if stats['errors'] else ""))
+
+    pool.close_all()
+    tmpdir.cleanup()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,71 +1,133 @@
+import time
+# Taken before the other imports so --profile-startup can report their cost
+IMPORTS_STARTED = time.perf_counter()
+
 import tkinter as tk
-from tkinter import ttk, messagebox, scrolledtext
-import sqlite3
-import datetime
+from tkinter import messagebox
 import os
-from tkinter import filedialog
+import functools
+import argparse
+# tkinter.filedialog is imported where a dialog opens, keeping it off the startup path
+from store_bill import Bill, format_paise
+from store_engine import DB_PATH, SNAPSHOT_EVENTS, StoreEngine, StoreError
+from store_csv import export_medicines, import_medicines, read_price_list
+from store_executor import QueryExecutor
+from store_maintenance import MaintenanceScheduler
+from store_metrics import METRICS, configure_logs, log_snapshot, serve_metrics, timed
+from store_receipts import render_receipt, spool_receipts
+from store_widgets import BillView, MedicinePicker, VirtualTable
+
+# Milliseconds to wait after a keystroke before searching
+SEARCH_DELAY = 150
+# Milliseconds between checks for lots coming within the expiry alert horizon
+EXPIRY_CHECK_INTERVAL = 6 * 60 * 60 * 1000
+# Milliseconds between metrics snapshots written to the metrics log
+METRICS_LOG_INTERVAL = 15 * 60 * 1000
+# Milliseconds between stock ledger snapshots (taken once SNAPSHOT_EVENTS have built up)
+SNAPSHOT_INTERVAL = 60 * 60 * 1000
+# Milliseconds between checks for closed months of sales to archive, and
+# between archiving passes while a backlog is being moved
+ARCHIVE_INTERVAL = 60 * 60 * 1000
+ARCHIVE_PAUSE = 5 * 1000
+
+class StartupProfile:
+    """Wall-clock time of each startup phase, reported by --profile-startup.
+    
+    mark() ends a foreground phase; everything marked happens before the
+    window is interactive. start() and finish() time work deferred to the
+    background, and on_done is called when the last of it finishes.
+    """
+    
+    def __init__(self, started=None):
+        self.started = self.last = time.perf_counter() if started is None else started
+        self.phases = []
+        self.running = {}  # background phase -> start time
+        self.background = []
+        self.on_done = None
+    
+    def mark(self, phase):
+        now = time.perf_counter()
+        self.phases.append((phase, now - self.last))
+        self.last = now
+    
+    def start(self, phase):
+        self.running[phase] = time.perf_counter()
+    
+    def finish(self, phase):
+        started = self.running.pop(phase, None)
+        if started is None:
+            return
+        self.background.append((phase, time.perf_counter() - started))
+        if not self.running and self.on_done:
+            self.on_done()
+    
+    def report(self) -> str:
+        rows = self.phases + [("time to interactive", self.last - self.started)]
+        rows += [(f"{phase} (background)", seconds) for phase, seconds in self.background]
+        return "\n".join(f"{phase:<32} {seconds * 1000:>8.1f} ms" for phase, seconds in rows)
 
 class MedicalStoreManagement:
-    def __init__(self, root):
+    def __init__(self, root, db_path=DB_PATH, profile=None, backup_dir=None):
         self.root = root
+        self.db_path = db_path
+        self.backup_dir = backup_dir
+        self.profile = profile or StartupProfile()
         self.root.title("Medical Store Management System")
         self.root.geometry("1200x700")
         self.root.configure(bg='#f0f0f0')
         
         # Initialize database
         self.init_db()
+        self.profile.mark("database")
         
-        # Setup UI
+        # Setup UI; each page is built on its first visit and kept
+        self.pages = {}
+        self.page = None
         self.setup_ui()
-        
-        # Load initial data
-        self.load_medicines()
-        self.update_stock_warning()
-        
+        self.profile.mark("window")
+        
+        # Catalog and alerts load once the first page is on screen
+        self.root.after_idle(self.finish_startup)
+        
+    def finish_startup(self):
+        """Start the deferred startup work in the background"""
+        self.root.update_idletasks()
+        self.profile.mark("first draw")
+        self.warm_cache()
+        self.check_expiry_alerts()
+        self.check_stock_ledger()
+        self.root.after(METRICS_LOG_INTERVAL, self.log_metrics)
+        self.root.after(SNAPSHOT_INTERVAL, self.snapshot_stock)
+        self.root.after(ARCHIVE_INTERVAL, self.archive_sales)
+    
+    def log_metrics(self):
+        """Append a metrics snapshot to the metrics log, then reschedule"""
+        log_snapshot()
+        self.root.after(METRICS_LOG_INTERVAL, self.log_metrics)
+    
+    def warm_cache(self):
+        """Load the catalog cache on a worker rather than at the first lookup"""
+        catalog = self.engine.catalog
+        token = catalog.fill_token()
+        
+        def done(records):
+            catalog.fill(token, records)
+            self.profile.finish("catalog warm-up")
+        
+        # On failure the catalog simply loads on its first lookup
+        self.profile.start("catalog warm-up")
+        self.executor.submit(lambda engine: engine.catalog.read_records(), callback=done,
+                             errback=lambda e: self.profile.finish("catalog warm-up"), detached=True)
+    
     def init_db(self):
         """Initialize database and create tables"""
-        self.conn = sqlite3.connect('medical_store.db')
-        self.cursor = self.conn.cursor()
-        
-        # Create medicines table
-        self.cursor.execute('''
-            CREATE TABLE IF NOT EXISTS medicines (
-                med_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT NOT NULL,
-                company TEXT,
-                category TEXT,
-                purchase_price REAL,
-                sale_price REAL,
-                quantity INTEGER,
-                expiry_date TEXT
-            )
-        ''')
-        
-        # Create sales table
-        self.cursor.execute('''
-            CREATE TABLE IF NOT EXISTS sales (
-                sale_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                med_id INTEGER,
-                med_name TEXT,
-                quantity INTEGER,
-                price REAL,
-                total REAL,
-                sale_date TEXT,
-                FOREIGN KEY (med_id) REFERENCES medicines(med_id)
-            )
-        ''')
-        
-        # Create bills table
-        self.cursor.execute('''
-            CREATE TABLE IF NOT EXISTS bills (
-                bill_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                customer_name TEXT,
-                total_amount REAL,
-                bill_date TEXT
-            )
-        ''')
+        self.engine = StoreEngine(self.db_path)
         
-        self.conn.commit()
+        # Long reads run on worker connections and report back via root.after
+        self.executor = QueryExecutor(self.root, self.engine.db_path)
+        # So do integrity checks, backups and vacuum steps, one at a time
+        self.maintenance = MaintenanceScheduler(self.root, self.executor, self.engine.db_path,
+                                                self.backup_dir, on_problem=messagebox.showwarning)
     
     def setup_ui(self):
         """Setup the main user interface"""
@@ -112,27 +174,49 @@ class MedicalStoreManagement:
         # Show default page
         self.show_medicine_management()
     
-    def clear_content(self):
-        """Clear main content area"""
-        for widget in self.main_content.winfo_children():
-            widget.destroy()
+    def open_page(self, name, refresh=None):
+        """Raise the page called name in the main content area.
+        
+        The first time, returns a new empty frame for the caller to build
+        the page in. After that the cached frame is shown again, refresh()
+        brings its data up to date and None is returned.
+        """
+        # Results for the page being left are no longer wanted
+        self.executor.cancel()
+        
+        if self.page is not None:
+            self.pages[self.page].pack_forget()
+        self.page = name
+        page = self.pages.get(name)
+        if page is not None:
+            page.pack(fill='both', expand=True)
+            if refresh:
+                refresh()
+            return None
+        
+        page = self.pages[name] = tk.Frame(self.main_content, bg='white')
+        page.pack(fill='both', expand=True)
+        return page
     
     def show_medicine_management(self):
         """Show medicine management page"""
-        self.clear_content()
+        page = self.open_page('medicine')
+        if page is None:
+            return
         
         # Title
-        title = tk.Label(self.main_content, text="Medicine Management", 
+        title = tk.Label(page, text="Medicine Management", 
                         font=('Arial', 20, 'bold'), bg='white')
         title.pack(pady=10)
         
         # Form frame
-        form_frame = tk.Frame(self.main_content, bg='white')
+        form_frame = tk.Frame(page, bg='white')
         form_frame.pack(pady=10, padx=20, fill='x')
         
         # Form fields
         fields = ["Medicine Name", "Company Name", "Category", 
-                  "Purchase Price", "Sale Price", "Stock Quantity", "Expiry Date (YYYY-MM-DD)"]
+                  "Purchase Price", "Sale Price", "Stock Quantity", "Expiry Date (YYYY-MM-DD)",
+                  "Barcode"]
         self.medicine_entries = {}
         
         for i, field in enumerate(fields):
@@ -143,7 +227,7 @@ class MedicalStoreManagement:
             self.medicine_entries[field] = entry
         
         # Buttons frame
-        btn_frame = tk.Frame(self.main_content, bg='white')
+        btn_frame = tk.Frame(page, bg='white')
         btn_frame.pack(pady=20)
         
         tk.Button(btn_frame, text="Add Medicine", bg='#3498db', fg='white',
@@ -155,29 +239,27 @@ class MedicalStoreManagement:
     
     def show_rate_update(self):
         """Show rate update page"""
-        self.clear_content()
+        page = self.open_page('rate')
+        if page is None:
+            return
         
-        title = tk.Label(self.main_content, text="Update Medicine Rates", 
+        title = tk.Label(page, text="Update Medicine Rates", 
                         font=('Arial', 20, 'bold'), bg='white')
         title.pack(pady=10)
         
         # Rate update frame
-        update_frame = tk.Frame(self.main_content, bg='white')
+        update_frame = tk.Frame(page, bg='white')
         update_frame.pack(pady=10, padx=20)
         
         tk.Label(update_frame, text="Select Medicine:", font=('Arial', 11), 
                 bg='white').grid(row=0, column=0, sticky='w', pady=5, padx=5)
         
-        # Medicine combobox
-        self.rate_med_var = tk.StringVar()
-        self.rate_combobox = ttk.Combobox(update_frame, textvariable=self.rate_med_var, 
-                                         font=('Arial', 11), width=30, state='readonly')
-        self.rate_combobox.grid(row=0, column=1, pady=5, padx=5)
-        
-        # Load medicines for combobox
-        self.cursor.execute("SELECT med_id, name FROM medicines")
-        medicines = self.cursor.fetchall()
-        self.rate_combobox['values'] = [f"{m[0]} - {m[1]}" for m in medicines]
+        # Medicine picker (type a name, or scan a barcode / enter an ID)
+        self.rate_picker = MedicinePicker(
+            update_frame, self.engine.suggest_medicines, self.engine.lookup_medicine,
+            format=lambda m: f"{m[0]} - {m[1]} (₹{m[5]})",
+            on_select=self.show_price_changes)
+        self.rate_picker.grid(row=0, column=1, pady=5, padx=5, sticky='new')
         
         tk.Label(update_frame, text="New Sale Price:", font=('Arial', 11), 
                 bg='white').grid(row=1, column=0, sticky='w', pady=5, padx=5)
@@ -186,50 +268,140 @@ class MedicalStoreManagement:
         
         tk.Button(update_frame, text="Update Rate", bg='#3498db', fg='white',
                  font=('Arial', 11), padx=20, pady=5, command=self.update_rate).grid(row=2, column=1, pady=10)
+        
+        self.price_history_label = tk.Label(update_frame, text="", font=('Arial', 10),
+                                            bg='white', fg='#7f8c8d', justify='left')
+        self.price_history_label.grid(row=3, column=0, columnspan=2, sticky='w', padx=5)
+        
+        # Bulk repricing: a rule or a price list, previewed before it is applied
+        bulk_frame = tk.LabelFrame(page, text="Bulk Repricing", font=('Arial', 11, 'bold'),
+                                   bg='white', padx=10, pady=10)
+        bulk_frame.pack(fill='both', expand=True, padx=20, pady=10)
+        
+        rule_frame = tk.Frame(bulk_frame, bg='white')
+        rule_frame.pack(fill='x')
+        
+        tk.Label(rule_frame, text="Company:", font=('Arial', 11),
+                bg='white').grid(row=0, column=0, sticky='w', padx=5, pady=3)
+        self.reprice_company = tk.Entry(rule_frame, font=('Arial', 11), width=18)
+        self.reprice_company.grid(row=0, column=1, padx=5, pady=3)
+        tk.Label(rule_frame, text="Category:", font=('Arial', 11),
+                bg='white').grid(row=0, column=2, sticky='w', padx=5, pady=3)
+        self.reprice_category = tk.Entry(rule_frame, font=('Arial', 11), width=18)
+        self.reprice_category.grid(row=0, column=3, padx=5, pady=3)
+        
+        self.reprice_mode = tk.StringVar(value='percent')
+        tk.Radiobutton(rule_frame, text="Change sale price by %", variable=self.reprice_mode,
+                      value='percent', bg='white').grid(row=1, column=0, columnspan=2, sticky='w')
+        tk.Radiobutton(rule_frame, text="Margin over purchase price %", variable=self.reprice_mode,
+                      value='margin', bg='white').grid(row=1, column=2, columnspan=2, sticky='w')
+        self.reprice_value = tk.Entry(rule_frame, font=('Arial', 11), width=8)
+        self.reprice_value.grid(row=1, column=4, padx=5)
+        
+        tk.Button(rule_frame, text="Preview", bg='#3498db', fg='white', font=('Arial', 11),
+                 padx=15, command=self.preview_reprice).grid(row=0, column=4, padx=5)
+        tk.Button(rule_frame, text="Load Price List", bg='#9b59b6', fg='white', font=('Arial', 11),
+                 padx=15, command=self.load_price_list).grid(row=0, column=5, padx=5)
+        tk.Button(rule_frame, text="Apply", bg='#2ecc71', fg='white', font=('Arial', 11),
+                 padx=15, command=self.apply_reprice).grid(row=1, column=5, padx=5)
+        
+        self.reprice_label = tk.Label(bulk_frame, text="", font=('Arial', 11), bg='white')
+        self.reprice_label.pack(anchor='w', pady=5)
+        self.reprice_table = VirtualTable(bulk_frame, ("ID", "Name", "Old Price", "New Price"),
+                                          lambda **kwargs: [], key=lambda row: row[0],
+                                          height=8, column_width=150)
+        self.reprice_table.pack(fill='both', expand=True)
+        # Rule arguments of the preview on screen; Apply applies exactly these
+        self.reprice_args = None
     
     def show_stock_management(self):
         """Show stock management page"""
-        self.clear_content()
+        page = self.open_page('stock', refresh=self.refresh_stock)
+        if page is None:
+            return
         
-        title = tk.Label(self.main_content, text="Stock Management", 
+        title = tk.Label(page, text="Stock Management", 
                         font=('Arial', 20, 'bold'), bg='white')
         title.pack(pady=10)
         
-        # Stock treeview
-        stock_frame = tk.Frame(self.main_content, bg='white')
-        stock_frame.pack(fill='both', expand=True, padx=20, pady=10)
-        
+        # Stock table, paged on (quantity, med_id)
         columns = ("ID", "Medicine Name", "Company", "Category", "Quantity", "Expiry Date")
-        self.stock_tree = ttk.Treeview(stock_frame, columns=columns, show='headings', height=15)
-        
-        for col in columns:
-            self.stock_tree.heading(col, text=col)
-            self.stock_tree.column(col, width=100)
-        
-        scrollbar = ttk.Scrollbar(stock_frame, orient="vertical", command=self.stock_tree.yview)
-        self.stock_tree.configure(yscrollcommand=scrollbar.set)
-        
-        self.stock_tree.pack(side='left', fill='both', expand=True)
-        scrollbar.pack(side='right', fill='y')
+        self.stock_table = VirtualTable(page, columns, self.engine.stock_page,
+                                        key=lambda row: (row[4], row[0]), height=8)
+        self.stock_table.pack(fill='both', expand=True, padx=20, pady=10)
         
         # Load stock data
         self.load_stock_data()
         
         # Warning label
-        self.warning_label = tk.Label(self.main_content, text="", font=('Arial', 11), 
+        self.warning_label = tk.Label(page, text="", font=('Arial', 11), 
                                      bg='white', fg='red')
         self.warning_label.pack(pady=5)
+        
+        # Open low-stock and expiry alerts, newest first
+        columns = ("Alert", "Raised", "Type", "Medicine", "Stock", "Details")
+        self.alerts_table = VirtualTable(page, columns, self.engine.alerts_page,
+                                         key=lambda row: (row[0],), height=5)
+        self.alerts_table.pack(fill='both', expand=True, padx=20)
+        self.update_stock_warning()
+        
+        # Receive a new lot
+        receive_frame = tk.LabelFrame(page, text="Receive Stock", font=('Arial', 11, 'bold'),
+                                      bg='white', padx=10, pady=5)
+        receive_frame.pack(fill='x', padx=20, pady=5)
+        
+        self.receive_picker = MedicinePicker(
+            receive_frame, self.engine.suggest_medicines, self.engine.lookup_medicine,
+            on_select=lambda m: self.receive_entries["Quantity"].focus_set(), width=25)
+        self.receive_picker.grid(row=0, column=0, rowspan=2, padx=5, sticky='new')
+        self.receive_entries = {}
+        for i, field in enumerate(["Quantity", "Batch No", "Expiry (YYYY-MM-DD)", "Cost"]):
+            tk.Label(receive_frame, text=field + ":", font=('Arial', 10),
+                    bg='white').grid(row=0, column=i + 1, sticky='w', padx=5)
+            entry = tk.Entry(receive_frame, font=('Arial', 11), width=14)
+            entry.grid(row=1, column=i + 1, padx=5)
+            self.receive_entries[field] = entry
+        tk.Button(receive_frame, text="Receive", bg='#2ecc71', fg='white', font=('Arial', 11),
+                 padx=15, command=self.receive_stock).grid(row=1, column=5, padx=5)
+        tk.Label(receive_frame, text="Reorder Level:", font=('Arial', 10),
+                bg='white').grid(row=0, column=6, sticky='w', padx=5)
+        self.reorder_entry = tk.Entry(receive_frame, font=('Arial', 11), width=8)
+        self.reorder_entry.grid(row=1, column=6, padx=5)
+        tk.Button(receive_frame, text="Set Level", bg='#3498db', fg='white', font=('Arial', 11),
+                 padx=10, command=self.set_reorder_level).grid(row=1, column=7, padx=5)
+        
+        # Lots nearing expiry, earliest (and already expired) first
+        expiry_frame = tk.Frame(page, bg='white')
+        expiry_frame.pack(fill='x', padx=20)
+        tk.Label(expiry_frame, text="Lots expiring within", font=('Arial', 11, 'bold'),
+                bg='white').pack(side='left')
+        self.expiry_days = tk.Entry(expiry_frame, font=('Arial', 11), width=5)
+        self.expiry_days.insert(0, "90")
+        self.expiry_days.pack(side='left', padx=5)
+        tk.Label(expiry_frame, text="days", font=('Arial', 11, 'bold'), bg='white').pack(side='left')
+        tk.Button(expiry_frame, text="Show", bg='#3498db', fg='white', font=('Arial', 10),
+                 padx=10, command=self.load_expiry_data).pack(side='left', padx=10)
+        self.expiry_label = tk.Label(expiry_frame, text="", font=('Arial', 11), bg='white', fg='#e67e22')
+        self.expiry_label.pack(side='left', padx=10)
+        
+        columns = ("Expiry", "Batch ID", "Medicine", "Batch No", "Quantity", "Cost")
+        self.expiry_table = VirtualTable(page, columns, self.engine.near_expiry,
+                                         key=lambda row: (row[0], row[1]), height=6)
+        self.expiry_table.pack(fill='both', expand=True, padx=20, pady=10)
+        self.load_expiry_data()
     
     def show_billing_system(self):
         """Show billing system page"""
-        self.clear_content()
+        page = self.open_page('billing')
+        if page is None:
+            return
         
-        title = tk.Label(self.main_content, text="Billing System", 
+        title = tk.Label(page, text="Billing System", 
                         font=('Arial', 20, 'bold'), bg='white')
         title.pack(pady=10)
         
         # Billing container
-        billing_container = tk.Frame(self.main_content, bg='white')
+        billing_container = tk.Frame(page, bg='white')
         billing_container.pack(fill='both', expand=True, padx=20, pady=10)
         
         # Left frame - Medicine selection
@@ -239,18 +411,26 @@ class MedicalStoreManagement:
         tk.Label(left_frame, text="Select Medicine:", font=('Arial', 11), 
                 bg='white').pack(anchor='w', pady=5)
         
-        self.bill_med_var = tk.StringVar()
-        self.bill_combobox = ttk.Combobox(left_frame, textvariable=self.bill_med_var, 
-                                         font=('Arial', 11), state='readonly')
-        self.bill_combobox.pack(fill='x', pady=5)
+        self.bill_picker = MedicinePicker(
+            left_frame, functools.partial(self.engine.suggest_medicines, in_stock=True),
+            self.engine.lookup_medicine,
+            format=lambda m: f"{m[0]} - {m[1]} (₹{m[5]}, Stock: {m[6]})",
+            on_select=lambda m: self.quantity_entry.focus_set())
+        self.bill_picker.pack(fill='x', pady=5)
         
         tk.Label(left_frame, text="Quantity:", font=('Arial', 11), 
                 bg='white').pack(anchor='w', pady=5)
         self.quantity_entry = tk.Entry(left_frame, font=('Arial', 11))
         self.quantity_entry.pack(fill='x', pady=5)
         
-        tk.Button(left_frame, text="Add to Bill", bg='#3498db', fg='white',
-                 font=('Arial', 11), padx=20, pady=5, command=self.add_to_bill).pack(pady=10)
+        item_buttons = tk.Frame(left_frame, bg='white')
+        item_buttons.pack(pady=10)
+        tk.Button(item_buttons, text="Add to Bill", bg='#3498db', fg='white',
+                 font=('Arial', 11), padx=20, pady=5, command=self.add_to_bill).pack(side='left', padx=5)
+        tk.Button(item_buttons, text="Set Quantity", bg='#f39c12', fg='white',
+                 font=('Arial', 11), padx=20, pady=5, command=self.set_bill_quantity).pack(side='left', padx=5)
+        tk.Button(item_buttons, text="Remove Item", bg='#e74c3c', fg='white',
+                 font=('Arial', 11), padx=20, pady=5, command=self.remove_from_bill).pack(side='left', padx=5)
         
         # Right frame - Bill details
         right_frame = tk.Frame(billing_container, bg='white')
@@ -259,8 +439,7 @@ class MedicalStoreManagement:
         tk.Label(right_frame, text="Bill Details:", font=('Arial', 11, 'bold'), 
                 bg='white').pack(anchor='w', pady=5)
         
-        self.bill_text = scrolledtext.ScrolledText(right_frame, width=40, height=15,
-                                                  font=('Courier', 10))
+        self.bill_text = BillView(right_frame, width=40, height=15, font=('Courier', 10))
         self.bill_text.pack(fill='both', expand=True, pady=5)
         
         # Customer name
@@ -290,22 +469,21 @@ class MedicalStoreManagement:
                  font=('Arial', 11), padx=20, pady=5, command=self.clear_bill).pack(side='left', padx=5)
         
         # Initialize billing variables
-        self.bill_items = []
-        self.total_amount = 0.0
-        
-        # Load medicines for billing
-        self.load_billing_medicines()
+        self.bill = Bill()
+        self.last_bill_id = None
     
     def show_sales_report(self):
         """Show sales report page"""
-        self.clear_content()
+        page = self.open_page('sales', refresh=self.refresh_sales)
+        if page is None:
+            return
         
-        title = tk.Label(self.main_content, text="Sales Report", 
+        title = tk.Label(page, text="Sales Report", 
                         font=('Arial', 20, 'bold'), bg='white')
         title.pack(pady=10)
         
         # Date selection
-        date_frame = tk.Frame(self.main_content, bg='white')
+        date_frame = tk.Frame(page, bg='white')
         date_frame.pack(pady=10)
         
         tk.Label(date_frame, text="From Date (YYYY-MM-DD):", font=('Arial', 11), 
@@ -320,70 +498,63 @@ class MedicalStoreManagement:
         
         tk.Button(date_frame, text="Filter", bg='#3498db', fg='white',
                  font=('Arial', 11), padx=20, pady=5, command=self.filter_sales).pack(side='left', padx=10)
+        tk.Button(date_frame, text="Spool Receipts", bg='#9b59b6', fg='white',
+                 font=('Arial', 11), padx=20, pady=5, command=self.spool_receipts).pack(side='left', padx=5)
+        self.spool_status = tk.Label(page, text="", font=('Arial', 10),
+                                     bg='white', fg='gray')
+        self.spool_status.pack()
         
-        # Sales treeview
-        sales_frame = tk.Frame(self.main_content, bg='white')
-        sales_frame.pack(fill='both', expand=True, padx=20, pady=10)
-        
+        # Sales table, paged newest first on (sale_date, sale_id)
         columns = ("Sale ID", "Medicine", "Quantity", "Price", "Total", "Date")
-        self.sales_tree = ttk.Treeview(sales_frame, columns=columns, show='headings', height=15)
-        
-        for col in columns:
-            self.sales_tree.heading(col, text=col)
-            self.sales_tree.column(col, width=100)
-        
-        scrollbar = ttk.Scrollbar(sales_frame, orient="vertical", command=self.sales_tree.yview)
-        self.sales_tree.configure(yscrollcommand=scrollbar.set)
-        
-        self.sales_tree.pack(side='left', fill='both', expand=True)
-        scrollbar.pack(side='right', fill='y')
-        
-        # Load sales data
-        self.load_sales_data()
+        self.sales_table = VirtualTable(page, columns, self.engine.sales_page,
+                                        key=lambda row: (row[5], row[0]), height=15)
+        self.sales_table.pack(fill='both', expand=True, padx=20, pady=10)
         
         # Total sales label
-        self.sales_total_label = tk.Label(self.main_content, text="", font=('Arial', 12, 'bold'), 
+        self.sales_total_label = tk.Label(page, text="", font=('Arial', 12, 'bold'), 
                                          bg='white', fg='blue')
         self.sales_total_label.pack(pady=5)
+        
+        # Load sales data
+        self.load_sales_data()
     
     def show_medicine_list(self):
         """Show medicine list page"""
-        self.clear_content()
+        page = self.open_page('list', refresh=self.search_medicines)
+        if page is None:
+            return
         
-        title = tk.Label(self.main_content, text="Medicine List", 
+        title = tk.Label(page, text="Medicine List", 
                         font=('Arial', 20, 'bold'), bg='white')
         title.pack(pady=10)
         
         # Search frame
-        search_frame = tk.Frame(self.main_content, bg='white')
+        search_frame = tk.Frame(page, bg='white')
         search_frame.pack(pady=10, padx=20, fill='x')
         
         tk.Label(search_frame, text="Search:", font=('Arial', 11), 
                 bg='white').pack(side='left', padx=5)
         self.search_entry = tk.Entry(search_frame, font=('Arial', 11), width=30)
         self.search_entry.pack(side='left', padx=5)
+        self.search_entry.bind("<KeyRelease>", self.schedule_search)
+        self._search_after = None
         
         tk.Button(search_frame, text="Search", bg='#3498db', fg='white',
                  font=('Arial', 11), padx=20, pady=5, command=self.search_medicines).pack(side='left', padx=5)
         tk.Button(search_frame, text="Export CSV", bg='#2ecc71', fg='white',
                  font=('Arial', 11), padx=20, pady=5, command=self.export_csv).pack(side='left', padx=5)
+        tk.Button(search_frame, text="Import CSV", bg='#9b59b6', fg='white',
+                 font=('Arial', 11), padx=20, pady=5, command=self.import_csv).pack(side='left', padx=5)
+        self.csv_status = tk.Label(search_frame, text="", font=('Arial', 10),
+                                   bg='white', fg='#7f8c8d')
+        self.csv_status.pack(side='left', padx=10)
         
-        # Medicine treeview
-        med_frame = tk.Frame(self.main_content, bg='white')
-        med_frame.pack(fill='both', expand=True, padx=20, pady=10)
-        
+        # Medicine table, paged on (name, med_id)
         columns = ("ID", "Name", "Company", "Category", "Purchase", "Sale", "Stock", "Expiry")
-        self.med_tree = ttk.Treeview(med_frame, columns=columns, show='headings', height=20)
-        
-        for col in columns:
-            self.med_tree.heading(col, text=col)
-            self.med_tree.column(col, width=80)
-        
-        scrollbar = ttk.Scrollbar(med_frame, orient="vertical", command=self.med_tree.yview)
-        self.med_tree.configure(yscrollcommand=scrollbar.set)
-        
-        self.med_tree.pack(side='left', fill='both', expand=True)
-        scrollbar.pack(side='right', fill='y')
+        self.med_table = VirtualTable(page, columns, self.engine.medicine_page,
+                                      key=lambda row: (row[1], row[0]), height=20,
+                                      column_width=80)
+        self.med_table.pack(fill='both', expand=True, padx=20, pady=10)
         
         # Load medicine data
         self.load_medicine_data()
@@ -394,20 +565,18 @@ class MedicalStoreManagement:
         try:
             values = [self.medicine_entries[field].get() for field in 
                      ["Medicine Name", "Company Name", "Category", 
-                      "Purchase Price", "Sale Price", "Stock Quantity", "Expiry Date (YYYY-MM-DD)"]]
+                      "Purchase Price", "Sale Price", "Stock Quantity", "Expiry Date (YYYY-MM-DD)",
+                      "Barcode"]]
             
-            # Validate required fields
-            if not values[0]:
-                messagebox.showerror("Error", "Medicine Name is required!")
-                return
+            name, company, category, purchase, sale, quantity, expiry, barcode = values
             
             # Insert into database
-            self.cursor.execute('''
-                INSERT INTO medicines (name, company, category, purchase_price, 
-                                     sale_price, quantity, expiry_date)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-            ''', values)
-            self.conn.commit()
+            self.engine.add_medicine(
+                name, company, category,
+                float(purchase) if purchase else None,
+                float(sale) if sale else None,
+                int(quantity) if quantity else 0,
+                expiry.strip() or None, barcode.strip())
             
             messagebox.showinfo("Success", "Medicine added successfully!")
             
@@ -415,24 +584,11 @@ class MedicalStoreManagement:
             for entry in self.medicine_entries.values():
                 entry.delete(0, tk.END)
             
-            # Refresh medicine list
-            self.load_medicines()
-            
+        except StoreError as e:
+            messagebox.showerror("Error", str(e))
         except Exception as e:
             messagebox.showerror("Error", f"Failed to add medicine: {str(e)}")
     
-    def load_medicines(self):
-        """Load medicines for comboboxes"""
-        self.cursor.execute("SELECT med_id, name FROM medicines")
-        medicines = self.cursor.fetchall()
-        med_list = [f"{m[0]} - {m[1]}" for m in medicines]
-        
-        # Update comboboxes if they exist
-        if hasattr(self, 'rate_combobox'):
-            self.rate_combobox['values'] = med_list
-        if hasattr(self, 'bill_combobox'):
-            self.bill_combobox['values'] = med_list
-    
     def update_medicine(self):
         """Update selected medicine"""
         # Implementation for update medicine
@@ -446,174 +602,334 @@ class MedicalStoreManagement:
     def update_rate(self):
         """Update medicine sale price"""
         try:
-            med_str = self.rate_med_var.get()
+            medicine = self.rate_picker.selected
             new_price = self.new_price_entry.get()
             
-            if not med_str or not new_price:
+            if not medicine or not new_price:
                 messagebox.showerror("Error", "Please select medicine and enter new price!")
                 return
             
-            med_id = med_str.split(" - ")[0]
-            
-            # Get old price
-            self.cursor.execute("SELECT sale_price FROM medicines WHERE med_id = ?", (med_id,))
-            old_price = self.cursor.fetchone()[0]
+            med_id = medicine[0]
             
-            # Update price
-            self.cursor.execute("UPDATE medicines SET sale_price = ? WHERE med_id = ?", 
-                              (float(new_price), med_id))
-            self.conn.commit()
+            old_price = self.engine.update_rate(med_id, float(new_price))
             
             messagebox.showinfo("Success", 
                               f"Price updated!\nOld Price: ₹{old_price}\nNew Price: ₹{new_price}")
             
             self.new_price_entry.delete(0, tk.END)
+            self.rate_picker.clear()
+            self.price_history_label.config(text="")
             
+        except StoreError as e:
+            messagebox.showerror("Error", str(e))
         except Exception as e:
             messagebox.showerror("Error", f"Failed to update rate: {str(e)}")
     
+    def show_price_changes(self, medicine):
+        """Show a picked medicine's recent price changes"""
+        changes = self.engine.price_changes(medicine[0], limit=3)
+        self.price_history_label.config(text="\n".join(
+            f"{changed_at}: ₹{old} → ₹{new}" + (f" ({reason})" if reason else "")
+            for changed_at, old, new, reason in changes))
+        self.new_price_entry.focus_set()
+    
+    def preview_reprice(self):
+        """Preview the bulk repricing rule entered in the form"""
+        args = {
+            'company': self.reprice_company.get().strip() or None,
+            'category': self.reprice_category.get().strip() or None,
+            self.reprice_mode.get(): self.reprice_value.get().strip(),
+        }
+        if not args[self.reprice_mode.get()]:
+            messagebox.showerror("Error", "Please enter a percentage!")
+            return
+        self.run_reprice_preview(args)
+    
+    def load_price_list(self):
+        """Preview repricing from a CSV of medicine IDs and sale prices"""
+        from tkinter import filedialog
+        filename = filedialog.askopenfilename(
+            filetypes=[("CSV files", "*.csv"), ("All files", "*.*")])
+        if not filename:
+            return
+        try:
+            prices, errors = read_price_list(filename)
+        except (OSError, UnicodeDecodeError) as e:
+            messagebox.showerror("Error", f"Failed to read price list: {str(e)}")
+            return
+        if errors:
+            messagebox.showwarning("Price list", f"{len(errors)} rows skipped\n" + "\n".join(
+                f"Line {line}: {message}" for line, message in errors[:10]))
+        self.run_reprice_preview({'prices': prices})
+    
+    def run_reprice_preview(self, args):
+        """Fetch a repricing preview on a worker and show it"""
+        def show(result):
+            count, rows = result
+            self.reprice_args = args if count else None
+            self.reprice_label.config(
+                text=f"{count} prices will change" + (f" (first {len(rows)} shown)" if count > len(rows) else ""))
+            self.reprice_table.reload(rows=rows)
+        
+        self.executor.cancel(tag='reprice')
+        self.executor.submit(
+            lambda engine: engine.reprice_preview(**args), callback=show, tag='reprice',
+            errback=lambda e: messagebox.showerror("Error", str(e)))
+    
+    def apply_reprice(self):
+        """Apply the previewed repricing after confirmation"""
+        if not self.reprice_args:
+            messagebox.showerror("Error", "Preview a repricing with changes first!")
+            return
+        if not messagebox.askyesno("Confirm", f"{self.reprice_label.cget('text')}. Apply?"):
+            return
+        args, self.reprice_args = self.reprice_args, None
+        
+        def done(changed):
+            self.reprice_label.config(text=f"{changed} prices updated")
+            self.reprice_table.reload(rows=[])
+            if self.page != 'rate':
+                messagebox.showinfo("Success", f"{changed} prices updated")
+        
+        self.executor.submit(
+            lambda engine: engine.reprice(reason="Bulk repricing", **args), callback=done,
+            detached=True, errback=lambda e: messagebox.showerror("Error", str(e)))
+    
+    def receive_stock(self):
+        """Add a new lot for the picked medicine"""
+        medicine = self.receive_picker.selected
+        values = {field: entry.get().strip() for field, entry in self.receive_entries.items()}
+        if not medicine or not values["Quantity"]:
+            messagebox.showerror("Error", "Please select medicine and enter quantity!")
+            return
+        try:
+            self.engine.receive_stock(
+                medicine[0], int(values["Quantity"]),
+                expiry_date=values["Expiry (YYYY-MM-DD)"] or None,
+                batch_no=values["Batch No"] or None,
+                cost=float(values["Cost"]) if values["Cost"] else None)
+        except StoreError as e:
+            messagebox.showerror("Error", str(e))
+            return
+        except ValueError:
+            messagebox.showerror("Error", "Please enter a valid quantity and cost!")
+            return
+        
+        messagebox.showinfo("Success", f"{values['Quantity']} units of {medicine[1]} received!")
+        for entry in self.receive_entries.values():
+            entry.delete(0, tk.END)
+        self.receive_picker.clear()
+        self.load_stock_data()
+        self.load_expiry_data()
+        self.update_stock_warning()
+    
+    def load_expiry_data(self):
+        """Show lots expiring within the chosen number of days"""
+        try:
+            days = int(self.expiry_days.get())
+        except ValueError:
+            messagebox.showerror("Error", "Please enter a number of days!")
+            return
+        self.expiry_table.reload(functools.partial(self.engine.near_expiry, days))
+        lots, units, value, expired = self.engine.expiry_summary(days)
+        self.expiry_label.config(
+            text=f"{lots} lots, {units} units, ₹{value:.2f} at cost ({expired} already expired)")
+    
     def load_stock_data(self):
         """Load stock data into treeview"""
-        # Clear existing items
-        for item in self.stock_tree.get_children():
-            self.stock_tree.delete(item)
+        self.stock_table.reload()
+    
+    def refresh_stock(self):
+        """Bring the cached Stock page up to date when it is shown again"""
+        self.load_stock_data()
+        self.update_stock_warning()
+        self.load_expiry_data()
+    
+    def update_stock_warning(self):
+        """Show open alert counts and refresh the alert list on the Stock page"""
+        # A hidden Stock page is refreshed when it is next shown
+        if self.page != 'stock':
+            return
         
-        self.cursor.execute('''
-            SELECT med_id, name, company, category, quantity, expiry_date 
-            FROM medicines ORDER BY quantity ASC
-        ''')
+        counts = self.engine.alert_counts()
+        parts = []
+        if counts.get('low_stock'):
+            parts.append(f"{counts['low_stock']} medicines below reorder level")
+        if counts.get('expiry'):
+            parts.append(f"{counts['expiry']} lots expiring soon")
+        self.warning_label.config(text="⚠️ " + ", ".join(parts) if parts else "")
+        self.alerts_table.reload()
+    
+    def check_expiry_alerts(self):
+        """Raise alerts for lots the calendar has brought near expiry, then reschedule"""
+        def done(_):
+            self.update_stock_warning()
+            self.profile.finish("expiry alerts")
+        
+        def failed(e):
+            self.profile.finish("expiry alerts")
+            messagebox.showerror("Error", f"Failed to check expiry alerts: {str(e)}")
         
-        for row in self.cursor.fetchall():
-            self.stock_tree.insert("", "end", values=row)
+        self.profile.start("expiry alerts")
+        self.executor.submit(lambda engine: engine.refresh_expiry_alerts(),
+                             callback=done, errback=failed, detached=True)
+        self.root.after(EXPIRY_CHECK_INTERVAL, self.check_expiry_alerts)
     
-    def update_stock_warning(self):
-        """Update low stock warning"""
-        self.cursor.execute("SELECT name FROM medicines WHERE quantity < 10")
-        low_stock = self.cursor.fetchall()
-        
-        if low_stock:
-            warning_text = "⚠️ Low Stock Warning: " + ", ".join([m[0] for m in low_stock])
-            if hasattr(self, 'warning_label'):
-                self.warning_label.config(text=warning_text)
-        elif hasattr(self, 'warning_label'):
-            self.warning_label.config(text="")
-    
-    def load_billing_medicines(self):
-        """Load medicines for billing combobox"""
-        self.cursor.execute("SELECT med_id, name, sale_price, quantity FROM medicines WHERE quantity > 0")
-        medicines = self.cursor.fetchall()
-        med_list = [f"{m[0]} - {m[1]} (₹{m[2]}, Stock: {m[3]})" for m in medicines]
-        
-        if hasattr(self, 'bill_combobox'):
-            self.bill_combobox['values'] = med_list
+    def check_stock_ledger(self):
+        """Compare stock with the stock ledger and offer to reset it from the ledger"""
+        def done(mismatches):
+            self.profile.finish("stock check")
+            if not mismatches:
+                return
+            _, name, quantity, ledger = mismatches[0]
+            if messagebox.askyesno(
+                    "Stock Mismatch",
+                    f"Stock for {len(mismatches)} medicines differs from the stock ledger "
+                    f"(e.g. {name}: {quantity} in stock, {ledger} in the ledger).\n\n"
+                    f"Reset stock from the ledger?"):
+                self.executor.submit(
+                    lambda engine: engine.rebuild_stock(), callback=lambda _: self.update_stock_warning(),
+                    detached=True, errback=lambda e: messagebox.showerror("Error", str(e)))
+        
+        def failed(e):
+            self.profile.finish("stock check")
+            messagebox.showerror("Error", f"Failed to check stock: {str(e)}")
+        
+        self.profile.start("stock check")
+        self.executor.submit(lambda engine: engine.check_stock(), callback=done, errback=failed,
+                             detached=True)
+    
+    def snapshot_stock(self):
+        """Fold recent stock ledger events into a snapshot if enough have built up, then reschedule"""
+        # A failed snapshot is simply retried at the next interval
+        self.executor.submit(lambda engine: engine.snapshot_stock(min_events=SNAPSHOT_EVENTS), detached=True)
+        self.root.after(SNAPSHOT_INTERVAL, self.snapshot_stock)
     
+    def archive_sales(self):
+        """Move a batch of old sales to the yearly archives, then reschedule"""
+        def done(moved):
+            self.root.after(ARCHIVE_PAUSE if moved else ARCHIVE_INTERVAL, self.archive_sales)
+        
+        # A failed pass is simply retried at the next interval
+        self.executor.submit(lambda engine: engine.archive_sales(), callback=done,
+                             errback=lambda e: self.root.after(ARCHIVE_INTERVAL, self.archive_sales),
+                             detached=True)
+    
+    def set_reorder_level(self):
+        """Set the picked medicine's reorder level"""
+        medicine = self.receive_picker.selected
+        if not medicine or not self.reorder_entry.get().strip():
+            messagebox.showerror("Error", "Please select medicine and enter reorder level!")
+            return
+        try:
+            self.engine.set_reorder_level(medicine[0], int(self.reorder_entry.get()))
+        except StoreError as e:
+            messagebox.showerror("Error", str(e))
+            return
+        except ValueError:
+            messagebox.showerror("Error", "Please enter a valid reorder level!")
+            return
+        
+        messagebox.showinfo("Success", f"Reorder level for {medicine[1]} updated!")
+        self.reorder_entry.delete(0, tk.END)
+        self.update_stock_warning()
+    
+    @timed("add_to_bill")
     def add_to_bill(self):
         """Add selected medicine to bill"""
         try:
-            med_str = self.bill_med_var.get()
+            medicine = self.bill_picker.selected
             quantity = self.quantity_entry.get()
             
-            if not med_str or not quantity:
+            if not medicine or not quantity:
                 messagebox.showerror("Error", "Please select medicine and enter quantity!")
                 return
             
-            med_id = med_str.split(" - ")[0]
+            med_id = medicine[0]
             quantity = int(quantity)
             
-            # Check stock availability
-            self.cursor.execute("SELECT name, sale_price, quantity FROM medicines WHERE med_id = ?", (med_id,))
-            med_data = self.cursor.fetchone()
-            
-            if not med_data:
-                messagebox.showerror("Error", "Medicine not found!")
-                return
-            
-            if quantity > med_data[2]:
-                messagebox.showerror("Error", f"Insufficient stock! Available: {med_data[2]}")
-                return
-            
-            # Calculate total
-            total = med_data[1] * quantity
-            
-            # Add to bill items
-            self.bill_items.append({
-                'med_id': med_id,
-                'name': med_data[0],
-                'price': med_data[1],
-                'quantity': quantity,
-                'total': total
-            })
+            # Check stock for everything of this medicine on the bill, then merge
+            item = self.engine.make_bill_item(med_id, self.bill.quantity_of(med_id) + quantity)
+            if not self.bill:
+                # Starting a new bill: drop the last receipt
+                self.bill_text.clear()
+            line = self.bill.add(med_id, item['name'], item['price'], quantity)
             
             # Update bill display
-            self.update_bill_display()
+            self.update_bill_display(line)
             
             # Clear inputs
             self.quantity_entry.delete(0, tk.END)
+            self.bill_picker.clear()
+            self.bill_picker.entry.focus_set()
             
         except ValueError:
             messagebox.showerror("Error", "Please enter a valid quantity!")
+        except StoreError as e:
+            messagebox.showerror("Error", str(e))
         except Exception as e:
             messagebox.showerror("Error", f"Failed to add to bill: {str(e)}")
     
-    def update_bill_display(self):
-        """Update the bill display text"""
-        self.bill_text.delete(1.0, tk.END)
-        
-        bill_text = "=" * 40 + "\n"
-        bill_text += "MEDICAL STORE BILL\n"
-        bill_text += "=" * 40 + "\n"
-        bill_text += f"{'Item':<20} {'Qty':<6} {'Price':<8} {'Total':<8}\n"
-        bill_text += "-" * 40 + "\n"
-        
-        self.total_amount = 0
-        
-        for item in self.bill_items:
-            bill_text += f"{item['name'][:20]:<20} {item['quantity']:<6} "
-            bill_text += f"₹{item['price']:<7} ₹{item['total']:<7}\n"
-            self.total_amount += item['total']
-        
-        bill_text += "=" * 40 + "\n"
-        bill_text += f"{'TOTAL AMOUNT:':<32} ₹{self.total_amount:.2f}\n"
-        bill_text += "=" * 40 + "\n"
+    def set_bill_quantity(self):
+        """Change the quantity of the selected medicine's bill line"""
+        try:
+            medicine = self.bill_picker.selected
+            if not medicine or medicine[0] not in self.bill.lines:
+                messagebox.showerror("Error", "Please select a medicine that is on the bill!")
+                return
+            
+            med_id = medicine[0]
+            quantity = int(self.quantity_entry.get())
+            if quantity > 0:
+                self.engine.make_bill_item(med_id, quantity)
+            line = self.bill.set_quantity(med_id, quantity)
+            self.update_bill_display(line, removed=quantity <= 0)
+            
+            self.quantity_entry.delete(0, tk.END)
+            self.bill_picker.clear()
+            self.bill_picker.entry.focus_set()
+            
+        except ValueError:
+            messagebox.showerror("Error", "Please enter a valid quantity!")
+        except StoreError as e:
+            messagebox.showerror("Error", str(e))
+    
+    def remove_from_bill(self):
+        """Take the selected medicine off the bill"""
+        medicine = self.bill_picker.selected
+        if not medicine or medicine[0] not in self.bill.lines:
+            messagebox.showerror("Error", "Please select a medicine that is on the bill!")
+            return
         
-        self.bill_text.insert(1.0, bill_text)
-        self.total_label.config(text=f"₹{self.total_amount:.2f}")
+        self.update_bill_display(self.bill.remove(medicine[0]), removed=True)
+        self.bill_picker.clear()
+        self.bill_picker.entry.focus_set()
+    
+    def update_bill_display(self, line, removed=False):
+        """Redraw one changed bill line and the total"""
+        if removed:
+            self.bill_text.remove_line(line.med_id)
+        else:
+            self.bill_text.show_line(line)
+        self.bill_text.show_total(self.bill.total)
+        self.total_label.config(text=f"₹{format_paise(self.bill.total)}")
     
+    @timed("generate_bill")
     def generate_bill(self):
         """Generate and save bill"""
-        if not self.bill_items:
+        if not self.bill:
             messagebox.showerror("Error", "No items in the bill!")
             return
         
         try:
             customer_name = self.customer_entry.get() or "Walk-in Customer"
-            current_date = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            
-            # Save bill to database
-            self.cursor.execute('''
-                INSERT INTO bills (customer_name, total_amount, bill_date)
-                VALUES (?, ?, ?)
-            ''', (customer_name, self.total_amount, current_date))
-            
-            bill_id = self.cursor.lastrowid
             
-            # Save bill items and update stock
-            for item in self.bill_items:
-                # Save sale record
-                self.cursor.execute('''
-                    INSERT INTO sales (med_id, med_name, quantity, price, total, sale_date)
-                    VALUES (?, ?, ?, ?, ?, ?)
-                ''', (item['med_id'], item['name'], item['quantity'], 
-                     item['price'], item['total'], current_date))
-                
-                # Update stock
-                self.cursor.execute('''
-                    UPDATE medicines 
-                    SET quantity = quantity - ? 
-                    WHERE med_id = ?
-                ''', (item['quantity'], item['med_id']))
-            
-            self.conn.commit()
+            # Save bill, sale records and stock updates
+            bill_id, current_date = self.engine.generate_bill(customer_name, self.bill.items())
+            self.maintenance.checkout(self.engine.last_checkout)
+            # The receipt stays on screen; Print Bill renders it again from the database
+            self.bill.clear()
+            self.last_bill_id = bill_id
             
             # Update bill display with bill ID
             self.bill_text.insert(tk.END, f"\nBill ID: {bill_id}\n")
@@ -623,26 +939,32 @@ class MedicalStoreManagement:
             messagebox.showinfo("Success", f"Bill generated successfully!\nBill ID: {bill_id}")
             
             # Refresh data
-            self.load_billing_medicines()
             self.update_stock_warning()
             
+        except StoreError as e:
+            messagebox.showerror("Error", str(e))
         except Exception as e:
             messagebox.showerror("Error", f"Failed to generate bill: {str(e)}")
     
     def print_bill(self):
-        """Print bill to file"""
+        """Save the last generated bill as a text or PDF receipt"""
+        if self.last_bill_id is None:
+            messagebox.showerror("Error", "Generate the bill first!")
+            return
+        
+        from tkinter import filedialog
         try:
-            bill_content = self.bill_text.get(1.0, tk.END)
-            
             filename = filedialog.asksaveasfilename(
                 defaultextension=".txt",
-                filetypes=[("Text files", "*.txt"), ("All files", "*.*")],
-                initialfile=f"bill_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.txt"
+                filetypes=[("Text files", "*.txt"), ("PDF files", "*.pdf"), ("All files", "*.*")],
+                initialfile=f"bill_{self.last_bill_id:08d}.txt"
             )
             
             if filename:
-                with open(filename, 'w') as f:
-                    f.write(bill_content)
+                fmt = 'pdf' if filename.lower().endswith('.pdf') else 'txt'
+                [(bill, lines)] = next(self.engine.iter_bills(bill_ids=[self.last_bill_id]))
+                with open(filename, 'wb') as f:
+                    f.write(render_receipt(bill, lines, fmt))
                 
                 messagebox.showinfo("Success", f"Bill saved to {filename}")
         
@@ -651,112 +973,115 @@ class MedicalStoreManagement:
     
     def clear_bill(self):
         """Clear current bill"""
-        self.bill_items = []
-        self.total_amount = 0
-        self.bill_text.delete(1.0, tk.END)
+        self.bill.clear()
+        self.last_bill_id = None
+        self.bill_text.clear()
         self.total_label.config(text="₹0.00")
         self.customer_entry.delete(0, tk.END)
     
     def load_sales_data(self):
         """Load sales data into treeview"""
-        # Clear existing items
-        for item in self.sales_tree.get_children():
-            self.sales_tree.delete(item)
-        
-        self.cursor.execute('''
-            SELECT sale_id, med_name, quantity, price, total, sale_date 
-            FROM sales ORDER BY sale_date DESC LIMIT 100
-        ''')
-        
-        total_sales = 0
-        
-        for row in self.cursor.fetchall():
-            self.sales_tree.insert("", "end", values=row)
-            total_sales += row[4]
-        
-        if hasattr(self, 'sales_total_label'):
-            self.sales_total_label.config(text=f"Total Sales: ₹{total_sales:.2f}")
+        self.query_sales(None, None, "Total Sales")
+    
+    def refresh_sales(self):
+        """Reload the cached Sales Report page for the dates still entered"""
+        if self.from_date.get() or self.to_date.get():
+            self.filter_sales()
+        else:
+            self.load_sales_data()
     
+    @timed("filter_sales")
     def filter_sales(self):
         """Filter sales by date range"""
         from_date = self.from_date.get()
         to_date = self.to_date.get()
         
-        query = "SELECT sale_id, med_name, quantity, price, total, sale_date FROM sales WHERE 1=1"
-        params = []
-        
-        if from_date:
-            query += " AND DATE(sale_date) >= ?"
-            params.append(from_date)
-        
-        if to_date:
-            query += " AND DATE(sale_date) <= ?"
-            params.append(to_date)
-        
-        query += " ORDER BY sale_date DESC"
-        
-        # Clear existing items
-        for item in self.sales_tree.get_children():
-            self.sales_tree.delete(item)
-        
-        self.cursor.execute(query, params)
-        
-        total_sales = 0
-        
-        for row in self.cursor.fetchall():
-            self.sales_tree.insert("", "end", values=row)
-            total_sales += row[4]
-        
-        if hasattr(self, 'sales_total_label'):
-            self.sales_total_label.config(text=f"Total Filtered Sales: ₹{total_sales:.2f}")
+        self.query_sales(from_date, to_date, "Total Filtered Sales")
+    
+    def query_sales(self, from_date, to_date, label):
+        """Fetch the first sales page and totals on a worker, then display them"""
+        def fetch(engine):
+            return (engine.sales_page(from_date, to_date),
+                    engine.sales_summary(from_date, to_date),
+                    engine.top_sellers(from_date, to_date, limit=3))
+        
+        def show(result):
+            # From the click to the results on screen, worker time included
+            METRICS.observe_handler("sales_report_loaded", time.perf_counter() - started)
+            rows, (quantity, total_sales, cost, margin), top = result
+            self.sales_table.reload(functools.partial(self.engine.sales_page, from_date, to_date),
+                                    rows=rows)
+            text = f"{label}: ₹{total_sales:.2f}   Margin: ₹{margin:.2f}   Units: {quantity}"
+            if top:
+                text += "\nTop sellers: " + ", ".join(f"{t[1]} (₹{t[3]:.2f})" for t in top)
+            self.sales_total_label.config(text=text)
+        
+        self.executor.cancel(tag='sales')
+        self.sales_total_label.config(text="Loading...")
+        started = time.perf_counter()
+        self.executor.submit(fetch, callback=show, tag='sales',
+                             errback=lambda e: messagebox.showerror("Error", f"Failed to load sales: {e}"))
+    
+    def spool_receipts(self):
+        """Write receipts for every bill in the date range to a zip of text or PDF files"""
+        from tkinter import filedialog
+        from_date = self.from_date.get() or None
+        to_date = self.to_date.get() or None
+        filename = filedialog.asksaveasfilename(
+            defaultextension=".zip",
+            filetypes=[("Zip files", "*.zip"), ("All files", "*.*")],
+            initialfile=f"receipts_{from_date or 'all'}_{to_date or 'all'}.zip"
+        )
+        if not filename:
+            return
+        fmt = messagebox.askquestion("Receipt format", "Save receipts as PDF?\n(No saves text files)")
+        fmt = 'pdf' if fmt == 'yes' else 'txt'
+        
+        def spool(engine):
+            return spool_receipts(engine, filename, from_date, to_date, fmt=fmt,
+                                  progress=lambda n: self.executor.call_soon(
+                                      self.show_spool_status, f"Rendered {n:,} receipts..."))
+        
+        def done(count):
+            self.show_spool_status("")
+            messagebox.showinfo("Success", f"{count:,} receipts saved to {filename}")
+        
+        # Detached: leaving the report page must not abort a half-written archive
+        self.executor.submit(
+            spool, callback=done, detached=True,
+            errback=lambda e: messagebox.showerror("Error", f"Failed to spool receipts: {str(e)}"))
+    
+    def show_spool_status(self, text):
+        """Show spool progress if the sales report is still open"""
+        status = getattr(self, 'spool_status', None)
+        if status is not None and status.winfo_exists():
+            status.config(text=text)
     
     def load_medicine_data(self):
         """Load medicine data into treeview"""
-        # Clear existing items
-        if hasattr(self, 'med_tree'):
-            for item in self.med_tree.get_children():
-                self.med_tree.delete(item)
-        
-        self.cursor.execute('''
-            SELECT med_id, name, company, category, purchase_price, 
-                   sale_price, quantity, expiry_date 
-            FROM medicines ORDER BY name
-        ''')
-        
-        for row in self.cursor.fetchall():
-            if hasattr(self, 'med_tree'):
-                self.med_tree.insert("", "end", values=row)
+        if hasattr(self, 'med_table'):
+            self.med_table.reload(self.engine.medicine_page)
+    
+    def schedule_search(self, event=None):
+        """Search as the user types, once typing pauses"""
+        if self._search_after is not None:
+            self.search_entry.after_cancel(self._search_after)
+        self._search_after = self.search_entry.after(SEARCH_DELAY, self.search_medicines)
     
     def search_medicines(self):
-        """Search medicines by name or category"""
-        search_term = self.search_entry.get()
-        
-        if hasattr(self, 'med_tree'):
-            for item in self.med_tree.get_children():
-                self.med_tree.delete(item)
-        
-        if search_term:
-            query = '''
-                SELECT med_id, name, company, category, purchase_price, 
-                       sale_price, quantity, expiry_date 
-                FROM medicines 
-                WHERE name LIKE ? OR category LIKE ?
-                ORDER BY name
-            '''
-            self.cursor.execute(query, (f"%{search_term}%", f"%{search_term}%"))
-        else:
-            self.cursor.execute('''
-                SELECT med_id, name, company, category, purchase_price, 
-                       sale_price, quantity, expiry_date 
-                FROM medicines ORDER BY name
-            ''')
+        """Search medicines by name, company or category"""
+        self._search_after = None
+        if not self.search_entry.winfo_exists():
+            return
         
-        for row in self.cursor.fetchall():
-            if hasattr(self, 'med_tree'):
-                self.med_tree.insert("", "end", values=row)
+        search_term = self.search_entry.get().strip()
+        
+        if hasattr(self, 'med_table'):
+            self.med_table.reload(functools.partial(self.engine.medicine_page, search_term))
     
     def export_csv(self):
         """Export medicine list to CSV"""
+        from tkinter import filedialog
         try:
             filename = filedialog.asksaveasfilename(
                 defaultextension=".csv",
@@ -765,38 +1090,103 @@ class MedicalStoreManagement:
             )
             
             if filename:
-                self.cursor.execute('''
-                    SELECT name, company, category, purchase_price, 
-                           sale_price, quantity, expiry_date 
-                    FROM medicines ORDER BY name
-                ''')
+                def export(engine):
+                    return export_medicines(engine, filename, progress=lambda n: self.executor.call_soon(
+                        self.show_csv_status, f"Exported {n:,} rows..."))
                 
-                with open(filename, 'w') as f:
-                    # Write header
-                    f.write("Name,Company,Category,Purchase Price,Sale Price,Quantity,Expiry Date\n")
-                    
-                    # Write data
-                    for row in self.cursor.fetchall():
-                        f.write(",".join(str(item) for item in row) + "\n")
+                def done(count):
+                    self.show_csv_status("")
+                    messagebox.showinfo("Success", f"{count:,} medicines exported to {filename}")
                 
-                messagebox.showinfo("Success", f"Data exported to {filename}")
+                self.executor.submit(
+                    export, callback=done, detached=True,
+                    errback=lambda e: messagebox.showerror("Error", f"Failed to export CSV: {str(e)}"))
         
         except Exception as e:
             messagebox.showerror("Error", f"Failed to export CSV: {str(e)}")
     
+    def import_csv(self):
+        """Add or update medicines from a CSV file"""
+        from tkinter import filedialog
+        filename = filedialog.askopenfilename(
+            filetypes=[("CSV files", "*.csv"), ("All files", "*.*")])
+        if not filename:
+            return
+        
+        def load(engine):
+            return import_medicines(engine, filename, progress=lambda n: self.executor.call_soon(
+                self.show_csv_status, f"Imported {n:,} rows..."))
+        
+        def done(result):
+            self.show_csv_status("")
+            if self.page == 'list':
+                self.search_medicines()
+            self.update_stock_warning()
+            if result.errors:
+                messagebox.showwarning("Import finished", result.summary())
+            else:
+                messagebox.showinfo("Success", result.summary())
+        
+        self.executor.submit(
+            load, callback=done, detached=True,
+            errback=lambda e: messagebox.showerror("Error", f"Failed to import CSV: {str(e)}"))
+    
+    def show_csv_status(self, text):
+        """Show export/import progress if the medicine list is still open"""
+        status = getattr(self, 'csv_status', None)
+        if status is not None and status.winfo_exists():
+            status.config(text=text)
+    
     def on_closing(self):
         """Close database connection on exit"""
-        self.conn.close()
+        log_snapshot()
+        self.maintenance.stop()
+        self.executor.shutdown()
+        self.engine.close()
         self.root.destroy()
 
 def main():
+    parser = argparse.ArgumentParser(description="Medical Store Management System")
+    parser.add_argument("--db", default=DB_PATH,
+                        help="database file (default: $MEDICAL_STORE_DB or medical_store.db)")
+    parser.add_argument("--profile-startup", action="store_true",
+                        help="print time-to-interactive by startup phase, then exit")
+    parser.add_argument("--slow-log",
+                        help="slow-query log with query plans (default: <db>_slow.log)")
+    parser.add_argument("--metrics-log",
+                        help="rotating JSON lines of metrics snapshots (default: <db>_metrics.jsonl)")
+    parser.add_argument("--metrics-port", type=int,
+                        help="serve Prometheus metrics at http://127.0.0.1:PORT/metrics")
+    parser.add_argument("--maintenance-log",
+                        help="backups, checks and vacuum runs with their checkout latency "
+                             "(default: <db>_maintenance.log)")
+    parser.add_argument("--backup-dir", help="daily backups (default: <db>_backups)")
+    args = parser.parse_args()
+    
+    base = os.path.splitext(args.db)[0]
+    configure_logs(args.slow_log or base + "_slow.log",
+                   args.metrics_log or base + "_metrics.jsonl",
+                   args.maintenance_log or base + "_maintenance.log")
+    server = serve_metrics(args.metrics_port) if args.metrics_port else None
+    
+    profile = StartupProfile(IMPORTS_STARTED)
+    profile.mark("imports")
     root = tk.Tk()
-    app = MedicalStoreManagement(root)
+    profile.mark("tk init")
+    app = MedicalStoreManagement(root, args.db, profile, args.backup_dir)
+    
+    if args.profile_startup:
+        def report():
+            print(profile.report())
+            app.on_closing()
+        profile.on_done = report
     
     # Handle window closing
     root.protocol("WM_DELETE_WINDOW", app.on_closing)
     
     root.mainloop()
+    if server:
+        server.shutdown()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file